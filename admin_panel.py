@@ -3,8 +3,15 @@ Panel de Administración para REDI7 IA
 Sistema completo de gestión y monitoreo
 """
 
+import json
 import streamlit as st
-from auth import AuthSystem
+from auth import obtener_auth
+from bandeja_telegram import obtener_bandeja_telegram
+from cache_analisis import obtener_vuelos_en_curso
+from cola_analisis import obtener_cola_analisis
+from metricas import obtener_metricas
+from resiliencia import obtener_cortacircuitos
+from telegram_sender import estadisticas_cache_bots, estadisticas_cache_imagenes
 from datetime import datetime, timedelta
 import mysql.connector
 from mysql.connector import Error
@@ -13,10 +20,10 @@ class AdminPanel:
     """Panel administrativo con estadísticas y gestión"""
     
     def __init__(self):
-        self.auth = AuthSystem()
+        self.auth = obtener_auth()
     
     def _get_connection(self):
-        """Obtiene conexión MySQL del auth"""
+        """Obtiene conexión MySQL del pool compartido del auth"""
         return self.auth._get_connection()
     
     def is_admin(self, user_id: int) -> bool:
@@ -185,6 +192,7 @@ class AdminPanel:
             """, (new_plan, user_id))
             conn.commit()
             conn.close()
+            self.auth.invalidar_cache_uso(user_id)
             return {"success": True, "message": f"✅ Plan cambiado a {new_plan}"}
         except Exception as e:
             return {"success": False, "message": f"❌ Error: {str(e)}"}
@@ -227,6 +235,7 @@ class AdminPanel:
             
             conn.commit()
             conn.close()
+            self.auth.invalidar_cache_uso(user_id)
             return {"success": True, "message": "✅ Usuario eliminado"}
         except Exception as e:
             return {"success": False, "message": f"❌ Error: {str(e)}"}
@@ -246,6 +255,89 @@ class AdminPanel:
         conn.close()
         return activity
     
+    def render_rendimiento(self):
+        """Percentiles por etapa, solicitudes más lentas y exportación de métricas"""
+        st.subheader("⏱️ Rendimiento por Etapa")
+        
+        metricas = obtener_metricas()
+        ventanas = {"Últimos 5 min": 300, "Últimos 15 min": 900, "Última hora": 3600, "Todo": None}
+        col_ventana, col_reiniciar = st.columns([3, 1])
+        with col_ventana:
+            ventana = ventanas[st.selectbox("Ventana", list(ventanas), index=1, key="admin_ventana_metricas")]
+        with col_reiniciar:
+            st.write("")
+            if st.button("🔄 Reiniciar métricas"):
+                metricas.reiniciar()
+                st.rerun()
+        
+        resumen = metricas.resumen(ventana)
+        if not resumen:
+            st.info("Aún no hay mediciones en este proceso")
+            return
+        
+        vacio = {"n": 0, "p50_ms": 0.0, "p95_ms": 0.0}
+        completo = resumen.get("analisis.completo", vacio)
+        primer_token = resumen.get("openai.primer_token", vacio)
+        espera = resumen.get("cola.espera", vacio)
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("🧠 Análisis", completo["n"])
+        col2.metric("⏱️ Análisis p50 / p95", f"{completo['p50_ms'] / 1000:.1f}s / {completo['p95_ms'] / 1000:.1f}s")
+        col3.metric("⚡ Primer token p50", f"{primer_token['p50_ms'] / 1000:.2f}s")
+        col4.metric("⏳ Espera en cola p95", f"{espera['p95_ms'] / 1000:.2f}s")
+        
+        st.dataframe(
+            [
+                {
+                    "Etapa": etapa,
+                    "n": datos["n"],
+                    "Errores": datos["errores"],
+                    "p50 ms": datos["p50_ms"],
+                    "p95 ms": datos["p95_ms"],
+                    "p99 ms": datos["p99_ms"],
+                    "Máx ms": datos["max_ms"],
+                    "Media ms": datos["media_ms"]
+                }
+                for etapa, datos in resumen.items()
+            ],
+            width='stretch',
+            hide_index=True
+        )
+        
+        st.markdown("#### 🐢 Solicitudes más lentas")
+        lentas = metricas.lentas()
+        if not lentas:
+            st.caption("Sin análisis completos registrados")
+        for solicitud in lentas:
+            etiquetas = " | ".join(f"{k}: {v}" for k, v in solicitud["etiquetas"].items())
+            hora = datetime.fromtimestamp(solicitud["inicio"]).strftime("%H:%M:%S")
+            with st.expander(f"{'❌' if solicitud['error'] else '✅'} {solicitud['ms'] / 1000:.2f}s · {hora} · {etiquetas}"):
+                st.dataframe(solicitud["etapas"], width='stretch', hide_index=True)
+        
+        st.markdown("#### 🔌 Recursos")
+        st.caption(f"Pool MySQL: {self.auth.pool.estado()}")
+        st.caption(f"Cola de análisis: {obtener_cola_analisis().estadisticas()}")
+        st.caption(f"Cortacircuitos OpenAI: {obtener_cortacircuitos().estadisticas()}")
+        st.caption(f"Análisis compartidos (vuelo único): {obtener_vuelos_en_curso().estadisticas()}")
+        st.caption(f"Bandeja de Telegram: {obtener_bandeja_telegram(self.auth.pool).estadisticas()}")
+        st.caption(f"Caché de bots de Telegram (getMe): {estadisticas_cache_bots()}")
+        st.caption(f"Caché de file_id de capturas de Telegram: {estadisticas_cache_imagenes()}")
+        
+        col_json, col_prom = st.columns(2)
+        with col_json:
+            st.download_button(
+                "⬇️ Exportar JSON",
+                json.dumps(metricas.exportar_json(ventana), ensure_ascii=False, indent=2),
+                file_name="redi7_metricas.json",
+                mime="application/json"
+            )
+        with col_prom:
+            st.download_button(
+                "⬇️ Exportar Prometheus",
+                metricas.exportar_prometheus(),
+                file_name="redi7_metricas.prom",
+                mime="text/plain"
+            )
+    
     def render_admin_page(self):
         """Renderiza la página completa de administración"""
         
@@ -263,10 +355,11 @@ class AdminPanel:
         """, unsafe_allow_html=True)
         
         # Tabs principales
-        tab1, tab2, tab3, tab4 = st.tabs([
+        tab1, tab2, tab3, tab4, tab5 = st.tabs([
             "📊 Dashboard", 
             "👥 Usuarios", 
             "📈 Actividad",
+            "⏱️ Rendimiento",
             "⚙️ Configuración"
         ])
         
@@ -502,8 +595,12 @@ class AdminPanel:
             else:
                 st.info("No hay actividad reciente")
         
-        # TAB 4: CONFIGURACIÓN
+        # TAB 4: RENDIMIENTO
         with tab4:
+            self.render_rendimiento()
+        
+        # TAB 5: CONFIGURACIÓN
+        with tab5:
             st.subheader("⚙️ Configuración del Sistema")
             
             st.markdown("### 🎨 Personalización")
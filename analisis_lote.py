@@ -0,0 +1,355 @@
+"""
+Análisis por lotes de capturas MT5 sin interfaz (pre-cálculo nocturno)
+Recorre DIR_CAPTURAS/<ACTIVO>/<MODO>/..., arma los sets de imágenes según
+temporalidades_config y escribe un JSONL por análisis en DIR_ANALISIS
+
+Uso:
+    python analisis_lote.py
+    python analisis_lote.py --activos XAUUSD NAS100 --por-minuto 30 --concurrencia 5
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from config import (
+    ANALISIS_LOTE_POR_MINUTO,
+    CAPITAL_DEFAULT,
+    DIR_ANALISIS,
+    DIR_CAPTURAS,
+    MAX_CONCURRENCIA_ANALISIS,
+    SALIDA_ESTRUCTURADA
+)
+from procesamiento_imagenes import preparar_imagenes
+from redi7_ai import AsyncREDI7AI, REDI7AI
+from temporalidades_config import get_config_temporalidades
+
+EXTENSIONES_IMAGEN = (".png", ".jpg", ".jpeg", ".webp")
+
+# Temporalidad dentro del nombre: "M15.png", "XAUUSD_M15.png", "20260301-1430 M1.jpg"
+PATRON_TEMPORALIDAD = re.compile(r"(?:^|[_\-\s.])(M1|M5|M15|M30|H1|H4|D1|W1)(?=[_\-\s.]|$)", re.IGNORECASE)
+
+DISPOSITIVOS = ["MOVIL", "PC"]
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━
+# 📂 DESCUBRIMIENTO DE SETS
+# ━━━━━━━━━━━━━━━━━━━━━━
+
+def _temporalidad_archivo(nombre: str) -> Optional[str]:
+    """Devuelve la temporalidad que aparece en el nombre del archivo (o None)"""
+    base = os.path.splitext(nombre)[0]
+    coincidencias = PATRON_TEMPORALIDAD.findall(base)
+    return coincidencias[-1].upper() if coincidencias else None
+
+
+def _prefijo_set(nombre: str) -> str:
+    """Nombre sin la temporalidad: los archivos con el mismo prefijo forman un set"""
+    base = os.path.splitext(nombre)[0]
+    coincidencias = list(PATRON_TEMPORALIDAD.finditer(base))
+    if not coincidencias:
+        return base
+    ultima = coincidencias[-1]
+    return (base[:ultima.start()] + base[ultima.end():]).strip("_- .")
+
+
+def _elegir_configuracion(activo: str, modo: str, disponibles: Dict[str, str]) -> Optional[Dict]:
+    """
+    Elige el dispositivo cuyas temporalidades están todas disponibles (prefiere el set más completo)
+
+    Returns:
+        Dict con dispositivo, temporalidades, detail_levels y archivos en orden, o None
+    """
+    for dispositivo in DISPOSITIVOS:
+        config = get_config_temporalidades(activo, modo, dispositivo)
+        if all(tf in disponibles for tf in config["temporalidades"]):
+            return {
+                "dispositivo": dispositivo,
+                "temporalidades": config["temporalidades"],
+                "detail_levels": config["detail_levels"],
+                "archivos": [disponibles[tf] for tf in config["temporalidades"]]
+            }
+    return None
+
+
+def _firma_archivos(rutas: List[str]) -> str:
+    """Huella barata del set (nombre, tamaño, fecha): si cambia una captura, se re-analiza"""
+    h = hashlib.sha1()
+    for ruta in rutas:
+        info = os.stat(ruta)
+        h.update(f"{os.path.basename(ruta)}|{info.st_size}|{info.st_mtime_ns}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def descubrir_sets(directorio: str, activos: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Busca sets de capturas en <directorio>/<ACTIVO>/<MODO>/...
+
+    Un set son los archivos de una misma carpeta que comparten prefijo y solo se diferencian
+    en la temporalidad del nombre (p. ej. "1430_M15.png" y "1430_M1.png").
+
+    Returns:
+        Lista de sets con id, activo, modo, dispositivo, temporalidades, detail_levels, archivos y firma
+    """
+    sets = []
+    if not os.path.isdir(directorio):
+        return sets
+
+    for activo in sorted(os.listdir(directorio)):
+        ruta_activo = os.path.join(directorio, activo)
+        if not os.path.isdir(ruta_activo) or activo.upper() not in REDI7AI.ACTIVOS_PERMITIDOS:
+            continue
+        if activos and activo.upper() not in activos:
+            continue
+
+        for modo in sorted(os.listdir(ruta_activo)):
+            ruta_modo = os.path.join(ruta_activo, modo)
+            if not os.path.isdir(ruta_modo) or modo.upper() not in REDI7AI.MODOS_OPERATIVA:
+                continue
+
+            for carpeta, _, archivos in sorted(os.walk(ruta_modo)):
+                grupos: Dict[str, Dict[str, str]] = {}
+                for nombre in sorted(archivos):
+                    if not nombre.lower().endswith(EXTENSIONES_IMAGEN):
+                        continue
+                    tf = _temporalidad_archivo(nombre)
+                    if tf:
+                        grupos.setdefault(_prefijo_set(nombre), {})[tf] = os.path.join(carpeta, nombre)
+
+                for prefijo, disponibles in sorted(grupos.items()):
+                    eleccion = _elegir_configuracion(activo, modo, disponibles)
+                    if eleccion is None:
+                        continue
+
+                    relativa = os.path.relpath(carpeta, directorio).replace(os.sep, "/")
+                    try:
+                        eleccion.update({
+                            "id": f"{relativa}/{prefijo}" if prefijo else relativa,
+                            "activo": activo.upper(),
+                            "modo": modo.upper(),
+                            "firma": _firma_archivos(eleccion["archivos"]),
+                            "horario": datetime.fromtimestamp(
+                                max(os.path.getmtime(r) for r in eleccion["archivos"])
+                            ).strftime("%H:%M")
+                        })
+                    except OSError as e:
+                        # Captura borrada o renombrada entre el listado y el stat: el set se omite
+                        print(f"⚠️ Set {relativa}/{prefijo} omitido: {e}")
+                        continue
+                    sets.append(eleccion)
+    return sets
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━
+# ▶️ EJECUCIÓN
+# ━━━━━━━━━━━━━━━━━━━━━━
+
+def cargar_completados(ruta_salida: str) -> set:
+    """Lee el JSONL existente y devuelve los (id, firma) ya analizados sin error"""
+    completados = set()
+    if not os.path.exists(ruta_salida):
+        return completados
+
+    with open(ruta_salida, "r", encoding="utf-8") as f:
+        for linea in f:
+            try:
+                registro = json.loads(linea)
+            except ValueError:
+                # Línea a medias de una ejecución interrumpida
+                continue
+            if not registro.get("error"):
+                completados.add((registro.get("id"), registro.get("firma")))
+    return completados
+
+
+class LimitadorTasa:
+    """Espacia los inicios de llamada para no superar `por_minuto` (compartido entre tareas)"""
+
+    def __init__(self, por_minuto: float):
+        self.intervalo = 60.0 / por_minuto if por_minuto > 0 else 0.0
+        self._siguiente = 0.0
+        self._lock = asyncio.Lock()
+
+    async def esperar(self):
+        async with self._lock:
+            ahora = time.monotonic()
+            espera = self._siguiente - ahora
+            self._siguiente = max(ahora, self._siguiente) + self.intervalo
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+
+async def ejecutar_lote(
+    sets: List[Dict],
+    ruta_salida: str,
+    api_key: str,
+    concurrencia: int,
+    por_minuto: float,
+    capital: float,
+    riesgo_porcentaje: float,
+    gestionar_riesgo: bool = True
+) -> Dict:
+    """
+    Analiza los sets con concurrencia y tasa limitadas, escribiendo cada resultado al terminar
+
+    Returns:
+        Dict con total, exitos, errores y duracion_s
+    """
+    motor = AsyncREDI7AI(api_key=api_key, max_concurrencia=concurrencia)
+    semaforo = asyncio.Semaphore(concurrencia)
+    limitador = LimitadorTasa(por_minuto)
+    total = len(sets)
+    progreso = {"hechos": 0, "exitos": 0, "errores": 0}
+    inicio = time.monotonic()
+
+    os.makedirs(os.path.dirname(os.path.abspath(ruta_salida)), exist_ok=True)
+    salida = open(ruta_salida, "a", encoding="utf-8")
+
+    async def analizar_set(item: Dict):
+        async with semaforo:
+            await limitador.esperar()
+            t0 = time.monotonic()
+            try:
+                datos = []
+                for ruta in item["archivos"]:
+                    with open(ruta, "rb") as f:
+                        datos.append(f.read())
+                # Recorte y recompresión fuera del bucle de eventos
+                preparadas = await asyncio.to_thread(preparar_imagenes, datos, item["detail_levels"])
+
+                resultado = await motor.analizar_con_imagenes_async(
+                    activo=item["activo"],
+                    modo=item["modo"],
+                    capital=capital,
+                    riesgo_porcentaje=riesgo_porcentaje,
+                    horario_actual=item["horario"],
+                    imagenes_base64=preparadas["imagenes_base64"],
+                    mime_types=preparadas["mime_types"],
+                    detail_levels=item["detail_levels"],
+                    dispositivo=item["dispositivo"],
+                    temporalidades=item["temporalidades"],
+                    gestionar_riesgo=gestionar_riesgo,
+                    salida_estructurada=SALIDA_ESTRUCTURADA
+                )
+            except Exception as e:
+                resultado = {"error": True, "mensaje": f"❌ Error en el análisis: {str(e)}"}
+
+        duracion = time.monotonic() - t0
+        registro = {
+            "id": item["id"],
+            "firma": item["firma"],
+            "activo": item["activo"],
+            "modo": item["modo"],
+            "dispositivo": item["dispositivo"],
+            "temporalidades": item["temporalidades"],
+            "archivos": item["archivos"],
+            "procesado": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "duracion_s": round(duracion, 2),
+            "error": bool(resultado.get("error")),
+            "mensaje": resultado.get("mensaje", ""),
+            "senal": resultado.get("senal"),
+            "gestion": resultado.get("gestion"),
+            "analisis": resultado.get("analisis", ""),
+            "tokens_usados": resultado.get("tokens_usados", 0),
+            "desde_cache": resultado.get("desde_cache", False)
+        }
+        # Una línea completa por análisis: si se corta el proceso, lo hecho queda guardado
+        salida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        salida.flush()
+
+        progreso["hechos"] += 1
+        progreso["errores" if registro["error"] else "exitos"] += 1
+        transcurrido = time.monotonic() - inicio
+        restante = transcurrido / progreso["hechos"] * (total - progreso["hechos"])
+        icono = "❌" if registro["error"] else "✅"
+        print(
+            f"[{progreso['hechos']}/{total}] {icono} {item['activo']} {item['modo']} {item['id']} "
+            f"({duracion:.1f}s) | ETA {restante:.0f}s"
+            + (f" | {registro['mensaje']}" if registro["error"] else "")
+        )
+
+    try:
+        await asyncio.gather(*(analizar_set(item) for item in sets))
+    finally:
+        salida.close()
+        await motor.cerrar()
+
+    return {
+        "total": total,
+        "exitos": progreso["exitos"],
+        "errores": progreso["errores"],
+        "duracion_s": round(time.monotonic() - inicio, 1)
+    }
+
+
+def main():
+    """Punto de entrada de la línea de comandos"""
+    parser = argparse.ArgumentParser(description="REDI7 IA - Análisis por lotes de capturas MT5")
+    parser.add_argument("--directorio", default=DIR_CAPTURAS, help="Carpeta raíz de capturas (ACTIVO/MODO/...)")
+    parser.add_argument(
+        "--salida",
+        default=os.path.join(DIR_ANALISIS, "analisis_lote.jsonl"),
+        help="Archivo JSONL de resultados (se reanuda si ya existe)"
+    )
+    parser.add_argument("--activos", nargs="*", help="Limitar a estos activos")
+    parser.add_argument("--concurrencia", type=int, default=MAX_CONCURRENCIA_ANALISIS, help="Análisis simultáneos")
+    parser.add_argument("--por-minuto", type=float, default=ANALISIS_LOTE_POR_MINUTO, help="Máximo de llamadas por minuto")
+    parser.add_argument("--capital", type=float, default=CAPITAL_DEFAULT, help="Capital para la gestión de riesgo")
+    parser.add_argument("--riesgo", type=float, default=1.0, help="Riesgo por operación en %% (1-5)")
+    parser.add_argument("--sin-gestion", action="store_true", help="No calcular gestión de riesgo")
+    parser.add_argument("--listar", action="store_true", help="Solo listar los sets pendientes")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("🧠 REDI7 IA - Análisis por Lotes")
+    print("=" * 60)
+
+    activos = [a.upper() for a in args.activos] if args.activos else None
+    sets = descubrir_sets(args.directorio, activos)
+    completados = cargar_completados(args.salida)
+    pendientes = [s for s in sets if (s["id"], s["firma"]) not in completados]
+
+    print(f"📂 {len(sets)} sets encontrados en '{args.directorio}' | ✅ {len(sets) - len(pendientes)} ya analizados | ⏳ {len(pendientes)} pendientes")
+
+    if args.listar:
+        for item in pendientes:
+            print(f"   • {item['activo']} {item['modo']} {item['dispositivo']} {item['id']} ({', '.join(item['temporalidades'])})")
+        return
+
+    if not pendientes:
+        print("Nada que hacer.")
+        return
+
+    api_key = os.getenv("OPENAI_API_KEY", "")
+    if not api_key:
+        print("⚠️  Configura OPENAI_API_KEY en las variables de entorno")
+        return
+
+    resumen = asyncio.run(ejecutar_lote(
+        pendientes,
+        args.salida,
+        api_key,
+        concurrencia=max(1, args.concurrencia),
+        por_minuto=args.por_minuto,
+        capital=args.capital,
+        riesgo_porcentaje=args.riesgo,
+        gestionar_riesgo=not args.sin_gestion
+    ))
+
+    print("=" * 60)
+    print(
+        f"🏁 {resumen['exitos']}/{resumen['total']} análisis correctos, {resumen['errores']} con error "
+        f"en {resumen['duracion_s']}s → {args.salida}"
+    )
+    if resumen["errores"]:
+        print("   Vuelve a ejecutar el comando para reintentar solo los que fallaron.")
+
+
+if __name__ == "__main__":
+    main()
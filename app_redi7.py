@@ -7,14 +7,17 @@ import streamlit as st
 import os
 from datetime import datetime
 from redi7_ai import REDI7AI
-from config import ACTIVOS_PERMITIDOS
-from auth import AuthSystem
+from config import ACTIVOS_PERMITIDOS, SALIDA_ESTRUCTURADA
+from auth import obtener_auth
 from admin_panel import show_admin_panel
-from telegram_sender import TelegramSender
+from bandeja_telegram import obtener_bandeja_telegram, clave_mensaje, ENVIADO, FALLIDO
 from PIL import Image
 import io
 import base64
 from temporalidades_config import get_config_temporalidades, get_num_imagenes_requeridas, get_detail_levels
+from procesamiento_imagenes import preparar_imagenes
+from cola_analisis import obtener_cola_analisis, COMPLETADO, CANCELADO, EN_COLA
+from metricas import medir, tramo
 
 # Configuración de la página
 st.set_page_config(
@@ -114,9 +117,9 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Inicializar sistema de autenticación
+# Sistema de autenticación compartido por todas las sesiones del proceso
 if 'auth' not in st.session_state:
-    st.session_state.auth = AuthSystem()
+    st.session_state.auth = obtener_auth()
 
 # Inicializar estado de sesión
 if 'logged_in' not in st.session_state:
@@ -428,6 +431,304 @@ Chatea con nosotros en WhatsApp para más información y actualizar tu plan:
     st.caption("📱 +51 960 239 007 | Soporte REDI7 AI")
 
 
+def mostrar_gestion_preliminar(gestion):
+    """Muestra las métricas clave de gestión de riesgo mientras el análisis sigue llegando"""
+    st.info("💰 Niveles detectados: gestión de riesgo calculada")
+    col_g1, col_g2, col_g3, col_g4 = st.columns(4)
+    with col_g1:
+        st.metric("💵 En Riesgo", f"${gestion['riesgo_usd']:,.2f}")
+    with col_g2:
+        st.metric("📊 Lotaje", f"{gestion['lotaje']} lotes")
+    with col_g3:
+        st.metric("🎯 TP1", f"${gestion['ganancia_tp1']:,.2f}", delta=f"R:R {gestion['rr_tp1']}")
+    with col_g4:
+        st.metric("🎯 TP3", f"${gestion['ganancia_tp3']:,.2f}", delta=f"R:R {gestion['rr_tp3']}")
+
+
+@medir("app.encolar_telegram")
+def encolar_senal_telegram(auth, user_id, resultado, id_envio, capturas=None):
+    """
+    Deja la señal en la bandeja de salida; su hilo la entrega al bot del usuario con reintentos
+    
+    Args:
+        id_envio: Identifica el envío (el id del trabajo): repetirlo no duplica la señal
+        capturas: Dict con imagenes_base64 y mime_types para enviarlas como álbum con la
+                  señal de leyenda (None = solo texto)
+    
+    Returns:
+        Dict con exito/mensaje/clave, o None si el usuario no tiene Telegram configurado
+    """
+    telegram_config = auth.obtener_telegram_config(user_id)
+    if not telegram_config['configurado']:
+        return None
+    
+    try:
+        # Extraer análisis principal
+        analisis_text = resultado['analisis']
+        if "📉GESTIÓN DE RIESGO REDI7📉" in analisis_text:
+            analisis_principal = analisis_text.split("📉GESTIÓN DE RIESGO REDI7📉")[0].strip()
+        else:
+            analisis_principal = analisis_text
+        
+        mensaje = f"🚀 SEÑAL REDI7 AI\n\n📊 Activo: {resultado['activo']}\n⚡ Modo: {resultado['modo']}\n\n{analisis_principal}"
+        capturas = capturas or {}
+        return obtener_bandeja_telegram(auth.pool).encolar(
+            clave_mensaje("analisis", id_envio, telegram_config['chat_id']),
+            telegram_config['bot_token'],
+            telegram_config['chat_id'],
+            mensaje,
+            parse_mode=None,
+            user_id=user_id,
+            imagenes_base64=capturas.get("imagenes_base64"),
+            mime_types=capturas.get("mime_types")
+        )
+    except Exception as e:
+        return {"exito": False, "mensaje": f"Error al enviar a Telegram: {str(e)}"}
+
+
+def crear_cierre_analisis(auth, user_id, reserva, activo, modo, temporalidades, auto_telegram,
+                          adjuntar_capturas=False):
+    """
+    Crea el callback de fin de trabajo de la cola
+    
+    Se ejecuta en el hilo del trabajo (sin acceso a st.session_state), así el cupo,
+    el historial y el envío a Telegram se resuelven aunque la sesión ya no esté mirando.
+    """
+    def cerrar(trabajo):
+        if trabajo.estado != COMPLETADO:
+            # El modelo falló o se canceló: devolver el hueco reservado al cupo
+            auth.liberar_reserva(reserva)
+            return
+        
+        resultado = trabajo.resultado
+        
+        # Guardar en historial (el cupo ya está descontado)
+        try:
+            auth.registrar_analisis(
+                user_id,
+                activo,
+                modo,
+                ', '.join(temporalidades) if isinstance(temporalidades, list) else str(temporalidades),
+                resultado['analisis'][:1000],
+                reserva=reserva
+            )
+        except Exception as e:
+            print(f"Error guardando análisis: {e}")
+        
+        # ENVÍO AUTOMÁTICO A TELEGRAM SI ESTÁ ACTIVADO
+        if auto_telegram:
+            # Las capturas ya van recomprimidas en los params del trabajo
+            capturas = trabajo.params if adjuntar_capturas else None
+            envio = encolar_senal_telegram(auth, user_id, resultado, trabajo.id, capturas)
+            if envio is not None:
+                trabajo.extra['telegram'] = envio
+    
+    return cerrar
+
+
+def mostrar_trabajo_analisis():
+    """Muestra el análisis en segundo plano de la sesión: progreso en vivo o resultado final"""
+    trabajo_info = st.session_state['trabajo_analisis']
+    instantanea = obtener_cola_analisis().estado(trabajo_info['job_id'])
+    
+    if instantanea is None:
+        # El proceso se reinició o el trabajo caducó
+        del st.session_state['trabajo_analisis']
+        st.warning("⚠️ El análisis anterior ya no está disponible. Genera uno nuevo.")
+        return
+    
+    if not instantanea['terminado']:
+        seguir_trabajo_analisis()
+    elif instantanea['estado'] == COMPLETADO:
+        mostrar_resultado_analisis(instantanea, trabajo_info)
+    elif instantanea['estado'] == CANCELADO:
+        st.warning("⛔ Análisis cancelado. No se ha descontado de tu cupo diario.")
+    else:
+        st.error(f"❌ {instantanea['mensaje']}")
+
+
+@st.fragment(run_every=1.0)
+def seguir_trabajo_analisis():
+    """Refresca solo este bloque cada segundo mientras el trabajo está en cola o en curso"""
+    trabajo_info = st.session_state.get('trabajo_analisis')
+    if not trabajo_info:
+        return
+    
+    cola = obtener_cola_analisis()
+    instantanea = cola.estado(trabajo_info['job_id'])
+    if instantanea is None or instantanea['terminado']:
+        # Terminó: rerun completo para pintar el resultado sin refresco periódico
+        st.rerun()
+    
+    if instantanea['estado'] == EN_COLA:
+        st.info(f"⏳ Análisis en cola (posición {instantanea.get('posicion', 1)}). Puedes seguir usando la app.")
+    else:
+        st.info("🧠 REDI7 IA analizando el mercado con Inteligencia Artificial...")
+        if instantanea['gestion']:
+            # Entrada/SL/TP ya leídos: mostrar la gestión antes de que acabe el texto
+            mostrar_gestion_preliminar(instantanea['gestion'])
+        if instantanea['texto']:
+            st.markdown(instantanea['texto'].replace('\n', '  \n') + " ▌")
+    
+    if st.button("⛔ Cancelar análisis", key="btn_cancelar_analisis"):
+        cola.cancelar(trabajo_info['job_id'], user_id=st.session_state.user_data['id'])
+        st.rerun()
+
+
+def mostrar_resultado_analisis(instantanea, trabajo_info):
+    """Pinta el resultado de un análisis completado"""
+    resultado = instantanea['resultado']
+    
+    # GUARDAR TODO EN SESSION STATE PARA QUE NO DESAPAREZCA
+    st.session_state['resultado_actual'] = {
+        'activo': resultado['activo'],
+        'modo': resultado['modo'],
+        'horario': resultado['horario'],
+        'tokens': resultado['tokens_usados'],
+        'analisis_completo': resultado['analisis'],
+        'timestamp': resultado['timestamp'],
+        'gestionar_riesgo': trabajo_info['gestionar_riesgo']
+    }
+    
+    # Header del resultado
+    st.success("✅ **Análisis completado exitosamente**")
+
+    # Estado del envío automático a Telegram (el hilo del trabajo lo dejó en la bandeja de salida)
+    envio_tg = instantanea['extra'].get('telegram')
+    if envio_tg:
+        entrega = None
+        if envio_tg["exito"]:
+            entrega = obtener_bandeja_telegram(st.session_state.auth.pool).consultar(envio_tg['clave'])
+        
+        if entrega and entrega['estado'] == ENVIADO:
+            st.success("📱 ✅ Señal enviada automáticamente a Telegram")
+            if not trabajo_info.get('celebrado'):
+                st.balloons()
+                trabajo_info['celebrado'] = True
+        elif entrega and entrega['estado'] == FALLIDO:
+            st.warning(f"⚠️ No se pudo enviar a Telegram: {entrega.get('ultimo_error') or 'Error'}")
+        elif envio_tg["exito"]:
+            st.info("📨 Señal en cola de envío a Telegram: se entrega en segundo plano y se reintenta si Telegram falla")
+        else:
+            st.warning(f"⚠️ No se pudo enviar a Telegram: {envio_tg.get('mensaje', 'Error')}")
+
+    if resultado.get('desde_cache'):
+        st.caption("♻️ Resultado reutilizado de un análisis idéntico reciente")
+
+    # Métricas superiores
+    # Verificar si es admin desde user_data
+    es_admin = st.session_state.user_data.get('is_admin', 0) == 1
+
+    if es_admin:
+        col_m1, col_m2, col_m3, col_m4 = st.columns(4)
+    else:
+        col_m1, col_m2, col_m3 = st.columns(3)
+
+    with col_m1:
+        st.metric("📊 Activo", resultado['activo'])
+
+    with col_m2:
+        st.metric("⚡ Modo", resultado['modo'])
+
+    with col_m3:
+        st.metric("⏰ Hora", resultado['horario'])
+
+    if es_admin:
+        with col_m4:
+            st.metric("🔢 Tokens", f"{resultado['tokens_usados']}")
+        st.caption(
+            f"🗜️ Capturas: {trabajo_info['imagenes']['bytes_originales'] / 1024:,.0f} KB → "
+            f"{trabajo_info['imagenes']['bytes_finales'] / 1024:,.0f} KB "
+            f"(-{trabajo_info['imagenes']['bytes_ahorrados'] / 1024:,.0f} KB)"
+        )
+
+    # Resultado del análisis
+    st.markdown("---")
+    st.markdown("### 📋 Análisis Institucional REDI7 AI")
+
+    analisis_text = resultado['analisis']
+
+    # Separar análisis de gestión de riesgo si existe (las métricas salen de resultado['gestion'])
+    analisis_principal = analisis_text.split("📉GESTIÓN DE RIESGO REDI7📉")[0].strip()
+
+    # Mostrar el análisis principal en un contenedor con estilo
+    st.markdown('<div class="resultado-box">', unsafe_allow_html=True)
+    analisis_formatted = analisis_principal.replace('\n', '  \n')
+    st.markdown(analisis_formatted)
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    # Si hay gestión de riesgo, mostrarla en formato profesional (valores numéricos del motor)
+    gestion = resultado.get('gestion')
+    if gestion and trabajo_info['gestionar_riesgo']:
+        st.markdown("---")
+        st.markdown("### 💰 Gestión de Riesgo")
+        
+        # Primera fila: Capital y Riesgo
+        col_r1, col_r2, col_r3, col_r4 = st.columns(4)
+        
+        with col_r1:
+            st.metric("💰 Capital Total", f"${resultado['capital']:,.2f}")
+        
+        with col_r2:
+            st.metric("⚠️ Riesgo", f"{resultado['riesgo_porcentaje']}%")
+        
+        with col_r3:
+            st.metric("💵 En Riesgo", f"${gestion['riesgo_usd']:,.2f}")
+        
+        with col_r4:
+            st.metric("📊 Lotaje", f"{gestion['lotaje']} lotes")
+        
+        # Segunda fila: TPs y Ratios
+        st.markdown("**💎 Ganancias Potenciales:**")
+        col_tp1, col_tp2, col_tp3, col_rr = st.columns(4)
+        
+        with col_tp1:
+            st.metric("🎯 TP1", f"${gestion['ganancia_tp1']:,.2f}", delta=f"R:R {gestion['rr_tp1']}")
+        
+        with col_tp2:
+            st.metric("🎯 TP2", f"${gestion['ganancia_tp2']:,.2f}", delta=f"R:R {gestion['rr_tp2']}")
+        
+        with col_tp3:
+            st.metric("🎯 TP3", f"${gestion['ganancia_tp3']:,.2f}", delta=f"R:R {gestion['rr_tp3']}")
+        
+        with col_rr:
+            rr_promedio = (gestion['rr_tp1'] + gestion['rr_tp2'] + gestion['rr_tp3']) / 3
+            st.metric("📈 R:R Promedio", f"{rr_promedio:.2f}")
+        
+        if resultado.get('senal'):
+            mostrar_tabla_sensibilidad(resultado)
+
+    # Timestamp
+    st.caption(f"🕐 Generado: {resultado['timestamp']}")
+
+    # Botón de acción
+    st.markdown("---")
+    # Botón para analizar de nuevo (centrado)
+    if st.button("🔄 Analizar de Nuevo", type="primary", use_container_width=True, key="btn_nuevo_analisis"):
+        del st.session_state['trabajo_analisis']
+        st.rerun()
+
+
+def mostrar_tabla_sensibilidad(resultado):
+    """Lotaje de la señal para distintos capitales y riesgos (matriz calculada con NumPy)"""
+    with st.expander("📊 Sensibilidad: lotaje según capital y riesgo", expanded=False):
+        capital = resultado['capital']
+        capitales = [capital * factor for factor in (0.25, 0.5, 1, 2, 4, 10)]
+        riesgos = [0.5, 1.0, 1.5, 2.0, 3.0, 5.0]
+        
+        tabla = REDI7AI.tabla_sensibilidad(resultado['activo'], resultado['senal'], capitales, riesgos)
+        
+        columnas = {"💰 Capital": [f"${c:,.0f}" for c in tabla['capitales']]}
+        for j, riesgo in enumerate(tabla['riesgos_porcentaje']):
+            columnas[f"{riesgo:g}%"] = [f"{lote:.2f}" for lote in tabla['lotaje'][:, j]]
+        
+        st.dataframe(columnas, hide_index=True, use_container_width=True)
+        st.caption(
+            f"Lotes por combinación. Dinero en riesgo con tu capital al {resultado['riesgo_porcentaje']}%: "
+            f"${capital * resultado['riesgo_porcentaje'] / 100:,.2f}"
+        )
+
+
 def detectar_dispositivo():
     """Detecta si el usuario está en PC o dispositivo móvil con toggle permanente"""
     # Inicializar con valor por defecto
@@ -606,6 +907,11 @@ def main():
                 
                 if enviar_auto:
                     st.info("🟢 Envío automático ACTIVO")
+                    st.session_state['telegram_adjuntar_capturas'] = st.toggle(
+                        "🖼️ Adjuntar capturas",
+                        value=st.session_state.get('telegram_adjuntar_capturas', False),
+                        help="Envía los gráficos analizados como álbum con la señal como leyenda"
+                    )
                 else:
                     st.warning("🔴 Envío automático DESACTIVADO")
             else:
@@ -806,9 +1112,13 @@ def main():
                 st.error(f"❌ Por favor sube las {num_imagenes} capturas de gráficos antes de analizar")
                 return
 
-            # Verificar límite de consultas ANTES de procesar
+            if gestionar_riesgo and (not capital or not riesgo_porcentaje):
+                st.error("❌ Completa los datos de capital y riesgo")
+                return
+        
+            # Reservar el análisis del cupo ANTES de llamar al modelo (atómico)
             plan = st.session_state.user_data.get("plan", "free")
-            usage = st.session_state.auth.can_analyze(st.session_state.user_data['id'], plan)
+            usage = st.session_state.auth.reservar_analisis(st.session_state.user_data['id'], plan)
             
             if not usage["allowed"]:
                 st.error(
@@ -820,240 +1130,97 @@ def main():
                 # Mostrar el modal de upgrade
                 mostrar_modal_upgrade()
                 return
-        
-            if gestionar_riesgo and (not capital or not riesgo_porcentaje):
-                st.error("❌ Completa los datos de capital y riesgo")
+            
+            reserva = usage["reserva"]
+            
+            # Inicializar REDI7 AI - Obtener API key de variable de entorno
+            api_key = os.getenv("OPENAI_API_KEY")
+            
+            if not api_key:
+                st.session_state.auth.liberar_reserva(reserva)
+                st.error("❌ API Key de OpenAI no configurada. Configura la variable de entorno OPENAI_API_KEY")
                 return
+            
+            try:
+                # Obtener los niveles de detalle para cada imagen
+                detail_levels = get_detail_levels(activo, modo_operacion, dispositivo)
+            
+                # Recortar, reducir a la resolución que usa el modelo y recomprimir
+                # (2 o 3 capturas según dispositivo)
+                with tramo("app.preparar_imagenes"):
+                    imagenes_preparadas = preparar_imagenes(
+                        [uploaded_file.getvalue() for uploaded_file in uploaded_files],
+                        detail_levels
+                    )
+            except Exception as e:
+                st.session_state.auth.liberar_reserva(reserva)
+                st.error(f"❌ Error procesando las capturas: {str(e)}")
+                st.exception(e)
+                return
+            
+            # Parámetros del análisis
+            params = {
+                "activo": activo,
+                "modo": modo_operacion,
+                "horario_actual": horario_actual,
+                "imagenes_base64": imagenes_preparadas["imagenes_base64"],
+                "mime_types": imagenes_preparadas["mime_types"],
+                "detail_levels": detail_levels,
+                "dispositivo": dispositivo,
+                "temporalidades": temporalidades,
+                "evento_macro": evento_macro,
+                "descripcion_evento": descripcion_evento if evento_macro else "",
+                "contexto_adicional": contexto_adicional,
+                "gestionar_riesgo": gestionar_riesgo,
+                "salida_estructurada": SALIDA_ESTRUCTURADA
+            }
+            
+            # Si la gestión de riesgo está activa, agregar parámetros
+            if gestionar_riesgo:
+                params["capital"] = capital
+                params["riesgo_porcentaje"] = riesgo_porcentaje
+            else:
+                # Valores por defecto cuando no hay gestión de riesgo
+                params["capital"] = 10000.0
+                params["riesgo_porcentaje"] = 2.0
+            
+            # Enviar a la cola del proceso: el análisis sigue aunque la página se recargue
+            cierre = crear_cierre_analisis(
+                st.session_state.auth,
+                st.session_state.user_data['id'],
+                reserva,
+                activo,
+                modo_operacion,
+                temporalidades,
+                st.session_state.get('telegram_auto_envio', False),
+                st.session_state.get('telegram_adjuntar_capturas', False)
+            )
+            envio = obtener_cola_analisis().enviar(
+                st.session_state.user_data['id'],
+                plan,
+                api_key,
+                params,
+                al_terminar=cierre
+            )
+            
+            if not envio["success"]:
+                st.session_state.auth.liberar_reserva(reserva)
+                st.error(f"❌ {envio['mensaje']}")
+                return
+            
+            st.session_state['trabajo_analisis'] = {
+                'job_id': envio['job_id'],
+                'gestionar_riesgo': gestionar_riesgo,
+                'imagenes': {
+                    'bytes_originales': imagenes_preparadas['bytes_originales'],
+                    'bytes_finales': imagenes_preparadas['bytes_finales'],
+                    'bytes_ahorrados': imagenes_preparadas['bytes_ahorrados']
+                }
+            }
         
-            # Mostrar spinner mientras procesa
-            with st.spinner('🧠 REDI7 IA analizando el mercado con Inteligencia Artificial...'):
-                try:
-                    # Inicializar REDI7 AI - Obtener API key de variable de entorno
-                    api_key = os.getenv("OPENAI_API_KEY")
-                    
-                    if not api_key:
-                        st.error("❌ API Key de OpenAI no configurada. Configura la variable de entorno OPENAI_API_KEY")
-                        return
-                
-                    redi7 = REDI7AI(api_key=api_key)
-                
-                    # Preparar imágenes en base64
-                    imagenes_base64 = []
-                
-                    # Función helper para convertir imagen a base64
-                    def imagen_to_base64(img):
-                        # Es UploadedFile de Streamlit
-                        return base64.b64encode(img.getvalue()).decode('utf-8')
-                
-                    # Convertir todas las imágenes (2 o 3 según dispositivo)
-                    for uploaded_file in uploaded_files:
-                        imagenes_base64.append(imagen_to_base64(uploaded_file))
-                    
-                    # Obtener los niveles de detalle para cada imagen
-                    detail_levels = get_detail_levels(activo, modo_operacion, dispositivo)
-                
-                    # Parámetros del análisis
-                    params = {
-                        "activo": activo,
-                        "modo": modo_operacion,
-                        "horario_actual": horario_actual,
-                        "imagenes_base64": imagenes_base64,
-                        "detail_levels": detail_levels,
-                        "dispositivo": dispositivo,
-                        "temporalidades": temporalidades,
-                        "evento_macro": evento_macro,
-                        "descripcion_evento": descripcion_evento if evento_macro else "",
-                        "contexto_adicional": contexto_adicional,
-                        "gestionar_riesgo": gestionar_riesgo
-                    }
-                
-                    # Si la gestión de riesgo está activa, agregar parámetros
-                    if gestionar_riesgo:
-                        params["capital"] = capital
-                        params["riesgo_porcentaje"] = riesgo_porcentaje
-                    else:
-                        # Valores por defecto cuando no hay gestión de riesgo
-                        params["capital"] = 10000.0
-                        params["riesgo_porcentaje"] = 2.0
-                
-                    # Realizar análisis CON IMÁGENES
-                    resultado = redi7.analizar_con_imagenes(**params)
-
-                    # Mostrar resultados
-                    if resultado["error"]:
-                        st.error(f"❌ {resultado['mensaje']}")
-                    else:
-                        # Guardar en historial usando auth
-                        try:
-                            st.session_state.auth.registrar_analisis(
-                                st.session_state.user_data['id'],
-                                activo,
-                                modo_operacion,
-                                ', '.join(temporalidades) if isinstance(temporalidades, list) else str(temporalidades),
-                                resultado['analisis'][:1000]
-                            )
-                        except Exception as e:
-                            print(f"Error guardando análisis: {e}")
-                        
-                        # GUARDAR TODO EN SESSION STATE PARA QUE NO DESAPAREZCA
-                        st.session_state['resultado_actual'] = {
-                            'activo': resultado['activo'],
-                            'modo': resultado['modo'],
-                            'horario': resultado['horario'],
-                            'tokens': resultado['tokens_usados'],
-                            'analisis_completo': resultado['analisis'],
-                            'timestamp': resultado['timestamp'],
-                            'gestionar_riesgo': gestionar_riesgo
-                        }
-                        
-                        # ENVÍO AUTOMÁTICO A TELEGRAM SI ESTÁ ACTIVADO
-                        if st.session_state.get('telegram_auto_envio', False):
-                            telegram_config = st.session_state.auth.obtener_telegram_config(
-                                st.session_state.user_data['id']
-                            )
-                            
-                            if telegram_config['configurado']:
-                                try:
-                                    from telegram_sender import TelegramSender
-                                    
-                                    # Extraer análisis principal
-                                    analisis_text = resultado['analisis']
-                                    if "📉GESTIÓN DE RIESGO REDI7📉" in analisis_text:
-                                        analisis_principal = analisis_text.split("📉GESTIÓN DE RIESGO REDI7📉")[0].strip()
-                                    else:
-                                        analisis_principal = analisis_text
-                                    
-                                    # Crear sender y enviar
-                                    sender = TelegramSender(
-                                        bot_token=telegram_config['bot_token'],
-                                        chat_id=telegram_config['chat_id']
-                                    )
-                                    
-                                    mensaje = f"🚀 SEÑAL REDI7 AI\n\n📊 Activo: {resultado['activo']}\n⚡ Modo: {resultado['modo']}\n\n{analisis_principal}"
-                                    resultado_tg = sender.enviar_mensaje(mensaje, parse_mode=None)
-                                    
-                                    if resultado_tg["exito"]:
-                                        st.success("📱 ✅ Señal enviada automáticamente a Telegram")
-                                        st.balloons()
-                                    else:
-                                        st.warning(f"⚠️ No se pudo enviar a Telegram: {resultado_tg.get('mensaje', 'Error')}")
-                                
-                                except Exception as e:
-                                    st.warning(f"⚠️ Error al enviar a Telegram: {str(e)}")
-                        
-                        # Header del resultado
-                        st.success("✅ **Análisis completado exitosamente**")
-
-                        # Métricas superiores
-                        # Verificar si es admin desde user_data
-                        es_admin = st.session_state.user_data.get('is_admin', 0) == 1
-                        
-                        if es_admin:
-                            col_m1, col_m2, col_m3, col_m4 = st.columns(4)
-                        else:
-                            col_m1, col_m2, col_m3 = st.columns(3)
-
-                        with col_m1:
-                            st.metric("📊 Activo", resultado['activo'])
-
-                        with col_m2:
-                            st.metric("⚡ Modo", resultado['modo'])
-
-                        with col_m3:
-                            st.metric("⏰ Hora", resultado['horario'])
-
-                        if es_admin:
-                            with col_m4:
-                                st.metric("🔢 Tokens", f"{resultado['tokens_usados']}")
-
-                        # Resultado del análisis
-                        st.markdown("---")
-                        st.markdown("### 📋 Análisis Institucional REDI7 AI")
-
-                        analisis_text = resultado['analisis']
-                        
-                        # Separar análisis de gestión de riesgo si existe
-                        if "📉GESTIÓN DE RIESGO REDI7📉" in analisis_text:
-                            partes = analisis_text.split("📉GESTIÓN DE RIESGO REDI7📉")
-                            analisis_principal = partes[0].strip()
-                            gestion_riesgo_texto = partes[1].strip() if len(partes) > 1 else ""
-                        else:
-                            analisis_principal = analisis_text
-                            gestion_riesgo_texto = ""
-
-                        # Mostrar el análisis principal en un contenedor con estilo
-                        st.markdown('<div class="resultado-box">', unsafe_allow_html=True)
-                        analisis_formatted = analisis_principal.replace('\n', '  \n')
-                        st.markdown(analisis_formatted)
-                        st.markdown('</div>', unsafe_allow_html=True)
-                        
-                        # Si hay gestión de riesgo, mostrarla en formato profesional
-                        if gestion_riesgo_texto and gestionar_riesgo:
-                            st.markdown("---")
-                            st.markdown("### 💰 Gestión de Riesgo")
-                            
-                            # Extraer valores con regex
-                            import re
-                            capital_match = re.search(r'Capital: \$([0-9,]+\.\d{2})', gestion_riesgo_texto)
-                            riesgo_pct_match = re.search(r'Riesgo: ([\d.]+)%', gestion_riesgo_texto)
-                            dinero_riesgo_match = re.search(r'Dinero en riesgo: \$([0-9,]+\.\d{2})', gestion_riesgo_texto)
-                            lotaje_match = re.search(r'Tamaño posición: ([\d.]+) lotes', gestion_riesgo_texto)
-                            tp1_match = re.search(r'TP1: \$([0-9,]+\.\d{2}) \(R:R ([\d.]+)\)', gestion_riesgo_texto)
-                            tp2_match = re.search(r'TP2: \$([0-9,]+\.\d{2}) \(R:R ([\d.]+)\)', gestion_riesgo_texto)
-                            tp3_match = re.search(r'TP3: \$([0-9,]+\.\d{2}) \(R:R ([\d.]+)\)', gestion_riesgo_texto)
-                            rr_prom_match = re.search(r'Ratio Riesgo/Beneficio promedio: ([\d.]+)', gestion_riesgo_texto)
-                            
-                            # Primera fila: Capital y Riesgo
-                            col_r1, col_r2, col_r3, col_r4 = st.columns(4)
-                            
-                            with col_r1:
-                                if capital_match:
-                                    st.metric("💰 Capital Total", f"${capital_match.group(1)}")
-                            
-                            with col_r2:
-                                if riesgo_pct_match:
-                                    st.metric("⚠️ Riesgo", f"{riesgo_pct_match.group(1)}%")
-                            
-                            with col_r3:
-                                if dinero_riesgo_match:
-                                    st.metric("💵 En Riesgo", f"${dinero_riesgo_match.group(1)}")
-                            
-                            with col_r4:
-                                if lotaje_match:
-                                    st.metric("📊 Lotaje", f"{lotaje_match.group(1)} lotes")
-                            
-                            # Segunda fila: TPs y Ratios
-                            st.markdown("**💎 Ganancias Potenciales:**")
-                            col_tp1, col_tp2, col_tp3, col_rr = st.columns(4)
-                            
-                            with col_tp1:
-                                if tp1_match:
-                                    st.metric("🎯 TP1", f"${tp1_match.group(1)}", delta=f"R:R {tp1_match.group(2)}")
-                            
-                            with col_tp2:
-                                if tp2_match:
-                                    st.metric("🎯 TP2", f"${tp2_match.group(1)}", delta=f"R:R {tp2_match.group(2)}")
-                            
-                            with col_tp3:
-                                if tp3_match:
-                                    st.metric("🎯 TP3", f"${tp3_match.group(1)}", delta=f"R:R {tp3_match.group(2)}")
-                            
-                            with col_rr:
-                                if rr_prom_match:
-                                    st.metric("📈 R:R Promedio", rr_prom_match.group(1))
-
-                        # Timestamp
-                        st.caption(f"🕐 Generado: {resultado['timestamp']}")
-
-                        # Botón de acción
-                        st.markdown("---")
-                        # Botón para analizar de nuevo (centrado)
-                        if st.button("🔄 Analizar de Nuevo", type="primary", use_container_width=True, key="btn_nuevo_analisis"):
-                            st.rerun()
-                    
-                except Exception as e:
-                    st.error(f"❌ Error durante el análisis: {str(e)}")
-                    st.exception(e)
+        # Análisis en segundo plano de esta sesión (sobrevive a los reruns)
+        if st.session_state.get('trabajo_analisis'):
+            mostrar_trabajo_analisis()
     
         # Footer
         st.markdown("---")
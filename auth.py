@@ -3,12 +3,17 @@ Sistema de Autenticación para REDI7 IA - Versión MySQL
 Gestión de usuarios, login y registro con MySQL/Hostinger
 """
 
-import mysql.connector
 from mysql.connector import Error
 import hashlib
 import os
 from datetime import datetime, timedelta
 from typing import Optional, Dict
+import threading
+import time
+from cache_ttl import CacheTTL
+from db_pool import obtener_pool
+from metricas import medir
+from migraciones import aplicar_migraciones, obtener_version, MigracionBloqueada, VERSION_ESQUEMA
 
 class AuthSystem:
     """Sistema de autenticación y gestión de usuarios con MySQL"""
@@ -19,12 +24,17 @@ class AuthSystem:
         "elite": 25
     }
     
-    def __init__(self):
-        """Inicializar conexión a MySQL"""
-        self._get_db_config()
-        self._init_database()
+    def __init__(self, config_bd: Optional[Dict] = None):
+        """
+        Inicializar conexión a MySQL (el esquema se gestiona en migraciones.py)
+
+        Args:
+            config_bd: Sustituye host/port/user/password/database/pool_size de secrets
+                o entorno (p. ej. la base local de prueba_carga.py)
+        """
+        self._get_db_config(config_bd or {})
     
-    def _get_db_config(self):
+    def _get_db_config(self, config_bd: Dict):
         """Obtener configuración de base de datos desde secrets o variables de entorno"""
         try:
             import streamlit as st
@@ -33,24 +43,47 @@ class AuthSystem:
             self.db_user = st.secrets.get("DB_USER", "u114360920_redi7")
             self.db_password = st.secrets.get("DB_PASSWORD", "")
             self.db_name = st.secrets.get("DB_NAME", "u114360920_redi7_users")
+            self.db_pool_size = int(st.secrets.get("DB_POOL_SIZE", 10))
+            self.cache_uso_ttl = float(st.secrets.get("QUOTA_CACHE_TTL", 60))
         except:
             self.db_host = os.getenv("DB_HOST", "srv1716.hstgr.io")
             self.db_port = int(os.getenv("DB_PORT", 3306))
             self.db_user = os.getenv("DB_USER", "u114360920_redi7")
             self.db_password = os.getenv("DB_PASSWORD", "")
             self.db_name = os.getenv("DB_NAME", "u114360920_redi7_users")
+            self.db_pool_size = int(os.getenv("DB_POOL_SIZE", 10))
+            self.cache_uso_ttl = float(os.getenv("QUOTA_CACHE_TTL", 60))
+        
+        self.db_host = config_bd.get("host", self.db_host)
+        self.db_port = int(config_bd.get("port", self.db_port))
+        self.db_user = config_bd.get("user", self.db_user)
+        self.db_password = config_bd.get("password", self.db_password)
+        self.db_name = config_bd.get("database", self.db_name)
+        self.db_pool_size = int(config_bd.get("pool_size", self.db_pool_size))
+        
+        # Pool compartido por todas las sesiones del proceso
+        self.pool = obtener_pool(
+            {
+                "host": self.db_host,
+                "port": self.db_port,
+                "user": self.db_user,
+                "password": self.db_password,
+                "database": self.db_name,
+                "connect_timeout": 10
+            },
+            max_conexiones=self.db_pool_size
+        )
+        
+        # Uso diario por (user_id, día): evita ir a MySQL en cada rerun de Streamlit
+        self.cache_uso = CacheTTL(max_entradas=5000, ttl=self.cache_uso_ttl)
     
+    @medir("mysql.conexion")
     def _get_connection(self):
-        """Crear conexión a MySQL"""
+        """Obtener conexión a MySQL desde el pool (close() la devuelve al pool)"""
         try:
-            connection = mysql.connector.connect(
-                host=self.db_host,
-                port=self.db_port,
-                user=self.db_user,
-                password=self.db_password,
-                database=self.db_name,
-                connect_timeout=10
-            )
+            connection = self.pool.obtener()
+            if connection is None:
+                print("Error conectando a MySQL: pool de conexiones agotado")
             return connection
         except Error as e:
             print(f"Error conectando a MySQL: {e}")
@@ -70,82 +103,53 @@ class AuthSystem:
         except:
             pass
     
-    def _init_database(self):
-        """Inicializa las tablas de la base de datos"""
+    def verificar_esquema(self) -> bool:
+        """
+        Comprueba la versión del esquema con una sola consulta y migra solo si está desactualizado
+
+        Returns:
+            True si el esquema está al día
+        """
         conn = self._get_connection()
         if not conn:
             print("⚠️ No se pudo conectar a la base de datos")
-            return
+            return False
         
         cursor = conn.cursor(buffered=True)
+        try:
+            version = obtener_version(cursor)
+        finally:
+            self._safe_close_cursor(cursor)
+            conn.close()
+        
+        if version >= VERSION_ESQUEMA:
+            return True
+        
+        print(f"ℹ️ Esquema en versión {version}, se requiere {VERSION_ESQUEMA}")
+        return self.inicializar_esquema()
+    
+    def inicializar_esquema(self) -> bool:
+        """Aplica migraciones pendientes y datos iniciales (admin, códigos de referido)"""
+        conn = self._get_connection()
+        if not conn:
+            print("⚠️ No se pudo conectar a la base de datos")
+            return False
         
         try:
-            # Tabla de usuarios
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS usuarios (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    username VARCHAR(255) UNIQUE NOT NULL,
-                    email VARCHAR(255) UNIQUE NOT NULL,
-                    password_hash VARCHAR(255) NOT NULL,
-                    nombre_completo VARCHAR(255),
-                    whatsapp VARCHAR(50) UNIQUE,
-                    fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    ultimo_acceso TIMESTAMP NULL,
-                    plan VARCHAR(50) DEFAULT 'free',
-                    activo TINYINT DEFAULT 1,
-                    is_admin TINYINT DEFAULT 0,
-                    referral_code VARCHAR(50) UNIQUE,
-                    referred_by INT,
-                    telegram_bot_token TEXT,
-                    telegram_chat_id VARCHAR(255),
-                    recovery_code VARCHAR(10),
-                    recovery_expiry DATETIME,
-                    INDEX idx_username (username),
-                    INDEX idx_email (email),
-                    INDEX idx_referral (referral_code)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            # Tabla de historial de análisis
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS historial_analisis (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id INT,
-                    activo VARCHAR(50),
-                    modo VARCHAR(50),
-                    temporalidad VARCHAR(255),
-                    fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    resultado TEXT,
-                    FOREIGN KEY (user_id) REFERENCES usuarios(id) ON DELETE CASCADE,
-                    INDEX idx_user_fecha (user_id, fecha)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            # Tabla de sesiones
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS sesiones (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_id INT,
-                    token VARCHAR(255) UNIQUE,
-                    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    fecha_expiracion TIMESTAMP NULL,
-                    FOREIGN KEY (user_id) REFERENCES usuarios(id) ON DELETE CASCADE,
-                    INDEX idx_token (token)
-                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
-            """)
-            
-            conn.commit()
-            print("✅ Tablas inicializadas correctamente")
-            
+            aplicar_migraciones(conn)
+        except MigracionBloqueada as e:
+            print(f"⚠️ {e}")
+            return False
         except Error as e:
-            print(f"Error inicializando tablas: {e}")
+            print(f"Error aplicando migraciones: {e}")
+            return False
         finally:
-            self._safe_close_cursor(cursor)
             conn.close()
         
         self._ensure_referral_codes()
         self._crear_admin_inicial()
         self._promover_usuarios_admin()
+        return True
     
     def _crear_admin_inicial(self):
         """Crea usuario admin si no existe"""
@@ -341,6 +345,7 @@ class AuthSystem:
         except Error as e:
             return {"success": False, "mensaje": f"❌ Error al registrar: {str(e)}"}
     
+    @medir("auth.login")
     def login(self, username: str, password: str) -> Dict:
         """Autentica un usuario"""
         try:
@@ -417,8 +422,55 @@ class AuthSystem:
         except Error as e:
             return {"success": False, "mensaje": f"❌ Error al iniciar sesión: {str(e)}"}
     
+    def _rango_dia(self, dia):
+        """Devuelve el rango semiabierto [inicio, fin) de un día, apto para índice sobre fecha"""
+        inicio = datetime.combine(dia, datetime.min.time())
+        return inicio, inicio + timedelta(days=1)
+    
+    def _contar_uso_dia(self, cursor, user_id: int, dia) -> int:
+        """Lee el contador diario (búsqueda por clave primaria) con respaldo por rango"""
+        cursor.execute("""
+            SELECT usados FROM uso_diario 
+            WHERE user_id = %s AND dia = %s
+        """, (user_id, dia))
+        fila = cursor.fetchone()
+        if fila is not None:
+            return fila[0]
+        
+        # Sin fila en el contador: contar por rango semiabierto (usa idx_user_fecha)
+        inicio, fin = self._rango_dia(dia)
+        cursor.execute("""
+            SELECT COUNT(*) FROM historial_analisis 
+            WHERE user_id = %s AND fecha >= %s AND fecha < %s
+        """, (user_id, inicio, fin))
+        return cursor.fetchone()[0]
+    
+    def _resumen_uso(self, used: int, plan: str) -> Dict:
+        limit = self.PLAN_LIMITS.get(plan, 3)
+        remaining = max(0, limit - used)
+        return {
+            "allowed": remaining > 0,
+            "used": used,
+            "limit": limit,
+            "remaining": remaining
+        }
+    
+    def invalidar_cache_uso(self, user_id: int):
+        """Descarta el uso en caché de un usuario (cambios de plan, borrados...)"""
+        self.cache_uso.invalidar_donde(lambda clave: clave[0] == user_id)
+    
+    def estadisticas_cache(self) -> Dict:
+        """Aciertos/fallos de la caché de cuotas"""
+        return self.cache_uso.estadisticas()
+    
+    @medir("auth.can_analyze")
     def can_analyze(self, user_id: int, plan: str) -> Dict:
         """Verifica si el usuario puede realizar más análisis hoy"""
+        today = datetime.now().date()
+        used = self.cache_uso.obtener((user_id, today))
+        if used is not None:
+            return self._resumen_uso(used, plan)
+        
         conn = self._get_connection()
         if not conn:
             return {"allowed": False, "used": 0, "limit": 0, "remaining": 0}
@@ -426,47 +478,161 @@ class AuthSystem:
         cursor = conn.cursor(buffered=True)
         
         try:
-            today = datetime.now().date()
-            cursor.execute("""
-                SELECT COUNT(*) FROM historial_analisis 
-                WHERE user_id = %s AND DATE(fecha) = %s
-            """, (user_id, today))
-            
-            used = cursor.fetchone()[0]
-            limit = self.PLAN_LIMITS.get(plan, 3)
-            remaining = max(0, limit - used)
+            used = self._contar_uso_dia(cursor, user_id, today)
+            self.cache_uso.guardar((user_id, today), used)
             
             self._safe_close_cursor(cursor)
             conn.close()
             
-            return {
-                "allowed": remaining > 0,
-                "used": used,
-                "limit": limit,
-                "remaining": remaining
-            }
+            return self._resumen_uso(used, plan)
         except Error as e:
             print(f"Error verificando límites: {e}")
             self._safe_close_cursor(cursor)
             conn.close()
             return {"allowed": False, "used": 0, "limit": 0, "remaining": 0}
     
-    def registrar_analisis(self, user_id: int, activo: str, modo: str, temporalidad: str, resultado: str):
-        """Registra un análisis en el historial"""
+    @medir("auth.reservar_analisis")
+    def reservar_analisis(self, user_id: int, plan: str) -> Dict:
+        """
+        Reserva atómicamente un análisis del cupo diario antes de llamar al modelo
+
+        Un único UPDATE condicional toma el hueco solo si queda cupo, así dos
+        pestañas o un doble clic no pueden pasar ambos la verificación.
+        Si el análisis falla, devolver el hueco con liberar_reserva().
+        
+        Returns:
+            Dict como can_analyze; si allowed es True incluye "reserva" para
+            pasarla a registrar_analisis() o liberar_reserva()
+        """
+        conn = self._get_connection()
+        if not conn:
+            return {"allowed": False, "used": 0, "limit": 0, "remaining": 0}
+        
+        cursor = conn.cursor(buffered=True)
+        today = datetime.now().date()
+        limit = self.PLAN_LIMITS.get(plan, 3)
+        
+        try:
+            reservar_sql = """
+                UPDATE uso_diario 
+                SET usados = LAST_INSERT_ID(usados + 1)
+                WHERE user_id = %s AND dia = %s AND usados < %s
+            """
+            cursor.execute(reservar_sql, (user_id, today, limit))
+            
+            if cursor.rowcount == 0:
+                # Sin fila del día todavía: sembrarla con el uso real y reintentar.
+                # Se reintenta aunque el INSERT no haga nada: si otra petición creó la fila
+                # a la vez, el UPDATE (lectura con bloqueo) ya la ve y toma el hueco si queda
+                inicio, fin = self._rango_dia(today)
+                cursor.execute("""
+                    INSERT IGNORE INTO uso_diario (user_id, dia, usados)
+                    SELECT %s, %s, COUNT(*) FROM historial_analisis
+                    WHERE user_id = %s AND fecha >= %s AND fecha < %s
+                """, (user_id, today, user_id, inicio, fin))
+                cursor.execute(reservar_sql, (user_id, today, limit))
+            
+            if cursor.rowcount == 1:
+                # LAST_INSERT_ID(expr) devuelve el nuevo valor sin otra consulta
+                used = cursor.lastrowid
+                conn.commit()
+                self._safe_close_cursor(cursor)
+                conn.close()
+                
+                self.cache_uso.guardar((user_id, today), used)
+                resumen = self._resumen_uso(used, plan)
+                resumen["allowed"] = True
+                resumen["reserva"] = {"user_id": user_id, "dia": today}
+                return resumen
+            
+            used = self._contar_uso_dia(cursor, user_id, today)
+            conn.commit()
+            self._safe_close_cursor(cursor)
+            conn.close()
+            
+            self.cache_uso.guardar((user_id, today), used)
+            resumen = self._resumen_uso(used, plan)
+            resumen["allowed"] = False
+            return resumen
+        except Error as e:
+            print(f"Error reservando análisis: {e}")
+            self._safe_close_cursor(cursor)
+            conn.close()
+            return {"allowed": False, "used": 0, "limit": 0, "remaining": 0}
+    
+    @medir("auth.liberar_reserva")
+    def liberar_reserva(self, reserva: Dict) -> bool:
+        """Devuelve al cupo un hueco reservado cuyo análisis no llegó a completarse"""
+        conn = self._get_connection()
+        if not conn:
+            return False
+        
+        cursor = conn.cursor(buffered=True)
+        
+        try:
+            cursor.execute("""
+                UPDATE uso_diario 
+                SET usados = usados - 1 
+                WHERE user_id = %s AND dia = %s AND usados > 0
+            """, (reserva["user_id"], reserva["dia"]))
+            conn.commit()
+            self._safe_close_cursor(cursor)
+            conn.close()
+            
+            self.cache_uso.actualizar(
+                (reserva["user_id"], reserva["dia"]),
+                lambda usados: max(0, usados - 1)
+            )
+            return True
+        except Error as e:
+            print(f"Error liberando reserva: {e}")
+            self._safe_close_cursor(cursor)
+            conn.close()
+            return False
+    
+    @medir("auth.registrar_analisis")
+    def registrar_analisis(
+        self,
+        user_id: int,
+        activo: str,
+        modo: str,
+        temporalidad: str,
+        resultado: str,
+        reserva: Optional[Dict] = None
+    ):
+        """
+        Registra un análisis en el historial
+
+        Si se pasa la reserva de reservar_analisis(), el cupo ya está descontado
+        y solo se inserta el historial; si no, suma uno al contador diario.
+        """
         conn = self._get_connection()
         if not conn:
             return False
         
         cursor = conn.cursor(buffered=True)
+        today = datetime.now().date()
         
         try:
             cursor.execute("""
                 INSERT INTO historial_analisis (user_id, activo, modo, temporalidad, resultado)
                 VALUES (%s, %s, %s, %s, %s)
             """, (user_id, activo, modo, temporalidad, resultado))
+            
+            if reserva is None:
+                # Mismo commit que el historial: el contador nunca se desincroniza
+                cursor.execute("""
+                    INSERT INTO uso_diario (user_id, dia, usados)
+                    VALUES (%s, %s, 1)
+                    ON DUPLICATE KEY UPDATE usados = usados + 1
+                """, (user_id, today))
             conn.commit()
             self._safe_close_cursor(cursor)
             conn.close()
+            
+            if reserva is None:
+                # Escritura directa: la caché refleja el nuevo uso sin volver a consultar
+                self.cache_uso.actualizar((user_id, today), lambda usados: usados + 1)
             return True
         except Error as e:
             print(f"Error registrando análisis: {e}")
@@ -527,6 +693,7 @@ class AuthSystem:
             conn.close()
             return {"success": False, "mensaje": f"❌ Error: {str(e)}"}
     
+    @medir("auth.obtener_telegram_config")
     def obtener_telegram_config(self, user_id: int) -> Dict:
         """Obtiene la configuración de Telegram del usuario"""
         conn = self._get_connection()
@@ -672,3 +839,57 @@ class AuthSystem:
             self._safe_close_cursor(cursor)
             conn.close()
             return {"success": False, "mensaje": f"❌ Error: {str(e)}"}
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━
+# 🌐 INSTANCIA COMPARTIDA POR PROCESO
+# ━━━━━━━━━━━━━━━━━━━━━━
+
+# Segundos entre comprobaciones del esquema mientras fallen (base caída o lock de otro despliegue)
+SEGUNDOS_REINTENTO_ESQUEMA = 30
+
+_auth_compartido: Optional[AuthSystem] = None
+_esquema_verificado = False
+_proxima_verificacion = 0.0
+_auth_lock = threading.Lock()
+_verificacion_lock = threading.Lock()
+
+
+def obtener_auth() -> AuthSystem:
+    """
+    Devuelve el AuthSystem del proceso, creándolo una sola vez
+
+    La primera llamada comprueba la versión del esquema (una consulta) y solo
+    migra si el despliegue no ejecutó `python migraciones.py`. Las sesiones
+    siguientes reutilizan la misma instancia y el mismo pool sin tocar el DDL;
+    si la comprobación falló (base caída, lock ocupado), se repite como mucho cada
+    SEGUNDOS_REINTENTO_ESQUEMA, en una sola sesión y sin hacer esperar a las demás.
+    """
+    global _auth_compartido
+    
+    if _auth_compartido is None:
+        with _auth_lock:
+            if _auth_compartido is None:
+                _auth_compartido = AuthSystem()
+    
+    if not _esquema_verificado and time.monotonic() >= _proxima_verificacion:
+        _verificar_esquema_compartido()
+    
+    return _auth_compartido
+
+
+def _verificar_esquema_compartido():
+    """Comprueba el esquema del AuthSystem compartido si ninguna otra sesión lo está haciendo ya"""
+    global _esquema_verificado, _proxima_verificacion
+    
+    # Sin bloquear: el connect_timeout o el GET_LOCK de una comprobación no se contagian a otras sesiones
+    if not _verificacion_lock.acquire(blocking=False):
+        return
+    try:
+        if _esquema_verificado or time.monotonic() < _proxima_verificacion:
+            return
+        _esquema_verificado = _auth_compartido.verificar_esquema()
+        if not _esquema_verificado:
+            _proxima_verificacion = time.monotonic() + SEGUNDOS_REINTENTO_ESQUEMA
+    finally:
+        _verificacion_lock.release()
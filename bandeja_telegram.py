@@ -0,0 +1,505 @@
+"""
+Bandeja de salida de Telegram para REDI7 IA
+Las señales se guardan en una tabla persistente (MySQL en producción, SQLite en local) y un
+hilo del proceso las entrega con backoff exponencial y respetando los 429 (retry_after),
+así el dashboard no espera a Telegram y ninguna señal se pierde si Telegram falla un rato
+"""
+
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+
+from config import (
+    TELEGRAM_BANDEJA,
+    TELEGRAM_BANDEJA_BACKOFF_BASE,
+    TELEGRAM_BANDEJA_BACKOFF_MAX,
+    TELEGRAM_BANDEJA_INTENTOS,
+    TELEGRAM_BANDEJA_SQLITE
+)
+from difusion_telegram import obtener_limitador
+from mensajes_telegram import dividir_mensaje
+from metricas import obtener_metricas
+from telegram_sender import ESPERA_MAXIMA_ENTRE_PARTES, TIMEOUT_IMAGENES, TIMEOUT_MENSAJE, TelegramSender
+
+# Estados de un mensaje
+PENDIENTE = "pendiente"
+ENVIANDO = "enviando"
+ENVIADO = "enviado"
+FALLIDO = "fallido"
+
+# Segundos que un hilo tiene reservado un lote; si el proceso muere, otro lo retoma después.
+# Antes de entregar cada mensaje la reserva se renueva para el peor caso de esa entrega.
+SEGUNDOS_RECLAMO = 120
+
+# Mensajes reclamados por vuelta del hilo de entrega
+LOTE_ENTREGA = 20
+
+# Errores de Telegram que no se arreglan reintentando (mensaje inválido, bot bloqueado o sin acceso)
+CODIGOS_PERMANENTES = (400, 401, 403, 404)
+
+# Misma tabla que las migraciones 3 a 5 de migraciones.py (tiempos en epoch para que el SQL sirva en ambos)
+ESQUEMA_SQLITE = """
+    CREATE TABLE IF NOT EXISTS telegram_bandeja (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        clave VARCHAR(64) NOT NULL UNIQUE,
+        user_id INTEGER,
+        bot_token TEXT NOT NULL,
+        chat_id VARCHAR(255) NOT NULL,
+        texto TEXT NOT NULL,
+        parse_mode VARCHAR(20),
+        estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+        intentos INTEGER NOT NULL DEFAULT 0,
+        proximo_intento DOUBLE NOT NULL,
+        reclamo VARCHAR(32),
+        reclamado_hasta DOUBLE,
+        ultimo_error VARCHAR(255),
+        message_id BIGINT,
+        creado DOUBLE NOT NULL,
+        enviado DOUBLE,
+        partes_enviadas INTEGER NOT NULL DEFAULT 0,
+        imagenes TEXT
+    )
+"""
+
+# Columnas añadidas después de crear la tabla (archivos SQLite de versiones anteriores)
+COLUMNAS_SQLITE_POSTERIORES = {
+    "partes_enviadas": "INTEGER NOT NULL DEFAULT 0",
+    "imagenes": "TEXT"
+}
+
+
+def clave_mensaje(*partes) -> str:
+    """Clave de idempotencia: encolar dos veces las mismas partes deja un solo mensaje"""
+    return hashlib.sha256("\x1f".join(str(p) for p in partes).encode("utf-8")).hexdigest()
+
+
+class AlmacenBandeja(ABC):
+    """
+    Operaciones de la bandeja sobre SQL común a MySQL y SQLite
+
+    Las subclases aportan la conexión, el marcador de parámetros y las dos
+    sentencias que difieren entre motores (insertar sin duplicar y reclamar un lote).
+    """
+
+    marcador = "%s"
+    sql_insertar: str
+    sql_reclamar: str
+
+    @abstractmethod
+    def _conectar(self):
+        """Conexión nueva (o del pool) con cursor(), commit() y close()"""
+
+    def _sql(self, sql: str) -> str:
+        return sql if self.marcador == "%s" else sql.replace("%s", self.marcador)
+
+    def _ejecutar(self, sql: str, parametros: tuple = (), leer: bool = False):
+        """Ejecuta y confirma una sentencia; devuelve las filas (leer=True) o las filas afectadas"""
+        conn = self._conectar()
+        if conn is None:
+            raise RuntimeError("Sin conexión a la base de datos de la bandeja")
+        cursor = conn.cursor()
+        try:
+            cursor.execute(self._sql(sql), parametros)
+            resultado = cursor.fetchall() if leer else cursor.rowcount
+            # También tras leer: cierra la transacción para que la siguiente lectura vea filas nuevas
+            conn.commit()
+            return resultado
+        finally:
+            cursor.close()
+            conn.close()
+
+    def insertar(self, clave: str, user_id: Optional[int], bot_token: str, chat_id: str, texto: str,
+                 parse_mode: Optional[str], imagenes: Optional[str] = None) -> bool:
+        """Guarda un mensaje pendiente; False si la clave ya existía"""
+        ahora = time.time()
+        return self._ejecutar(
+            self.sql_insertar,
+            (clave, user_id, bot_token, str(chat_id), texto, parse_mode, imagenes, PENDIENTE, ahora, ahora)
+        ) == 1
+
+    def reclamar(self, limite: int = LOTE_ENTREGA) -> List[Dict]:
+        """
+        Reserva los mensajes vencidos (o cuyo reclamo caducó) para este hilo
+
+        Returns:
+            Lista de dicts con id, clave, bot_token, chat_id, texto, parse_mode, intentos, creado,
+            partes_enviadas, imagenes (JSON o None) y reclamo
+        """
+        reclamo = uuid.uuid4().hex
+        ahora = time.time()
+        self._ejecutar(
+            self.sql_reclamar,
+            (ENVIANDO, reclamo, ahora + SEGUNDOS_RECLAMO, PENDIENTE, ahora, ENVIANDO, ahora, limite)
+        )
+        filas = self._ejecutar("""
+            SELECT id, clave, bot_token, chat_id, texto, parse_mode, intentos, creado, partes_enviadas, imagenes
+            FROM telegram_bandeja
+            WHERE reclamo = %s AND estado = %s
+            ORDER BY id
+        """, (reclamo, ENVIANDO), leer=True)
+        campos = (
+            "id", "clave", "bot_token", "chat_id", "texto", "parse_mode",
+            "intentos", "creado", "partes_enviadas", "imagenes"
+        )
+        return [dict(zip(campos, fila), reclamo=reclamo) for fila in filas]
+
+    def renovar(self, mensaje: Dict, hasta: float) -> bool:
+        """Alarga la reserva del mensaje; False si ya no es de este hilo (caducó y otro la tomó)"""
+        return self._ejecutar("""
+            UPDATE telegram_bandeja
+            SET reclamado_hasta = %s
+            WHERE id = %s AND reclamo = %s AND estado = %s
+        """, (hasta, mensaje["id"], mensaje["reclamo"], ENVIANDO)) == 1
+
+    def completar(self, mensaje: Dict, message_id: Optional[int]):
+        self._ejecutar("""
+            UPDATE telegram_bandeja
+            SET estado = %s, intentos = intentos + 1, message_id = %s, enviado = %s,
+                reclamo = NULL, ultimo_error = NULL
+            WHERE id = %s AND reclamo = %s
+        """, (ENVIADO, message_id, time.time(), mensaje["id"], mensaje["reclamo"]))
+
+    def reprogramar(self, mensaje: Dict, proximo_intento: float, error: str, partes_enviadas: int = 0):
+        """Vuelve a dejarlo pendiente; un mensaje partido recuerda cuántas partes ya llegaron"""
+        self._ejecutar("""
+            UPDATE telegram_bandeja
+            SET estado = %s, intentos = intentos + 1, proximo_intento = %s,
+                reclamo = NULL, ultimo_error = %s, partes_enviadas = %s
+            WHERE id = %s AND reclamo = %s
+        """, (PENDIENTE, proximo_intento, error[:255], partes_enviadas, mensaje["id"], mensaje["reclamo"]))
+
+    def descartar(self, mensaje: Dict, error: str, partes_enviadas: int = 0):
+        self._ejecutar("""
+            UPDATE telegram_bandeja
+            SET estado = %s, intentos = intentos + 1, reclamo = NULL, ultimo_error = %s, partes_enviadas = %s
+            WHERE id = %s AND reclamo = %s
+        """, (FALLIDO, error[:255], partes_enviadas, mensaje["id"], mensaje["reclamo"]))
+
+    def proximo_vencimiento(self) -> Optional[float]:
+        """Instante (epoch) del próximo mensaje pendiente, o None si no hay"""
+        filas = self._ejecutar(
+            "SELECT MIN(proximo_intento) FROM telegram_bandeja WHERE estado = %s",
+            (PENDIENTE,),
+            leer=True
+        )
+        return filas[0][0] if filas and filas[0][0] is not None else None
+
+    def consultar(self, clave: str) -> Optional[Dict]:
+        """Estado de un mensaje por su clave de idempotencia"""
+        filas = self._ejecutar(
+            "SELECT estado, intentos, ultimo_error, message_id FROM telegram_bandeja WHERE clave = %s",
+            (clave,),
+            leer=True
+        )
+        if not filas:
+            return None
+        return dict(zip(("estado", "intentos", "ultimo_error", "message_id"), filas[0]))
+
+    def estadisticas(self) -> Dict[str, int]:
+        filas = self._ejecutar(
+            "SELECT estado, COUNT(*) FROM telegram_bandeja GROUP BY estado",
+            leer=True
+        )
+        return {estado: cantidad for estado, cantidad in filas}
+
+
+class AlmacenMySQL(AlmacenBandeja):
+    """Bandeja en la base MySQL de la app (tabla creada por las migraciones 3 a 5)"""
+
+    sql_insertar = """
+        INSERT IGNORE INTO telegram_bandeja
+            (clave, user_id, bot_token, chat_id, texto, parse_mode, imagenes, estado, proximo_intento, creado)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """
+    sql_reclamar = """
+        UPDATE telegram_bandeja
+        SET estado = %s, reclamo = %s, reclamado_hasta = %s
+        WHERE (estado = %s AND proximo_intento <= %s)
+           OR (estado = %s AND reclamado_hasta < %s)
+        ORDER BY proximo_intento
+        LIMIT %s
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def _conectar(self):
+        return self.pool.obtener()
+
+
+class AlmacenSQLite(AlmacenBandeja):
+    """Bandeja en un archivo SQLite local (sin servidor de base de datos)"""
+
+    marcador = "?"
+    sql_insertar = """
+        INSERT OR IGNORE INTO telegram_bandeja
+            (clave, user_id, bot_token, chat_id, texto, parse_mode, imagenes, estado, proximo_intento, creado)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """
+    sql_reclamar = """
+        UPDATE telegram_bandeja
+        SET estado = %s, reclamo = %s, reclamado_hasta = %s
+        WHERE id IN (
+            SELECT id FROM telegram_bandeja
+            WHERE (estado = %s AND proximo_intento <= %s)
+               OR (estado = %s AND reclamado_hasta < %s)
+            ORDER BY proximo_intento
+            LIMIT %s
+        )
+    """
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        directorio = os.path.dirname(os.path.abspath(ruta))
+        os.makedirs(directorio, exist_ok=True)
+        conn = self._conectar()
+        try:
+            # WAL: el hilo de entrega escribe sin bloquear a quien encola
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(ESQUEMA_SQLITE)
+            columnas = {fila[1] for fila in conn.execute("PRAGMA table_info(telegram_bandeja)")}
+            for columna, definicion in COLUMNAS_SQLITE_POSTERIORES.items():
+                if columna not in columnas:
+                    conn.execute(f"ALTER TABLE telegram_bandeja ADD COLUMN {columna} {definicion}")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_bandeja_estado_proximo "
+                "ON telegram_bandeja (estado, proximo_intento)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_bandeja_reclamo ON telegram_bandeja (reclamo)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _conectar(self):
+        # Una conexión por operación: SQLite abre en microsegundos y así no se comparte entre hilos
+        return sqlite3.connect(self.ruta, timeout=30)
+
+
+class BandejaTelegram:
+    """
+    Bandeja de salida con su hilo de entrega
+
+    encolar() solo escribe en la tabla y despierta al hilo. La entrega es al menos una vez:
+    un mensaje se marca como enviado justo después de que Telegram lo acepte, y la clave
+    impide que el mismo aviso se encole dos veces. De un mensaje partido en varias partes,
+    un reintento solo envía las que faltan.
+    """
+
+    def __init__(
+        self,
+        almacen: AlmacenBandeja,
+        max_intentos: int = 8,
+        backoff_base: float = 2.0,
+        backoff_max: float = 300.0
+    ):
+        """
+        Args:
+            almacen: Tabla donde viven los mensajes
+            max_intentos: Intentos por mensaje antes de marcarlo como fallido
+            backoff_base: Espera tras el primer fallo (se duplica en cada intento)
+            backoff_max: Tope de la espera entre intentos
+        """
+        self.almacen = almacen
+        self.max_intentos = max_intentos
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._despertar = threading.Event()
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def encolar(
+        self,
+        clave: str,
+        bot_token: str,
+        chat_id: str,
+        texto: str,
+        parse_mode: Optional[str] = None,
+        user_id: Optional[int] = None,
+        imagenes_base64: Optional[List[str]] = None,
+        mime_types: Optional[List[str]] = None
+    ) -> Dict:
+        """
+        Guarda el mensaje para entregarlo en segundo plano
+
+        Args:
+            imagenes_base64: Capturas a adjuntar con el texto como leyenda (None = solo texto)
+            mime_types: Tipo MIME de cada captura
+
+        Returns:
+            Dict con exito, mensaje, clave y nuevo (False si la clave ya estaba encolada)
+        """
+        try:
+            imagenes = None
+            if imagenes_base64:
+                imagenes = json.dumps({"imagenes_base64": imagenes_base64, "mime_types": mime_types or []})
+            nuevo = self.almacen.insertar(clave, user_id, bot_token, chat_id, texto, parse_mode, imagenes)
+        except Exception as e:
+            return {"exito": False, "mensaje": f"❌ No se pudo encolar para Telegram: {str(e)}", "clave": clave}
+
+        self.iniciar()
+        self._despertar.set()
+        return {"exito": True, "mensaje": "📨 Señal en cola de envío a Telegram", "clave": clave, "nuevo": nuevo}
+
+    def iniciar(self):
+        """Arranca el hilo de entrega si no está corriendo"""
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._parar.clear()
+                self._hilo = threading.Thread(target=self._bucle, name="redi7-bandeja-telegram", daemon=True)
+                self._hilo.start()
+
+    def detener(self, timeout: float = 5.0):
+        self._parar.set()
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+
+    def _espera_reintento(self, intentos: int) -> float:
+        """Backoff exponencial con jitter (la mitad fija, la mitad aleatoria)"""
+        espera = min(self.backoff_max, self.backoff_base * 2 ** max(0, intentos - 1))
+        return espera / 2 + random.uniform(0, espera / 2)
+
+    def _duracion_maxima(self, mensaje: Dict) -> float:
+        """Peor caso de una entrega: cada parte con su timeout y su espera por 429, más la subida de capturas"""
+        partes = len(dividir_mensaje(mensaje["texto"], mensaje["parse_mode"])) - mensaje["partes_enviadas"]
+        segundos = max(1, partes) * (TIMEOUT_MENSAJE + ESPERA_MAXIMA_ENTRE_PARTES)
+        if mensaje["imagenes"]:
+            segundos += TIMEOUT_IMAGENES
+        return segundos
+
+    def _entregar(self, mensaje: Dict):
+        sender = TelegramSender(bot_token=mensaje["bot_token"], chat_id=mensaje["chat_id"])
+        limitador = obtener_limitador(sender.bot_token)
+        espera = limitador.reservar(sender.chat_id)
+        # Los mensajes anteriores del lote pudieron agotar la reserva inicial: alargarla antes de enviar
+        hasta = time.time() + espera + self._duracion_maxima(mensaje) + SEGUNDOS_RECLAMO
+        if not self.almacen.renovar(mensaje, hasta):
+            print(f"⚠️ Bandeja Telegram: el mensaje {mensaje['id']} ya lo reclamó otro hilo")
+            return
+        if espera > 0:
+            time.sleep(espera)
+
+        if mensaje["imagenes"]:
+            imagenes = json.loads(mensaje["imagenes"])
+            resultado = sender.enviar_con_imagenes(
+                sender.chat_id,
+                mensaje["texto"],
+                imagenes["imagenes_base64"],
+                imagenes["mime_types"],
+                mensaje["parse_mode"],
+                desde_parte=mensaje["partes_enviadas"]
+            )
+        else:
+            resultado = sender.enviar_a(
+                sender.chat_id,
+                mensaje["texto"],
+                mensaje["parse_mode"],
+                desde_parte=mensaje["partes_enviadas"]
+            )
+        intentos = mensaje["intentos"] + 1
+        codigo = resultado.get("codigo")
+        partes_enviadas = resultado.get("partes_enviadas", mensaje["partes_enviadas"])
+
+        if resultado["exito"]:
+            self.almacen.completar(mensaje, resultado.get("message_id"))
+            obtener_metricas().observar("telegram.bandeja.entrega", time.time() - mensaje["creado"])
+            return
+
+        error = resultado["mensaje"]
+        if codigo in CODIGOS_PERMANENTES or intentos >= self.max_intentos:
+            print(f"📭 Bandeja Telegram: mensaje {mensaje['id']} descartado tras {intentos} intento(s): {error}")
+            self.almacen.descartar(mensaje, error, partes_enviadas)
+            return
+
+        if codigo == 429:
+            espera = float(resultado.get("retry_after", 1))
+            limitador.aplazar(espera)
+        else:
+            espera = self._espera_reintento(intentos)
+        print(f"🔁 Bandeja Telegram: mensaje {mensaje['id']} reintento en {espera:.0f}s ({error})")
+        self.almacen.reprogramar(mensaje, time.time() + espera, error, partes_enviadas)
+
+    def procesar_pendientes(self) -> int:
+        """Entrega un lote de mensajes vencidos; devuelve cuántos se intentaron"""
+        mensajes = self.almacen.reclamar()
+        for mensaje in mensajes:
+            try:
+                self._entregar(mensaje)
+            except Exception as e:
+                # Sin marcar: el reclamo caduca y se reintenta más tarde
+                print(f"⚠️ Bandeja Telegram: error entregando el mensaje {mensaje['id']}: {e}")
+        return len(mensajes)
+
+    def _bucle(self):
+        while not self._parar.is_set():
+            try:
+                if self.procesar_pendientes():
+                    continue
+                proximo = self.almacen.proximo_vencimiento()
+                # Sin pendientes se revisa cada minuto por si hay reclamos caducados de otro proceso
+                espera = 60.0 if proximo is None else min(60.0, max(0.05, proximo - time.time()))
+            except Exception as e:
+                print(f"⚠️ Bandeja Telegram: {e}")
+                espera = 5.0
+            self._despertar.wait(espera)
+            self._despertar.clear()
+
+    def consultar(self, clave: str) -> Optional[Dict]:
+        """Estado de entrega de un mensaje (None si no existe o la base no responde)"""
+        try:
+            return self.almacen.consultar(clave)
+        except Exception as e:
+            print(f"⚠️ Bandeja Telegram: no se pudo consultar {clave[:8]}: {e}")
+            return None
+
+    def estadisticas(self) -> Dict:
+        try:
+            por_estado = self.almacen.estadisticas()
+        except Exception as e:
+            por_estado = {"error": str(e)}
+        return {
+            "almacen": type(self.almacen).__name__,
+            "por_estado": por_estado,
+            "hilo_activo": self._hilo is not None and self._hilo.is_alive()
+        }
+
+
+_bandeja: Optional[BandejaTelegram] = None
+_bandeja_lock = threading.Lock()
+
+
+def obtener_bandeja_telegram(pool=None) -> BandejaTelegram:
+    """
+    Bandeja del proceso (compartida por todas las sesiones), con el hilo de entrega arrancado
+
+    Args:
+        pool: Pool MySQL de la app; sin pool, o con TELEGRAM_BANDEJA="sqlite", usa el archivo local
+    """
+    global _bandeja
+    if _bandeja is None:
+        with _bandeja_lock:
+            if _bandeja is None:
+                if TELEGRAM_BANDEJA == "mysql" and pool is not None:
+                    almacen = AlmacenMySQL(pool)
+                else:
+                    almacen = AlmacenSQLite(TELEGRAM_BANDEJA_SQLITE)
+                bandeja = BandejaTelegram(
+                    almacen,
+                    TELEGRAM_BANDEJA_INTENTOS,
+                    TELEGRAM_BANDEJA_BACKOFF_BASE,
+                    TELEGRAM_BANDEJA_BACKOFF_MAX
+                )
+                # Entregar lo que quedó pendiente de una ejecución anterior
+                bandeja.iniciar()
+                _bandeja = bandeja
+    return _bandeja
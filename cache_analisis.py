@@ -0,0 +1,271 @@
+"""
+Caché direccionada por contenido para los análisis con imágenes de REDI7 IA
+Evita reenviar a GPT-4o las mismas capturas tras un rerun o un corte de red, y agrupa
+en una sola llamada las peticiones idénticas que llegan a la vez (vuelo único)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from cache_ttl import CacheTTL
+from config import CACHE_ANALISIS_DIR, CACHE_ANALISIS_MAX_ENTRADAS
+
+# Vida de un análisis según la temporalidad más rápida del set (una vela)
+TTL_POR_TEMPORALIDAD = {
+    "M1": 60,
+    "M5": 5 * 60,
+    "M15": 15 * 60,
+    "M30": 30 * 60,
+    "H1": 60 * 60,
+    "H4": 4 * 60 * 60,
+    "D1": 24 * 60 * 60,
+    "W1": 7 * 24 * 60 * 60
+}
+
+
+def ttl_para_temporalidades(temporalidades: List[str]) -> int:
+    """Devuelve la vida en segundos según la temporalidad más corta (la de entrada)"""
+    ttls = [TTL_POR_TEMPORALIDAD[tf.upper()] for tf in temporalidades if tf.upper() in TTL_POR_TEMPORALIDAD]
+    return min(ttls) if ttls else TTL_POR_TEMPORALIDAD["M15"]
+
+
+def clave_analisis(
+    imagenes_base64: List[str],
+    detail_levels: List[str],
+    activo: str,
+    modo: str,
+    dispositivo: str,
+    temporalidades: List[str],
+    version_prompt: str,
+    extra: str = ""
+) -> str:
+    """
+    Calcula la clave SHA-256 de un análisis a partir de todo lo que influye en la respuesta
+
+    Returns:
+        Hash hexadecimal estable para las mismas imágenes y parámetros
+    """
+    h = hashlib.sha256()
+    for parte in (activo.upper(), modo.upper(), dispositivo.upper(), version_prompt, extra):
+        h.update(parte.encode("utf-8"))
+        h.update(b"\0")
+    for tf, detail in zip(temporalidades, detail_levels):
+        h.update(f"{tf}:{detail}".encode("utf-8"))
+        h.update(b"\0")
+    for img in imagenes_base64:
+        h.update(hashlib.sha256(img.encode("ascii")).digest())
+    return h.hexdigest()
+
+
+class CacheAnalisis:
+    """Caché de dos niveles: memoria acotada (LRU) y disco opcional"""
+
+    def __init__(self, max_entradas: int = 200, directorio: str = ""):
+        """
+        Args:
+            max_entradas: Máximo de análisis en memoria
+            directorio: Carpeta para el nivel en disco ('' lo desactiva)
+        """
+        self.memoria = CacheTTL(max_entradas=max_entradas, ttl=TTL_POR_TEMPORALIDAD["M15"])
+        self.directorio = directorio
+        self.aciertos_disco = 0
+        self._lock_disco = threading.Lock()
+
+    def _ruta(self, clave: str) -> str:
+        return os.path.join(self.directorio, clave[:2], f"{clave}.json")
+
+    def obtener(self, clave: str) -> Optional[Dict]:
+        """Busca un análisis en memoria y, si no está, en disco"""
+        valor = self.memoria.obtener(clave)
+        if valor is not None or not self.directorio:
+            return valor
+
+        ruta = self._ruta(clave)
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                entrada = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        restante = entrada.get("expira", 0) - time.time()
+        if restante <= 0:
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+            return None
+
+        # Subir a memoria con la vida que le queda
+        self.aciertos_disco += 1
+        self.memoria.guardar(clave, entrada["valor"], ttl=restante)
+        return entrada["valor"]
+
+    def guardar(self, clave: str, valor: Dict, ttl: float):
+        """Guarda un análisis en memoria y, si está activado, en disco"""
+        self.memoria.guardar(clave, valor, ttl=ttl)
+        if not self.directorio:
+            return
+
+        ruta = self._ruta(clave)
+        try:
+            os.makedirs(os.path.dirname(ruta), exist_ok=True)
+            temporal = f"{ruta}.{threading.get_ident()}.tmp"
+            with self._lock_disco:
+                with open(temporal, "w", encoding="utf-8") as f:
+                    json.dump({"expira": time.time() + ttl, "valor": valor}, f, ensure_ascii=False)
+                os.replace(temporal, ruta)
+        except OSError as e:
+            print(f"⚠️ No se pudo guardar el análisis en caché de disco: {e}")
+
+    def estadisticas(self) -> Dict:
+        """Estadísticas de la caché en memoria más aciertos en disco"""
+        stats = self.memoria.estadisticas()
+        stats["aciertos_disco"] = self.aciertos_disco
+        stats["disco"] = bool(self.directorio)
+        return stats
+
+
+class VueloCancelado(Exception):
+    """El líder de un vuelo se canceló sin resultado: los que esperaban deben llamar ellos"""
+
+
+class VuelosEnCurso:
+    """
+    Vuelo único (singleflight): llamadas concurrentes con la misma clave comparten una
+
+    El primero en llegar (líder) hace la llamada a la API; los demás esperan su resultado
+    o su error. La clave es la misma de la caché, así que solo se agrupan peticiones cuyo
+    resultado también se podría servir desde caché.
+    """
+
+    def __init__(self):
+        self._vuelos: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.lideres = 0
+        self.compartidos = 0
+
+    def tomar(self, clave: str) -> Tuple[Future, bool]:
+        """Devuelve (futuro del vuelo, True si quien llama es el líder y debe resolverlo)"""
+        with self._lock:
+            futuro = self._vuelos.get(clave)
+            if futuro is not None:
+                self.compartidos += 1
+                return futuro, False
+            futuro = self._vuelos[clave] = Future()
+            self.lideres += 1
+            return futuro, True
+
+    def terminar(self, clave: str, futuro: Future, valor=None, error: Optional[BaseException] = None):
+        """El líder publica el resultado (o el error) y libera la clave para nuevas llamadas"""
+        with self._lock:
+            if self._vuelos.get(clave) is futuro:
+                del self._vuelos[clave]
+        if futuro.done():
+            return
+        if error is not None:
+            futuro.set_exception(error)
+        else:
+            futuro.set_result(valor)
+
+    def unirse(self, clave: str) -> Tuple[Optional[object], Optional[Future]]:
+        """
+        Espera el vuelo en curso con esa clave o se convierte en su líder
+
+        Returns:
+            (valor, None) si otra llamada lo resolvió, o (None, futuro) si quien llama
+            es el líder y debe publicar el resultado con terminar()
+        """
+        while True:
+            futuro, lider = self.tomar(clave)
+            if lider:
+                return None, futuro
+            try:
+                return futuro.result(), None
+            except VueloCancelado:
+                continue
+
+    def ejecutar(self, clave: Optional[str], funcion: Callable):
+        """
+        Ejecuta `funcion()` una sola vez por clave entre llamadas concurrentes
+
+        Returns:
+            (valor, compartido): compartido es True si el valor lo obtuvo otra llamada
+        """
+        if clave is None:
+            return funcion(), False
+        valor, futuro = self.unirse(clave)
+        if futuro is None:
+            return valor, True
+
+        try:
+            valor = funcion()
+        except BaseException as e:
+            self.terminar(clave, futuro, error=e)
+            raise
+        self.terminar(clave, futuro, valor=valor)
+        return valor, False
+
+    async def ejecutar_async(self, clave: Optional[str], funcion: Callable[[], Awaitable]):
+        """Versión asíncrona de ejecutar (la espera no bloquea el event loop)"""
+        if clave is None:
+            return await funcion(), False
+        while True:
+            futuro, lider = self.tomar(clave)
+            if lider:
+                break
+            try:
+                # shield: si cancelan a quien espera, el futuro compartido sigue intacto
+                return await asyncio.shield(asyncio.wrap_future(futuro)), True
+            except VueloCancelado:
+                continue
+
+        try:
+            valor = await funcion()
+        except asyncio.CancelledError:
+            self.terminar(clave, futuro, error=VueloCancelado())
+            raise
+        except BaseException as e:
+            self.terminar(clave, futuro, error=e)
+            raise
+        self.terminar(clave, futuro, valor=valor)
+        return valor, False
+
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            return {"en_curso": len(self._vuelos), "lideres": self.lideres, "compartidos": self.compartidos}
+
+
+_cache_compartida: Optional[CacheAnalisis] = None
+_cache_lock = threading.Lock()
+
+
+def obtener_cache_analisis() -> CacheAnalisis:
+    """Devuelve la caché de análisis del proceso (compartida por todas las sesiones)"""
+    global _cache_compartida
+    if _cache_compartida is None:
+        with _cache_lock:
+            if _cache_compartida is None:
+                _cache_compartida = CacheAnalisis(
+                    max_entradas=CACHE_ANALISIS_MAX_ENTRADAS,
+                    directorio=CACHE_ANALISIS_DIR
+                )
+    return _cache_compartida
+
+
+_vuelos_compartidos: Optional[VuelosEnCurso] = None
+
+
+def obtener_vuelos_en_curso() -> VuelosEnCurso:
+    """Devuelve el registro de vuelos en curso del proceso (compartido por todas las sesiones)"""
+    global _vuelos_compartidos
+    if _vuelos_compartidos is None:
+        with _cache_lock:
+            if _vuelos_compartidos is None:
+                _vuelos_compartidos = VuelosEnCurso()
+    return _vuelos_compartidos
@@ -0,0 +1,102 @@
+"""
+Caché en memoria con expiración (TTL) y desalojo LRU para REDI7 IA
+Compartida entre hilos/sesiones de Streamlit del mismo proceso
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class CacheTTL:
+    """Caché acotada: cada entrada caduca a los `ttl` segundos y se desaloja la menos usada"""
+
+    _AUSENTE = object()
+
+    def __init__(self, max_entradas: int = 1000, ttl: float = 60.0):
+        """
+        Args:
+            max_entradas: Número máximo de entradas antes de desalojar por LRU
+            ttl: Segundos de vida por defecto de cada entrada
+        """
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+
+    def obtener(self, clave: Hashable, defecto: Any = None) -> Any:
+        """Devuelve el valor vigente de la clave o `defecto` (cuenta acierto/fallo)"""
+        with self._lock:
+            entrada = self._datos.get(clave, self._AUSENTE)
+            if entrada is self._AUSENTE:
+                self.fallos += 1
+                return defecto
+
+            valor, expira = entrada
+            if expira <= time.monotonic():
+                del self._datos[clave]
+                self.fallos += 1
+                return defecto
+
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return valor
+
+    def guardar(self, clave: Hashable, valor: Any, ttl: Optional[float] = None):
+        """Guarda un valor; `ttl` permite una vida distinta a la de la caché"""
+        expira = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._datos[clave] = (valor, expira)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+                self.desalojos += 1
+
+    def actualizar(self, clave: Hashable, funcion: Callable[[Any], Any]) -> bool:
+        """
+        Aplica `funcion` al valor vigente conservando su expiración (escritura directa)
+
+        Returns:
+            True si la clave estaba en caché y se actualizó
+        """
+        with self._lock:
+            entrada = self._datos.get(clave, self._AUSENTE)
+            if entrada is self._AUSENTE or entrada[1] <= time.monotonic():
+                return False
+            self._datos[clave] = (funcion(entrada[0]), entrada[1])
+            return True
+
+    def invalidar(self, clave: Hashable):
+        """Elimina una clave si existe"""
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def invalidar_donde(self, condicion: Callable[[Hashable], bool]) -> int:
+        """Elimina todas las claves que cumplen la condición; devuelve cuántas"""
+        with self._lock:
+            claves = [clave for clave in self._datos if condicion(clave)]
+            for clave in claves:
+                del self._datos[clave]
+            return len(claves)
+
+    def limpiar(self):
+        """Vacía la caché (los contadores se conservan)"""
+        with self._lock:
+            self._datos.clear()
+
+    def estadisticas(self) -> Dict[str, Any]:
+        """Devuelve aciertos, fallos, tasa de acierto y tamaño actual"""
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._datos),
+                "max_entradas": self.max_entradas,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "desalojos": self.desalojos,
+                "tasa_acierto": round(self.aciertos / total, 3) if total else 0.0
+            }
@@ -0,0 +1,319 @@
+"""
+Cola de análisis en segundo plano para REDI7 IA
+Los análisis corren en un pool de hilos del proceso: la sesión de Streamlit solo guarda
+el id del trabajo y consulta su estado, así un rerun no pierde un análisis ya facturado.
+El orden de salida lo decide el planificador por plan (planificador.py), no la llegada.
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from config import (
+    LIMITE_TRABAJOS_POR_PLAN,
+    MAX_COLA_ANALISIS,
+    MAX_TRABAJADORES_ANALISIS,
+    PESOS_PLAN,
+    TOKENS_POR_MINUTO
+)
+from metricas import obtener_metricas
+from planificador import PlanificadorPlanes, estimar_tokens
+from redi7_ai import REDI7AI
+
+# Estados de un trabajo
+EN_COLA = "en_cola"
+EN_CURSO = "en_curso"
+COMPLETADO = "completado"
+ERROR = "error"
+CANCELADO = "cancelado"
+
+ESTADOS_ACTIVOS = (EN_COLA, EN_CURSO)
+
+# Segundos que se conserva un trabajo terminado para que la sesión lo recoja
+RETENCION_TERMINADOS = 30 * 60
+
+
+class TrabajoAnalisis:
+    """Un análisis enviado a la cola, con su progreso y resultado"""
+
+    def __init__(
+        self,
+        user_id: int,
+        plan: str,
+        params: Dict,
+        al_terminar: Optional[Callable] = None,
+        api_key: str = ""
+    ):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.plan = plan
+        self.params = params
+        self.api_key = api_key
+        self.al_terminar = al_terminar
+        self.estado = EN_COLA
+        self.texto = ""
+        self.gestion = None
+        self.resultado = None
+        self.mensaje = ""
+        self.extra: Dict = {}
+        self.creado = time.time()
+        self.iniciado = None
+        self.terminado = None
+        self.cancelar_evento = threading.Event()
+
+    def instantanea(self) -> Dict:
+        """Copia del estado para la interfaz (no expone params ni callbacks)"""
+        return {
+            "id": self.id,
+            "estado": self.estado,
+            "texto": self.texto,
+            "gestion": self.gestion,
+            "resultado": self.resultado,
+            "mensaje": self.mensaje,
+            "extra": dict(self.extra),
+            "creado": self.creado,
+            "iniciado": self.iniciado,
+            "terminado": self.terminado
+        }
+
+
+class ColaAnalisis:
+    """Pool de hilos acotado con límite de trabajos simultáneos por plan"""
+
+    def __init__(
+        self,
+        max_trabajadores: int = 4,
+        max_cola: int = 50,
+        limites_plan: Optional[Dict[str, int]] = None,
+        planificador: Optional[PlanificadorPlanes] = None
+    ):
+        """
+        Args:
+            max_trabajadores: Análisis ejecutándose a la vez en el proceso
+            max_cola: Trabajos activos (en cola + en curso) admitidos en total
+            limites_plan: Trabajos activos por usuario según su plan
+            planificador: Decide el orden de salida (por defecto reparto por plan sin límite de tokens)
+        """
+        self.max_cola = max_cola
+        self.limites_plan = limites_plan or {"free": 1}
+        self.planificador = planificador or PlanificadorPlanes({"free": 1})
+        self._ejecutor = ThreadPoolExecutor(max_workers=max_trabajadores, thread_name_prefix="redi7-analisis")
+        self._trabajos: Dict[str, TrabajoAnalisis] = {}
+        self._motores: Dict[str, REDI7AI] = {}
+        self._lock = threading.Lock()
+
+    def _motor(self, api_key: str) -> REDI7AI:
+        """Un motor por API key: el cliente de OpenAI es seguro entre hilos y reutiliza conexiones"""
+        with self._lock:
+            if api_key not in self._motores:
+                self._motores[api_key] = REDI7AI(api_key=api_key)
+            return self._motores[api_key]
+
+    def enviar(
+        self,
+        user_id: int,
+        plan: str,
+        api_key: str,
+        params: Dict,
+        al_terminar: Optional[Callable[[TrabajoAnalisis], None]] = None
+    ) -> Dict:
+        """
+        Encola un análisis con imágenes
+
+        Args:
+            user_id: Usuario que lo solicita
+            plan: Plan del usuario (limita sus trabajos simultáneos)
+            api_key: Clave de OpenAI
+            params: Parámetros de REDI7AI.analizar_con_imagenes_stream
+            al_terminar: Se llama en el hilo del trabajo al completarse, fallar o cancelarse
+
+        Returns:
+            Dict con success, mensaje y job_id
+        """
+        self.purgar_terminados()
+        limite = self.limites_plan.get(plan, self.limites_plan.get("free", 1))
+
+        with self._lock:
+            activos = [t for t in self._trabajos.values() if t.estado in ESTADOS_ACTIVOS]
+            if len(activos) >= self.max_cola:
+                return {"success": False, "mensaje": "El servidor está saturado, inténtalo en unos segundos", "job_id": None}
+            if sum(1 for t in activos if t.user_id == user_id) >= limite:
+                return {
+                    "success": False,
+                    "mensaje": f"Ya tienes {limite} análisis en curso (máximo de tu plan {plan.upper()})",
+                    "job_id": None
+                }
+
+            trabajo = TrabajoAnalisis(user_id, plan, params, al_terminar, api_key)
+            self._trabajos[trabajo.id] = trabajo
+
+        # Cada envío aporta un turno al pool; qué trabajo lo usa lo decide el planificador
+        self.planificador.encolar(trabajo, plan, estimar_tokens(params))
+        self._ejecutor.submit(self._despachar)
+        return {"success": True, "mensaje": "Análisis en cola", "job_id": trabajo.id}
+
+    def _despachar(self):
+        """Toma el siguiente trabajo según plan y presupuesto de tokens y lo ejecuta"""
+        salida = self.planificador.siguiente()
+        if salida is None:
+            # El trabajo de este turno se canceló antes de salir
+            return
+        trabajo, consumo = salida
+        try:
+            self._ejecutar(trabajo, trabajo.api_key)
+        finally:
+            tokens = (trabajo.resultado or {}).get("tokens_usados", 0) if trabajo.estado == COMPLETADO else 0
+            self.planificador.ajustar(consumo, tokens)
+
+    def _ejecutar(self, trabajo: TrabajoAnalisis, api_key: str):
+        """Ejecuta un trabajo en un hilo del pool (los tramos medidos dentro forman una solicitud)"""
+        metricas = obtener_metricas()
+        metricas.observar("cola.espera", time.time() - trabajo.creado)
+        etiquetas = {"job_id": trabajo.id[:8], "plan": trabajo.plan, "activo": trabajo.params.get("activo", "")}
+        with metricas.solicitud("analisis.completo", **etiquetas):
+            self._procesar(trabajo, api_key)
+
+    def _procesar(self, trabajo: TrabajoAnalisis, api_key: str):
+        if trabajo.cancelar_evento.is_set():
+            trabajo.estado = CANCELADO
+            trabajo.mensaje = "Análisis cancelado"
+            self._terminar(trabajo)
+            return
+
+        trabajo.estado = EN_CURSO
+        trabajo.iniciado = time.time()
+
+        try:
+            eventos = self._motor(api_key).analizar_con_imagenes_stream(**trabajo.params)
+            for evento in eventos:
+                if trabajo.cancelar_evento.is_set():
+                    # Cerrar el generador corta la conexión con la API
+                    eventos.close()
+                    break
+                if evento["tipo"] == "texto":
+                    trabajo.texto = evento["texto"]
+                elif evento["tipo"] == "gestion":
+                    trabajo.gestion = evento["gestion"]
+                else:
+                    trabajo.resultado = evento["resultado"]
+
+            if trabajo.cancelar_evento.is_set():
+                trabajo.estado = CANCELADO
+                trabajo.mensaje = "Análisis cancelado"
+            elif trabajo.resultado is None or trabajo.resultado.get("error"):
+                trabajo.estado = ERROR
+                trabajo.mensaje = (trabajo.resultado or {}).get("mensaje", "El análisis no devolvió resultado")
+            else:
+                trabajo.estado = COMPLETADO
+        except Exception as e:
+            trabajo.estado = ERROR
+            trabajo.mensaje = f"Error durante el análisis: {str(e)}"
+        finally:
+            self._terminar(trabajo)
+
+    def _terminar(self, trabajo: TrabajoAnalisis):
+        """
+        Ejecuta el callback del trabajo (cupo, historial, Telegram...) y lo marca como terminado
+
+        La interfaz espera a `terminado` para mostrar el resultado, así ya ve lo que hizo el callback.
+        """
+        if trabajo.al_terminar:
+            try:
+                with obtener_metricas().tramo("cola.cierre"):
+                    trabajo.al_terminar(trabajo)
+            except Exception as e:
+                print(f"⚠️ Error en el cierre del trabajo {trabajo.id}: {e}")
+        # Las capturas solo hacían falta hasta el cierre: no retenerlas los 30 min del trabajo terminado
+        trabajo.params = {k: v for k, v in trabajo.params.items() if k not in ("imagenes_base64", "mime_types")}
+        trabajo.terminado = time.time()
+
+    def estado(self, job_id: str) -> Optional[Dict]:
+        """Instantánea de un trabajo (None si no existe o ya se purgó)"""
+        with self._lock:
+            trabajo = self._trabajos.get(job_id)
+        if trabajo is None:
+            return None
+
+        instantanea = trabajo.instantanea()
+        if trabajo.estado == EN_COLA:
+            instantanea["posicion"] = self.planificador.posicion(trabajo) or 1
+        return instantanea
+
+    def cancelar(self, job_id: str, user_id: Optional[int] = None) -> bool:
+        """
+        Cancela un trabajo en cola o en curso
+
+        Args:
+            job_id: Trabajo a cancelar
+            user_id: Si se indica, solo cancela trabajos de ese usuario
+
+        Returns:
+            True si el trabajo estaba activo y se canceló
+        """
+        with self._lock:
+            trabajo = self._trabajos.get(job_id)
+        if trabajo is None or trabajo.estado not in ESTADOS_ACTIVOS:
+            return False
+        if user_id is not None and trabajo.user_id != user_id:
+            return False
+
+        trabajo.cancelar_evento.set()
+
+        # Si aún no salió de la cola, se cierra aquí; si ya está en curso, lo cierra su hilo
+        if self.planificador.retirar(trabajo):
+            trabajo.estado = CANCELADO
+            trabajo.mensaje = "Análisis cancelado"
+            self._terminar(trabajo)
+        return True
+
+    def trabajos_usuario(self, user_id: int) -> List[Dict]:
+        """Trabajos conocidos de un usuario, más recientes primero"""
+        with self._lock:
+            trabajos = [t for t in self._trabajos.values() if t.user_id == user_id]
+        return [t.instantanea() for t in sorted(trabajos, key=lambda t: t.creado, reverse=True)]
+
+    def purgar_terminados(self) -> int:
+        """Elimina trabajos terminados hace más de RETENCION_TERMINADOS; devuelve cuántos"""
+        limite = time.time() - RETENCION_TERMINADOS
+        with self._lock:
+            viejos = [
+                job_id for job_id, t in self._trabajos.items()
+                if t.estado not in ESTADOS_ACTIVOS and t.terminado and t.terminado < limite
+            ]
+            for job_id in viejos:
+                del self._trabajos[job_id]
+        return len(viejos)
+
+    def estadisticas(self) -> Dict:
+        """Trabajos por estado y ocupación de la cola"""
+        with self._lock:
+            por_estado = {}
+            for t in self._trabajos.values():
+                por_estado[t.estado] = por_estado.get(t.estado, 0) + 1
+        return {
+            "por_estado": por_estado,
+            "activos": por_estado.get(EN_COLA, 0) + por_estado.get(EN_CURSO, 0),
+            "max_cola": self.max_cola,
+            "planificador": self.planificador.estadisticas()
+        }
+
+
+_cola_compartida: Optional[ColaAnalisis] = None
+_cola_lock = threading.Lock()
+
+
+def obtener_cola_analisis() -> ColaAnalisis:
+    """Devuelve la cola de análisis del proceso (compartida por todas las sesiones)"""
+    global _cola_compartida
+    if _cola_compartida is None:
+        with _cola_lock:
+            if _cola_compartida is None:
+                _cola_compartida = ColaAnalisis(
+                    max_trabajadores=MAX_TRABAJADORES_ANALISIS,
+                    max_cola=MAX_COLA_ANALISIS,
+                    limites_plan=LIMITE_TRABAJOS_POR_PLAN,
+                    planificador=PlanificadorPlanes(PESOS_PLAN, TOKENS_POR_MINUTO)
+                )
+    return _cola_compartida
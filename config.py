@@ -15,6 +15,8 @@ load_dotenv()
 
 # OpenAI API Key (recomendado usar variable de entorno)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+# Vacío = API oficial; para pruebas locales: http://127.0.0.1:8787/v1 (servidor_openai_local.py)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "")
 
 # Modelo a utilizar
 # Opciones: "gpt-4", "gpt-4-turbo", "gpt-3.5-turbo"
@@ -34,6 +36,28 @@ TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "")
 # Activar envío automático a Telegram (True/False)
 TELEGRAM_ENABLED = bool(TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID)
 
+# URL base de la Bot API (para pruebas locales: http://127.0.0.1:8788, servidor_telegram_local.py)
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")
+
+# Segundos que se recuerda la validación de un bot (getMe) por token; menos si resultó inválido
+TELEGRAM_CACHE_BOT_TTL = 3600
+TELEGRAM_CACHE_BOT_TTL_INVALIDO = 60
+
+# Segundos que se reutiliza el file_id de una captura ya subida (evita volver a subir los bytes)
+TELEGRAM_CACHE_FILE_ID_TTL = 24 * 3600
+
+# Conexiones keep-alive abiertas como máximo hacia la Bot API (sesión compartida del proceso)
+TELEGRAM_MAX_CONEXIONES = 16
+
+# Difusión de una señal a muchos chats (difusion_telegram.py), según los límites de Telegram:
+# ~30 mensajes/s en total, 1 mensaje/s por chat privado y 20 mensajes/min por grupo
+TELEGRAM_MENSAJES_POR_SEGUNDO = 25
+TELEGRAM_SEGUNDOS_POR_CHAT = 1.0
+TELEGRAM_MENSAJES_POR_MINUTO_GRUPO = 20
+# Envíos simultáneos y reintentos tras un 429 (se espera el retry_after indicado)
+TELEGRAM_DIFUSION_CONCURRENCIA = 16
+TELEGRAM_REINTENTOS_429 = 3
+
 # ━━━━━━━━━━━━━━━━━━━━━━
 # �📊 TRADING CONFIGURATION
 # ━━━━━━━━━━━━━━━━━━━━━━
@@ -105,6 +129,22 @@ DIR_ANALISIS = "analisis_guardados"
 # Directorio para capturas MT5
 DIR_CAPTURAS = "capturas_mt5"
 
+# Límite de llamadas por minuto del análisis por lotes (analisis_lote.py)
+ANALISIS_LOTE_POR_MINUTO = 20
+
+# Vigilante de capturas (vigilante_capturas.py)
+# Segundos entre sondeos de DIR_CAPTURAS
+VIGILANTE_INTERVALO = 1.0
+
+# Segundos sin cambios antes de dar un set por escrito
+VIGILANTE_DEBOUNCE = 2.0
+
+# Sets pendientes por activo (al llenarse se descarta el más antiguo)
+VIGILANTE_COLA_POR_ACTIVO = 3
+
+# Análisis simultáneos por activo
+VIGILANTE_TRABAJADORES_POR_ACTIVO = 1
+
 # ━━━━━━━━━━━━━━━━━━━━━━
 # 🔧 ADVANCED SETTINGS
 # ━━━━━━━━━━━━━━━━━━━━━━
@@ -116,9 +156,68 @@ TEMPERATURE = 0.7
 # Máximo de tokens en la respuesta
 MAX_TOKENS = 2000
 
-# Timeout para llamadas API (segundos)
+# Timeout para llamadas API (segundos, por intento)
 API_TIMEOUT = 30
 
+# Reintentos ante 429/5xx/timeouts (resiliencia.py): intentos totales, backoff y plazo máximo
+API_REINTENTOS = 3
+API_BACKOFF_BASE = 1.0
+API_BACKOFF_MAX = 20.0
+API_PLAZO_TOTAL = 90.0
+
+# Cortacircuitos: fallos seguidos del proveedor que lo abren y segundos que permanece abierto
+CIRCUITO_UMBRAL_FALLOS = 5
+CIRCUITO_SEGUNDOS_ABIERTO = 30.0
+
+# Salida estructurada: el modelo devuelve la señal como JSON tipado (sin parseo de texto)
+SALIDA_ESTRUCTURADA = True
+
+# Análisis simultáneos máximos en un lote (AsyncREDI7AI.analizar_lote)
+MAX_CONCURRENCIA_ANALISIS = 5
+
+# Cola de análisis en segundo plano (cola_analisis.py)
+# Análisis ejecutándose a la vez en el proceso
+MAX_TRABAJADORES_ANALISIS = 4
+
+# Trabajos activos (en cola + en curso) admitidos en total
+MAX_COLA_ANALISIS = 50
+
+# Trabajos activos por usuario según su plan
+LIMITE_TRABAJOS_POR_PLAN = {
+    "free": 1,
+    "pro": 2,
+    "elite": 5
+}
+
+# Planificador de llamadas al modelo (planificador.py)
+# Peso de cada plan en el reparto de turnos cuando hay cola (elite recibe 6 por cada 1 de free)
+PESOS_PLAN = {"free": 1, "pro": 3, "elite": 6}
+# Presupuesto global de tokens por minuto hacia OpenAI (0 = sin límite)
+TOKENS_POR_MINUTO = 150000
+
+# Bandeja de salida de Telegram (bandeja_telegram.py)
+# Almacén: "mysql" (base de la app, migración 3) o "sqlite" (archivo local)
+TELEGRAM_BANDEJA = os.getenv("TELEGRAM_BANDEJA", "mysql")
+TELEGRAM_BANDEJA_SQLITE = os.path.join(DIR_ANALISIS, "bandeja_telegram.db")
+# Intentos por mensaje antes de darlo por fallido y backoff entre ellos (segundos)
+TELEGRAM_BANDEJA_INTENTOS = 8
+TELEGRAM_BANDEJA_BACKOFF_BASE = 2.0
+TELEGRAM_BANDEJA_BACKOFF_MAX = 300.0
+
+# Caché de análisis con imágenes (mismas capturas = misma respuesta)
+# Número máximo de análisis guardados en memoria
+CACHE_ANALISIS_MAX_ENTRADAS = 200
+
+# Directorio para la caché en disco ("" = solo memoria)
+CACHE_ANALISIS_DIR = os.getenv("CACHE_ANALISIS_DIR", "")
+
+# Recompresión de capturas antes de enviarlas al modelo
+# Opciones: "JPEG", "WEBP", "PNG"
+FORMATO_IMAGEN_ANALISIS = "JPEG"
+
+# Calidad de compresión (1-95) para JPEG/WEBP
+CALIDAD_IMAGEN_ANALISIS = 90
+
 # ━━━━━━━━━━━━━━━━━━━━━━
 # 📝 LOGGING
 # ━━━━━━━━━━━━━━━━━━━━━━
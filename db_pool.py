@@ -0,0 +1,296 @@
+"""
+Pool de conexiones MySQL para REDI7 IA
+Reutiliza conexiones abiertas entre sesiones para evitar el handshake TCP+TLS+auth
+en cada consulta a Hostinger
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import mysql.connector
+
+
+class ConexionPool:
+    """
+    Conexión prestada por el pool.
+
+    Se comporta como una conexión de mysql.connector normal, pero close()
+    la devuelve al pool en lugar de cerrar el socket. Así el código existente
+    (cursor(), commit(), close()...) funciona sin cambios.
+    """
+
+    def __init__(self, pool: "PoolMySQL", conexion):
+        self._pool = pool
+        self._conexion = conexion
+        self._devuelta = False
+
+    def close(self):
+        """Devuelve la conexión al pool (idempotente)"""
+        if not self._devuelta:
+            self._devuelta = True
+            self._pool._devolver(self._conexion)
+
+    def __getattr__(self, nombre):
+        return getattr(self._conexion, nombre)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __del__(self):
+        # Red de seguridad: si alguien olvidó close(), no perder el hueco del pool
+        try:
+            if not self._devuelta:
+                self.close()
+        except Exception:
+            pass
+
+
+class PoolMySQL:
+    """Pool de conexiones acotado con health checks y expulsión de inactivas"""
+
+    def __init__(
+        self,
+        config: Dict,
+        max_conexiones: int = 10,
+        timeout_espera: float = 10.0,
+        max_inactivo: float = 300.0,
+        max_vida: float = 3600.0,
+        ping_tras: float = 30.0
+    ):
+        """
+        Inicializa el pool (las conexiones se abren bajo demanda)
+
+        Args:
+            config: Parámetros de mysql.connector.connect (host, port, user...)
+            max_conexiones: Máximo de conexiones abiertas a la vez
+            timeout_espera: Segundos que espera un checkout si el pool está lleno
+            max_inactivo: Segundos sin uso tras los que se cierra una conexión libre
+            max_vida: Segundos de vida máxima de una conexión
+            ping_tras: Segundos de inactividad a partir de los cuales se hace ping antes de prestarla
+        """
+        self.config = dict(config)
+        self.max_conexiones = max_conexiones
+        self.timeout_espera = timeout_espera
+        self.max_inactivo = max_inactivo
+        self.max_vida = max_vida
+        self.ping_tras = ping_tras
+
+        # Conexiones libres: [conexion, creada_en, ultimo_uso]
+        self._libres: List[list] = []
+        self._creadas_en: Dict[int, float] = {}
+        self._en_uso = 0
+        self._cond = threading.Condition()
+
+        self._hooks: Dict[str, List[Callable]] = {"checkout": [], "checkin": []}
+        self.estadisticas = {
+            "creadas": 0,
+            "reutilizadas": 0,
+            "descartadas": 0,
+            "esperas": 0,
+            "timeouts": 0
+        }
+
+    # ━━━━━━━━━━━━━━━━━━━━━━
+    # Hooks
+    # ━━━━━━━━━━━━━━━━━━━━━━
+
+    def registrar_hook(self, evento: str, funcion: Callable):
+        """
+        Registra una función a ejecutar al prestar ('checkout') o devolver ('checkin') una conexión
+
+        La función recibe la conexión cruda de mysql.connector.
+        """
+        if evento not in self._hooks:
+            raise ValueError(f"Evento de hook no válido: {evento}")
+        self._hooks[evento].append(funcion)
+
+    def _ejecutar_hooks(self, evento: str, conexion):
+        for funcion in self._hooks[evento]:
+            try:
+                funcion(conexion)
+            except Exception as e:
+                print(f"⚠️ Error en hook de pool ({evento}): {e}")
+
+    # ━━━━━━━━━━━━━━━━━━━━━━
+    # Ciclo de vida de conexiones
+    # ━━━━━━━━━━━━━━━━━━━━━━
+
+    def _crear_conexion(self):
+        conexion = mysql.connector.connect(**self.config)
+        self._creadas_en[id(conexion)] = time.monotonic()
+        # += no es atómico entre hilos: los contadores se actualizan con el lock del pool
+        with self._cond:
+            self.estadisticas["creadas"] += 1
+        return conexion
+
+    def _cerrar(self, conexion):
+        self._creadas_en.pop(id(conexion), None)
+        with self._cond:
+            self.estadisticas["descartadas"] += 1
+        try:
+            conexion.close()
+        except Exception:
+            pass
+
+    def _esta_sana(self, conexion, ultimo_uso: float) -> bool:
+        """Hace ping solo si la conexión lleva un rato sin usarse"""
+        if time.monotonic() - ultimo_uso < self.ping_tras:
+            return True
+        try:
+            conexion.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _purgar_libres(self) -> List:
+        """Saca del pool las conexiones libres caducadas (llamar con el lock tomado)"""
+        ahora = time.monotonic()
+        vigentes, caducadas = [], []
+        for entrada in self._libres:
+            conexion, creada_en, ultimo_uso = entrada
+            if ahora - ultimo_uso > self.max_inactivo or ahora - creada_en > self.max_vida:
+                caducadas.append(conexion)
+            else:
+                vigentes.append(entrada)
+        self._libres = vigentes
+        return caducadas
+
+    def purgar_inactivas(self) -> int:
+        """Cierra las conexiones libres que superan el tiempo de inactividad o de vida"""
+        with self._cond:
+            caducadas = self._purgar_libres()
+        for conexion in caducadas:
+            self._cerrar(conexion)
+        return len(caducadas)
+
+    def obtener(self) -> Optional[ConexionPool]:
+        """
+        Presta una conexión del pool
+
+        Returns:
+            ConexionPool lista para usar, o None si el pool está agotado tras timeout_espera
+
+        Raises:
+            mysql.connector.Error si hay que abrir una conexión nueva y falla
+        """
+        limite = time.monotonic() + self.timeout_espera
+
+        conexion = None
+        crear = False
+        with self._cond:
+            caducadas = self._purgar_libres()
+
+            while not self._libres and self._en_uso >= self.max_conexiones:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self.estadisticas["timeouts"] += 1
+                    break
+                self.estadisticas["esperas"] += 1
+                self._cond.wait(restante)
+
+            if self._libres:
+                conexion, _, ultimo_uso = self._libres.pop()
+                self._en_uso += 1
+            elif self._en_uso < self.max_conexiones:
+                self._en_uso += 1
+                crear = True
+
+        for vieja in caducadas:
+            self._cerrar(vieja)
+
+        if conexion is None and not crear:
+            return None
+
+        try:
+            if crear:
+                conexion = self._crear_conexion()
+            elif not self._esta_sana(conexion, ultimo_uso):
+                self._cerrar(conexion)
+                conexion = self._crear_conexion()
+            else:
+                with self._cond:
+                    self.estadisticas["reutilizadas"] += 1
+        except Exception:
+            with self._cond:
+                self._en_uso -= 1
+                self._cond.notify()
+            raise
+
+        self._ejecutar_hooks("checkout", conexion)
+        return ConexionPool(self, conexion)
+
+    def _devolver(self, conexion):
+        """Recibe una conexión devuelta; la limpia y la deja libre o la descarta"""
+        reutilizable = True
+        try:
+            # No dejar transacciones ni snapshots abiertos para el siguiente usuario
+            if conexion.in_transaction:
+                conexion.rollback()
+        except Exception:
+            reutilizable = False
+
+        self._ejecutar_hooks("checkin", conexion)
+
+        ahora = time.monotonic()
+        creada_en = self._creadas_en.get(id(conexion), ahora)
+        if ahora - creada_en > self.max_vida:
+            reutilizable = False
+
+        with self._cond:
+            self._en_uso -= 1
+            if reutilizable:
+                self._libres.append([conexion, creada_en, ahora])
+            self._cond.notify()
+
+        if not reutilizable:
+            self._cerrar(conexion)
+
+    def cerrar_todo(self):
+        """Cierra todas las conexiones libres (las prestadas se cerrarán al devolverse)"""
+        with self._cond:
+            libres = [entrada[0] for entrada in self._libres]
+            self._libres = []
+        for conexion in libres:
+            self._cerrar(conexion)
+
+    def estado(self) -> Dict:
+        """Devuelve el estado actual del pool"""
+        with self._cond:
+            return {
+                "libres": len(self._libres),
+                "en_uso": self._en_uso,
+                "max_conexiones": self.max_conexiones,
+                **self.estadisticas
+            }
+
+
+# ━━━━━━━━━━━━━━━━━━━━━━
+# 🌐 POOL COMPARTIDO POR PROCESO
+# ━━━━━━━━━━━━━━━━━━━━━━
+
+_pools: Dict[tuple, PoolMySQL] = {}
+_pools_lock = threading.Lock()
+
+
+def obtener_pool(config: Dict, **opciones) -> PoolMySQL:
+    """
+    Devuelve el pool del proceso para una base de datos, creándolo la primera vez
+
+    Args:
+        config: Parámetros de conexión (host, port, user, password, database...)
+        **opciones: Parámetros de PoolMySQL usados solo al crear el pool
+
+    Returns:
+        PoolMySQL compartido por todas las sesiones del proceso
+    """
+    clave = (config.get("host"), config.get("port"), config.get("user"), config.get("database"))
+    with _pools_lock:
+        pool = _pools.get(clave)
+        if pool is None:
+            pool = PoolMySQL(config, **opciones)
+            _pools[clave] = pool
+        return pool
@@ -0,0 +1,241 @@
+"""
+Difusión de señales a muchos chats de Telegram para REDI7 IA
+Envía un mismo mensaje a cientos de chat_id en paralelo sobre la sesión HTTP compartida,
+respetando los límites de Telegram (global, por chat y por grupo) y los 429 con retry_after
+"""
+
+import argparse
+import asyncio
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Union
+
+from config import (
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_DIFUSION_CONCURRENCIA,
+    TELEGRAM_MENSAJES_POR_MINUTO_GRUPO,
+    TELEGRAM_MENSAJES_POR_SEGUNDO,
+    TELEGRAM_REINTENTOS_429,
+    TELEGRAM_SEGUNDOS_POR_CHAT
+)
+from metricas import tramo
+from telegram_sender import TelegramSender, normalizar_chat_id
+
+
+def es_grupo(chat_id: Union[int, str]) -> bool:
+    """Grupos y canales tienen id negativo o @nombre; los chats privados, positivo"""
+    if isinstance(chat_id, int):
+        return chat_id < 0
+    return str(chat_id).startswith(("-", "@"))
+
+
+class LimitadorTelegram:
+    """
+    Reparte los instantes de envío de un bot
+
+    Cada envío reserva un hueco que respeta a la vez el ritmo global del bot y el
+    del chat destino (más lento en grupos). Un 429 aplaza todo el bot lo que indique
+    retry_after. El lock es de hilos, así el mismo limitador sirve a varias difusiones
+    aunque corran en bucles de eventos distintos.
+    """
+
+    def __init__(
+        self,
+        por_segundo: float = 25,
+        segundos_por_chat: float = 1.0,
+        por_minuto_grupo: float = 20
+    ):
+        self.intervalo_global = 1.0 / por_segundo if por_segundo > 0 else 0.0
+        self.intervalo_chat = segundos_por_chat
+        self.intervalo_grupo = 60.0 / por_minuto_grupo if por_minuto_grupo > 0 else 0.0
+        self._siguiente_global = 0.0
+        self._siguiente_chat: Dict = {}
+        self._lock = threading.Lock()
+
+    def reservar(self, chat_id: Union[int, str]) -> float:
+        """Reserva el próximo hueco para `chat_id` y devuelve los segundos que faltan"""
+        intervalo_chat = self.intervalo_grupo if es_grupo(chat_id) else self.intervalo_chat
+        with self._lock:
+            ahora = time.monotonic()
+            inicio = max(ahora, self._siguiente_global, self._siguiente_chat.get(chat_id, 0.0))
+            self._siguiente_global = inicio + self.intervalo_global
+            self._siguiente_chat[chat_id] = inicio + intervalo_chat
+            # Los chats cuyo hueco ya pasó no aportan nada: no acumularlos entre difusiones
+            if len(self._siguiente_chat) > 10000:
+                self._siguiente_chat = {c: t for c, t in self._siguiente_chat.items() if t > ahora}
+        return inicio - ahora
+
+    async def esperar(self, chat_id: Union[int, str]):
+        espera = self.reservar(chat_id)
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+    def aplazar(self, segundos: float):
+        """Tras un 429 nadie del bot envía hasta pasados `segundos`"""
+        with self._lock:
+            self._siguiente_global = max(self._siguiente_global, time.monotonic() + segundos)
+
+
+_limitadores: Dict[str, LimitadorTelegram] = {}
+_limitadores_lock = threading.Lock()
+
+
+def obtener_limitador(bot_token: str) -> LimitadorTelegram:
+    """Limitador del bot (los límites de Telegram son por token, no por difusión)"""
+    limitador = _limitadores.get(bot_token)
+    if limitador is None:
+        with _limitadores_lock:
+            limitador = _limitadores.get(bot_token)
+            if limitador is None:
+                limitador = _limitadores[bot_token] = LimitadorTelegram(
+                    TELEGRAM_MENSAJES_POR_SEGUNDO,
+                    TELEGRAM_SEGUNDOS_POR_CHAT,
+                    TELEGRAM_MENSAJES_POR_MINUTO_GRUPO
+                )
+    return limitador
+
+
+class DifusorTelegram:
+    """Envía un mensaje a muchos chats con concurrencia acotada y resultado por destinatario"""
+
+    def __init__(
+        self,
+        sender: TelegramSender,
+        concurrencia: int = TELEGRAM_DIFUSION_CONCURRENCIA,
+        limitador: Optional[LimitadorTelegram] = None,
+        reintentos_429: int = TELEGRAM_REINTENTOS_429
+    ):
+        """
+        Args:
+            sender: Sender del bot (su sesión keep-alive se reutiliza en todos los envíos)
+            concurrencia: Peticiones HTTP en vuelo a la vez
+            limitador: Ritmo de envío (por defecto el compartido del bot)
+            reintentos_429: Reintentos de un destinatario tras un 429
+        """
+        self.sender = sender
+        self.concurrencia = max(1, concurrencia)
+        self.limitador = limitador or obtener_limitador(sender.bot_token)
+        self.reintentos_429 = reintentos_429
+
+    async def enviar(
+        self,
+        chat_id: Union[int, str],
+        mensaje: str,
+        parse_mode: Optional[str] = None,
+        disable_notification: bool = False,
+        imagenes_base64: Optional[List[str]] = None,
+        mime_types: Optional[List[str]] = None
+    ) -> Dict:
+        """Envía a un chat respetando los límites; reintenta solo los 429"""
+        intentos = 0
+        partes_enviadas = 0
+        while True:
+            intentos += 1
+            await self.limitador.esperar(chat_id)
+            # requests es bloqueante: la petición va a un hilo y el bucle sigue repartiendo
+            if imagenes_base64:
+                resultado = await asyncio.to_thread(
+                    self.sender.enviar_con_imagenes, chat_id, mensaje, imagenes_base64, mime_types,
+                    parse_mode, disable_notification, partes_enviadas
+                )
+            else:
+                resultado = await asyncio.to_thread(
+                    self.sender.enviar_a, chat_id, mensaje, parse_mode, disable_notification, partes_enviadas
+                )
+            if resultado.get("codigo") == 429 and intentos <= self.reintentos_429:
+                # Un mensaje partido continúa por la parte que no llegó
+                partes_enviadas = resultado.get("partes_enviadas", partes_enviadas)
+                self.limitador.aplazar(float(resultado.get("retry_after", 1)))
+                continue
+            resultado.update({"chat_id": chat_id, "intentos": intentos})
+            return resultado
+
+    async def difundir(
+        self,
+        chat_ids: Iterable,
+        mensaje: str,
+        parse_mode: Optional[str] = None,
+        disable_notification: bool = False,
+        imagenes_base64: Optional[List[str]] = None,
+        mime_types: Optional[List[str]] = None
+    ) -> Dict:
+        """
+        Envía `mensaje` a todos los chats (sin repetir ninguno)
+
+        Con imágenes, el primer chat se atiende antes que el resto: ahí se suben una vez
+        y los demás envíos reutilizan sus file_id.
+
+        Returns:
+            Dict con total, enviados, fallidos, duracion_s y resultados (uno por chat, en el orden dado)
+        """
+        destinos: List = list(dict.fromkeys(normalizar_chat_id(c) for c in chat_ids if str(c).strip()))
+        semaforo = asyncio.Semaphore(self.concurrencia)
+        inicio = time.monotonic()
+
+        async def enviar_uno(chat_id):
+            async with semaforo:
+                return await self.enviar(
+                    chat_id, mensaje, parse_mode, disable_notification, imagenes_base64, mime_types
+                )
+
+        with tramo("telegram.difusion"):
+            resultados = []
+            pendientes = destinos
+            if imagenes_base64 and destinos:
+                resultados.append(await enviar_uno(destinos[0]))
+                pendientes = destinos[1:]
+            resultados += await asyncio.gather(*(enviar_uno(c) for c in pendientes))
+
+        enviados = sum(1 for r in resultados if r["exito"])
+        resumen = {
+            "total": len(destinos),
+            "enviados": enviados,
+            "fallidos": len(destinos) - enviados,
+            "duracion_s": round(time.monotonic() - inicio, 2),
+            "resultados": resultados
+        }
+        print(f"📣 Difusión: {enviados}/{len(destinos)} enviados en {resumen['duracion_s']}s")
+        return resumen
+
+
+def difundir_senal(
+    bot_token: str,
+    chat_ids: Iterable,
+    mensaje: str,
+    parse_mode: Optional[str] = None,
+    disable_notification: bool = False,
+    imagenes_base64: Optional[List[str]] = None,
+    mime_types: Optional[List[str]] = None
+) -> Dict:
+    """Atajo síncrono: difunde `mensaje` con el bot dado (para scripts y callbacks en hilos)"""
+    difusor = DifusorTelegram(TelegramSender(bot_token=bot_token, chat_id=""))
+    return asyncio.run(difusor.difundir(
+        chat_ids, mensaje, parse_mode, disable_notification, imagenes_base64, mime_types
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Difunde un mensaje a varios chats de Telegram")
+    parser.add_argument("--chats", default="", help="chat_id separados por comas")
+    parser.add_argument("--archivo", help="Archivo con un chat_id por línea")
+    parser.add_argument("--mensaje", required=True, help="Texto a enviar")
+    parser.add_argument("--token", default=TELEGRAM_BOT_TOKEN, help="Token del bot (por defecto TELEGRAM_BOT_TOKEN)")
+    args = parser.parse_args()
+
+    chat_ids = [c for c in args.chats.split(",") if c.strip()]
+    if args.archivo:
+        with open(args.archivo, encoding="utf-8") as f:
+            chat_ids += [linea.strip() for linea in f if linea.strip()]
+
+    if not args.token or not chat_ids:
+        print("⚠️  Indica el token del bot y al menos un chat_id")
+        return
+
+    resumen = difundir_senal(args.token, chat_ids, args.mensaje)
+    for r in resumen["resultados"]:
+        if not r["exito"]:
+            print(f"   ❌ {r['chat_id']}: {r['mensaje']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Ensamblado de mensajes largos para Telegram en REDI7 IA
+Divide el texto en el menor número de partes de hasta 4096 caracteres, cortando por las
+secciones del análisis (cabeceras con emoji) y con las entidades Markdown/HTML equilibradas
+"""
+
+import re
+import unicodedata
+from typing import List, Optional, Tuple
+
+# Límite de sendMessage (Telegram lo cuenta en unidades UTF-16)
+LIMITE_MENSAJE = 4096
+
+# Límite de la leyenda de sendPhoto/sendMediaGroup
+LIMITE_LEYENDA = 1024
+
+# Espacio reservado en cada parte para cerrar y reabrir entidades en el corte
+MARGEN_ENTIDADES = 64
+
+# Marcadores de MarkdownV2 (los largos primero para no confundir ``` con `)
+MARCADORES_MARKDOWN_V2 = ("```", "||", "__", "`", "*", "_", "~")
+
+ETIQUETA_HTML = re.compile(
+    r"<(/?)(b|strong|i|em|u|ins|s|strike|del|code|pre|a|tg-spoiler|span|blockquote)\b[^>]*>",
+    re.IGNORECASE
+)
+
+
+def longitud_telegram(texto: str) -> int:
+    """Longitud como la cuenta Telegram (un emoji fuera del plano básico cuenta 2)"""
+    return len(texto.encode("utf-16-le")) // 2
+
+
+def _es_cabecera(linea: str) -> bool:
+    """Línea que abre sección: empieza por emoji/símbolo (🚨, 📉, 📊...) o es un separador ━"""
+    limpia = linea.strip()
+    return bool(limpia) and (limpia[0] == "━" or unicodedata.category(limpia[0]) in ("So", "Sk"))
+
+
+# Tipos de corte entre trozos, de más a menos preferido
+CORTE_SECCION, CORTE_LINEA, CORTE_PALABRA, CORTE_DURO = range(4)
+
+# Separador que une cada trozo con el anterior (se pierde si la parte se corta ahí)
+SEPARADORES = {CORTE_SECCION: "\n", CORTE_LINEA: "\n", CORTE_PALABRA: " ", CORTE_DURO: ""}
+
+
+def _cortar_duro(texto: str, limite: int) -> List[str]:
+    """Último recurso para una palabra más larga que el límite"""
+    partes, actual, longitud = [], "", 0
+    for caracter in texto:
+        ancho = longitud_telegram(caracter)
+        if longitud + ancho > limite:
+            partes.append(actual)
+            actual, longitud = "", 0
+        actual += caracter
+        longitud += ancho
+    if actual:
+        partes.append(actual)
+    return partes
+
+
+def _trozos(texto: str, limite: int) -> List[Tuple[str, int]]:
+    """
+    Parte el texto en líneas (o palabras, o caracteres si no caben) con el tipo de corte que las precede
+
+    Una cabecera tras una línea vacía (o un separador ━) abre sección.
+    """
+    trozos: List[Tuple[str, int]] = []
+    anterior_vacia = True
+    for linea in texto.split("\n"):
+        seccion = _es_cabecera(linea) and (anterior_vacia or linea.strip().startswith("━"))
+        corte = CORTE_SECCION if seccion else CORTE_LINEA
+        anterior_vacia = not linea.strip()
+        if longitud_telegram(linea) <= limite:
+            trozos.append((linea, corte))
+            continue
+        for palabra in linea.split(" "):
+            fragmentos = _cortar_duro(palabra, limite) if longitud_telegram(palabra) > limite else [palabra]
+            for fragmento in fragmentos:
+                trozos.append((fragmento, corte))
+                corte = CORTE_DURO
+            corte = CORTE_PALABRA
+    return trozos
+
+
+def _empaquetar(texto: str, limite: int) -> List[str]:
+    """
+    Reparte los trozos en el mínimo número de partes y, sin añadir ninguna, corta donde mejor queda
+
+    Llenar cada parte al máximo da el mínimo de partes; entre los cortes que lo conservan
+    se elige el de mejor tipo (sección, línea, palabra) y, a igualdad, el más lejano.
+    """
+    trozos = _trozos(texto, limite)
+    total = len(trozos)
+
+    # acumulado[i]: longitud de trozos[:i] unidos con sus separadores
+    acumulado = [0]
+    for indice, (trozo, corte) in enumerate(trozos):
+        separador = len(SEPARADORES[corte]) if indice else 0
+        acumulado.append(acumulado[-1] + separador + longitud_telegram(trozo))
+
+    def longitud(inicio: int, fin: int) -> int:
+        separador = len(SEPARADORES[trozos[inicio][1]]) if inicio else 0
+        return acumulado[fin] - acumulado[inicio] - separador
+
+    # alcance[i]: fin más lejano de una parte que empieza en el trozo i (cada trozo cabe solo)
+    alcance = [0] * total
+    fin = 0
+    for inicio in range(total):
+        fin = max(fin, inicio + 1)
+        while fin < total and longitud(inicio, fin + 1) <= limite:
+            fin += 1
+        alcance[inicio] = fin
+
+    # minimo[i]: partes necesarias para trozos[i:]
+    minimo = [0] * (total + 1)
+    for inicio in range(total - 1, -1, -1):
+        minimo[inicio] = 1 + minimo[alcance[inicio]]
+
+    partes = []
+    inicio = 0
+    while inicio < total:
+        fin = min(
+            (f for f in range(inicio + 1, alcance[inicio] + 1) if minimo[f] == minimo[inicio] - 1),
+            key=lambda f: (trozos[f][1] if f < total else -1, -f)
+        )
+        partes.append(trozos[inicio][0] + "".join(SEPARADORES[c] + t for t, c in trozos[inicio + 1:fin]))
+        inicio = fin
+    return partes
+
+
+def _abiertas_markdown(texto: str) -> List[str]:
+    """Entidades de Markdown clásico sin cerrar al final del texto (no admite anidado)"""
+    abierta = None
+    i = 0
+    while i < len(texto):
+        if texto[i] == "\\" and abierta not in ("`", "```"):
+            i += 2
+            continue
+        if texto.startswith("```", i) and abierta in (None, "```"):
+            abierta = None if abierta else "```"
+            i += 3
+            continue
+        if texto[i] in "*_`" and (abierta is None or abierta == texto[i]):
+            abierta = None if abierta else texto[i]
+        i += 1
+    return [abierta] if abierta else []
+
+
+def _abiertas_markdown_v2(texto: str) -> List[str]:
+    """Entidades de MarkdownV2 sin cerrar, en orden de apertura"""
+    abiertas: List[str] = []
+    i = 0
+    while i < len(texto):
+        dentro_codigo = bool(abiertas) and abiertas[-1] in ("`", "```")
+        if texto[i] == "\\":
+            i += 2
+            continue
+        for marcador in MARCADORES_MARKDOWN_V2:
+            if texto.startswith(marcador, i) and (not dentro_codigo or marcador == abiertas[-1]):
+                if marcador in abiertas:
+                    abiertas.remove(marcador)
+                else:
+                    abiertas.append(marcador)
+                i += len(marcador)
+                break
+        else:
+            i += 1
+    return abiertas
+
+
+def _abiertas_html(texto: str) -> List[str]:
+    """Etiquetas HTML sin cerrar (la etiqueta de apertura completa, para poder reabrirla)"""
+    abiertas: List[str] = []
+    for coincidencia in ETIQUETA_HTML.finditer(texto):
+        nombre = coincidencia.group(2).lower()
+        if not coincidencia.group(1):
+            abiertas.append(coincidencia.group(0))
+            continue
+        for indice in range(len(abiertas) - 1, -1, -1):
+            if ETIQUETA_HTML.match(abiertas[indice]).group(2).lower() == nombre:
+                del abiertas[indice]
+                break
+    return abiertas
+
+
+def _equilibrar(partes: List[str], parse_mode: str) -> List[str]:
+    """Cierra al final de cada parte las entidades abiertas y las reabre al principio de la siguiente"""
+    modo = parse_mode.lower()
+    equilibradas = []
+    arrastradas: List[str] = []
+    for parte in partes:
+        texto = "".join(arrastradas) + parte
+        if modo == "html":
+            arrastradas = _abiertas_html(texto)
+            cierre = "".join(f"</{ETIQUETA_HTML.match(e).group(2)}>" for e in reversed(arrastradas))
+        else:
+            arrastradas = _abiertas_markdown_v2(texto) if modo == "markdownv2" else _abiertas_markdown(texto)
+            cierre = "".join(reversed(arrastradas))
+        equilibradas.append(texto + cierre)
+    return equilibradas
+
+
+def dividir_mensaje(texto: str, parse_mode: Optional[str] = None, limite: int = LIMITE_MENSAJE) -> List[str]:
+    """
+    Parte un mensaje para sendMessage
+
+    Usa el mínimo número de partes y, dentro de eso, corta preferentemente entre secciones,
+    luego entre líneas y por último entre palabras. Con parse_mode, cada parte es
+    Markdown/HTML válido por sí sola.
+
+    Args:
+        texto: Mensaje completo
+        parse_mode: "Markdown", "MarkdownV2", "HTML" o None
+        limite: Caracteres por parte
+
+    Returns:
+        Lista de partes en orden (una sola si ya cabe)
+    """
+    if longitud_telegram(texto) <= limite:
+        return [texto]
+
+    limite_util = limite - MARGEN_ENTIDADES if parse_mode else limite
+    partes = [p.strip("\n") for p in _empaquetar(texto, limite_util)]
+    partes = [p for p in partes if p.strip()]
+    if parse_mode:
+        partes = _equilibrar(partes, parse_mode)
+    return partes
+
+
+def separar_leyenda(texto: str, parse_mode: Optional[str] = None, limite: int = LIMITE_LEYENDA) -> Tuple[str, str]:
+    """
+    Separa la leyenda de una foto del resto del mensaje
+
+    Corta por el mejor sitio que quepa (sección, línea, palabra; a igualdad, el más lejano).
+    El resto conserva el texto original, así dividir_mensaje() lo parte por sus secciones.
+
+    Returns:
+        (leyenda, resto); resto vacío si todo cabe en la leyenda
+    """
+    if longitud_telegram(texto) <= limite:
+        return texto, ""
+
+    limite_util = limite - MARGEN_ENTIDADES if parse_mode else limite
+    trozos = _trozos(texto, limite_util)
+    corte = 1
+    longitud = longitud_telegram(trozos[0][0])
+    for indice in range(1, len(trozos)):
+        if trozos[indice][1] <= trozos[corte][1]:
+            corte = indice
+        trozo, tipo = trozos[indice]
+        longitud += len(SEPARADORES[tipo]) + longitud_telegram(trozo)
+        if longitud > limite_util:
+            break
+
+    leyenda = trozos[0][0] + "".join(SEPARADORES[c] + t for t, c in trozos[1:corte])
+    resto = trozos[corte][0] + "".join(SEPARADORES[c] + t for t, c in trozos[corte + 1:])
+    leyenda, resto = leyenda.strip("\n"), resto.strip("\n")
+    if parse_mode and resto.strip():
+        leyenda, resto = _equilibrar([leyenda, resto], parse_mode)
+    return leyenda, resto if resto.strip() else ""
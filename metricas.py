@@ -0,0 +1,255 @@
+"""
+Métricas de latencia por etapa para REDI7 IA
+Tramos de tiempo ligeros (context manager o decorador) agregados en histogramas del proceso,
+con percentiles recientes, solicitudes más lentas y exportación JSON/Prometheus
+"""
+
+import functools
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+# Límites de los buckets del histograma en segundos (estilo Prometheus)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Muestras recientes por etapa para percentiles, y solicitudes lentas que se conservan
+MAX_MUESTRAS = 2000
+MAX_LENTAS = 20
+
+_local = threading.local()
+
+
+class Histograma:
+    """Histograma acumulado de una etapa más una ventana de muestras recientes"""
+
+    def __init__(self):
+        self.cuentas = [0] * (len(BUCKETS) + 1)
+        self.suma = 0.0
+        self.total = 0
+        self.errores = 0
+        self.muestras = deque(maxlen=MAX_MUESTRAS)
+
+    def observar(self, segundos: float, error: bool = False):
+        for i, limite in enumerate(BUCKETS):
+            if segundos <= limite:
+                self.cuentas[i] += 1
+                break
+        else:
+            self.cuentas[-1] += 1
+        self.suma += segundos
+        self.total += 1
+        if error:
+            self.errores += 1
+        self.muestras.append((time.time(), segundos, error))
+
+
+def _percentil(ordenados: List[float], p: float) -> float:
+    """Percentil por interpolación lineal (como numpy) sobre una lista ya ordenada"""
+    if not ordenados:
+        return 0.0
+    posicion = (len(ordenados) - 1) * p / 100
+    inferior = int(posicion)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (posicion - inferior)
+
+
+class RegistroMetricas:
+    """Histogramas por etapa y solicitudes más lentas, seguros entre hilos"""
+
+    def __init__(self):
+        self._histogramas: Dict[str, Histograma] = {}
+        self._lentas: List[Dict] = []
+        self._lock = threading.Lock()
+        self.desde = time.time()
+
+    def observar(self, etapa: str, segundos: float, error: bool = False):
+        """Registra una duración; si hay una solicitud abierta en el hilo, la añade a su desglose"""
+        with self._lock:
+            histograma = self._histogramas.get(etapa)
+            if histograma is None:
+                histograma = self._histogramas[etapa] = Histograma()
+            histograma.observar(segundos, error)
+
+        solicitud = getattr(_local, "solicitud", None)
+        if solicitud is not None:
+            solicitud["etapas"].append({"etapa": etapa, "ms": round(segundos * 1000, 1), "error": error})
+
+    def tramo(self, etapa: str):
+        """Context manager que mide el bloque como `etapa` (excepción = error)"""
+        return _Tramo(self, etapa)
+
+    def medir(self, etapa: str) -> Callable:
+        """Decorador que mide cada llamada a la función como `etapa`"""
+        def decorador(funcion):
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                with self.tramo(etapa):
+                    return funcion(*args, **kwargs)
+            return envoltura
+        return decorador
+
+    def solicitud(self, nombre: str, **etiquetas):
+        """
+        Agrupa los tramos del hilo en una solicitud (p. ej. un análisis completo)
+
+        Al cerrarse registra su duración como etapa `nombre` y la guarda entre
+        las más lentas con el desglose por etapa y las etiquetas dadas.
+        """
+        return _Solicitud(self, nombre, etiquetas)
+
+    def _registrar_lenta(self, solicitud: Dict):
+        with self._lock:
+            self._lentas.append(solicitud)
+            self._lentas.sort(key=lambda s: s["ms"], reverse=True)
+            del self._lentas[MAX_LENTAS:]
+
+    def resumen(self, ventana: Optional[float] = None) -> Dict[str, Dict]:
+        """
+        Percentiles por etapa
+
+        Args:
+            ventana: Segundos hacia atrás para los percentiles (None = todas las muestras recientes)
+
+        Returns:
+            Dict etapa -> n, errores, p50/p95/p99/max/media en ms y totales acumulados
+        """
+        desde = time.time() - ventana if ventana else 0
+        with self._lock:
+            copia = {
+                etapa: (list(h.muestras), h.total, h.errores, h.suma)
+                for etapa, h in self._histogramas.items()
+            }
+
+        resumen = {}
+        for etapa, (muestras, total, errores, suma) in sorted(copia.items()):
+            recientes = [m for m in muestras if m[0] >= desde]
+            duraciones = sorted(m[1] * 1000 for m in recientes)
+            resumen[etapa] = {
+                "n": len(duraciones),
+                "errores": sum(1 for m in recientes if m[2]),
+                "p50_ms": round(_percentil(duraciones, 50), 1),
+                "p95_ms": round(_percentil(duraciones, 95), 1),
+                "p99_ms": round(_percentil(duraciones, 99), 1),
+                "max_ms": round(duraciones[-1], 1) if duraciones else 0.0,
+                "media_ms": round(sum(duraciones) / len(duraciones), 1) if duraciones else 0.0,
+                "total": total,
+                "errores_total": errores,
+                "suma_s": round(suma, 3)
+            }
+        return resumen
+
+    def lentas(self) -> List[Dict]:
+        """Solicitudes más lentas registradas (de mayor a menor duración)"""
+        with self._lock:
+            return [dict(s) for s in self._lentas]
+
+    def exportar_json(self, ventana: Optional[float] = None) -> Dict:
+        """Resumen, buckets acumulados y solicitudes lentas en un dict serializable"""
+        with self._lock:
+            buckets = {
+                etapa: dict(zip([str(b) for b in BUCKETS] + ["+Inf"], h.cuentas))
+                for etapa, h in self._histogramas.items()
+            }
+        return {
+            "desde": self.desde,
+            "generado": time.time(),
+            "etapas": self.resumen(ventana),
+            "buckets": buckets,
+            "lentas": self.lentas()
+        }
+
+    def exportar_prometheus(self) -> str:
+        """Histogramas acumulados en el formato de texto de Prometheus"""
+        lineas = [
+            "# HELP redi7_etapa_duracion_segundos Duración de cada etapa de REDI7 IA",
+            "# TYPE redi7_etapa_duracion_segundos histogram"
+        ]
+        errores = []
+        with self._lock:
+            for etapa, h in sorted(self._histogramas.items()):
+                acumulado = 0
+                for limite, cuenta in zip(list(BUCKETS) + ["+Inf"], h.cuentas):
+                    acumulado += cuenta
+                    lineas.append(f'redi7_etapa_duracion_segundos_bucket{{etapa="{etapa}",le="{limite}"}} {acumulado}')
+                lineas.append(f'redi7_etapa_duracion_segundos_sum{{etapa="{etapa}"}} {h.suma:.6f}')
+                lineas.append(f'redi7_etapa_duracion_segundos_count{{etapa="{etapa}"}} {h.total}')
+                errores.append(f'redi7_etapa_errores_total{{etapa="{etapa}"}} {h.errores}')
+
+        lineas += [
+            "# HELP redi7_etapa_errores_total Ejecuciones de la etapa que terminaron en excepción",
+            "# TYPE redi7_etapa_errores_total counter"
+        ] + errores
+        return "\n".join(lineas) + "\n"
+
+    def reiniciar(self):
+        """Descarta todas las métricas"""
+        with self._lock:
+            self._histogramas.clear()
+            self._lentas.clear()
+            self.desde = time.time()
+
+
+class _Tramo:
+    def __init__(self, registro: RegistroMetricas, etapa: str):
+        self.registro = registro
+        self.etapa = etapa
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registro.observar(self.etapa, time.perf_counter() - self.inicio, error=exc_type is not None)
+        return False
+
+
+class _Solicitud:
+    def __init__(self, registro: RegistroMetricas, nombre: str, etiquetas: Dict):
+        self.registro = registro
+        self.datos = {"nombre": nombre, "etiquetas": etiquetas, "etapas": [], "inicio": time.time()}
+
+    def __enter__(self):
+        self.anterior = getattr(_local, "solicitud", None)
+        _local.solicitud = self.datos
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        segundos = time.perf_counter() - self.inicio
+        _local.solicitud = self.anterior
+        self.datos["ms"] = round(segundos * 1000, 1)
+        self.datos["error"] = exc_type is not None
+        self.registro.observar(self.datos["nombre"], segundos, error=exc_type is not None)
+        self.registro._registrar_lenta(self.datos)
+        return False
+
+
+_metricas_compartidas: Optional[RegistroMetricas] = None
+_metricas_lock = threading.Lock()
+
+
+def obtener_metricas() -> RegistroMetricas:
+    """Devuelve el registro de métricas del proceso (compartido por todas las sesiones)"""
+    global _metricas_compartidas
+    if _metricas_compartidas is None:
+        with _metricas_lock:
+            if _metricas_compartidas is None:
+                _metricas_compartidas = RegistroMetricas()
+    return _metricas_compartidas
+
+
+def tramo(etapa: str):
+    """Atajo: `with tramo("openai.chat"):` sobre el registro del proceso"""
+    return obtener_metricas().tramo(etapa)
+
+
+def medir(etapa: str) -> Callable:
+    """Atajo: `@medir("auth.login")` sobre el registro del proceso"""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with obtener_metricas().tramo(etapa):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
@@ -0,0 +1,236 @@
+"""
+Migraciones versionadas de la base de datos MySQL de REDI7 IA
+Se ejecutan una vez en el despliegue (python migraciones.py), no en cada sesión
+"""
+
+from mysql.connector import Error
+
+# Lock con nombre de MySQL para que dos procesos no migren a la vez
+LOCK_MIGRACIONES = "redi7_migraciones"
+
+
+class MigracionBloqueada(Exception):
+    """Otro proceso tiene el lock de migraciones: el esquema no se pudo comprobar ni migrar"""
+
+# ━━━━━━━━━━━━━━━━━━━━━━
+# 📜 LISTA DE MIGRACIONES (versión, descripción, sentencias)
+# ━━━━━━━━━━━━━━━━━━━━━━
+# Nunca modificar una migración ya desplegada: añadir una nueva con la versión siguiente.
+
+MIGRACIONES = [
+    (
+        1,
+        "Tablas base: usuarios, historial_analisis, sesiones",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS usuarios (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                username VARCHAR(255) UNIQUE NOT NULL,
+                email VARCHAR(255) UNIQUE NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                nombre_completo VARCHAR(255),
+                whatsapp VARCHAR(50) UNIQUE,
+                fecha_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                ultimo_acceso TIMESTAMP NULL,
+                plan VARCHAR(50) DEFAULT 'free',
+                activo TINYINT DEFAULT 1,
+                is_admin TINYINT DEFAULT 0,
+                referral_code VARCHAR(50) UNIQUE,
+                referred_by INT,
+                telegram_bot_token TEXT,
+                telegram_chat_id VARCHAR(255),
+                recovery_code VARCHAR(10),
+                recovery_expiry DATETIME,
+                INDEX idx_username (username),
+                INDEX idx_email (email),
+                INDEX idx_referral (referral_code)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS historial_analisis (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_id INT,
+                activo VARCHAR(50),
+                modo VARCHAR(50),
+                temporalidad VARCHAR(255),
+                fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                resultado TEXT,
+                FOREIGN KEY (user_id) REFERENCES usuarios(id) ON DELETE CASCADE,
+                INDEX idx_user_fecha (user_id, fecha)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS sesiones (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                user_id INT,
+                token VARCHAR(255) UNIQUE,
+                fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                fecha_expiracion TIMESTAMP NULL,
+                FOREIGN KEY (user_id) REFERENCES usuarios(id) ON DELETE CASCADE,
+                INDEX idx_token (token)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """
+        ]
+    ),
+    (
+        2,
+        "Contador diario de análisis por usuario (uso_diario)",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS uso_diario (
+                user_id INT NOT NULL,
+                dia DATE NOT NULL,
+                usados INT NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, dia),
+                FOREIGN KEY (user_id) REFERENCES usuarios(id) ON DELETE CASCADE
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """,
+            # Rellenar con el historial existente para que el contador arranque cuadrado
+            """
+            INSERT INTO uso_diario (user_id, dia, usados)
+            SELECT user_id, DATE(fecha), COUNT(*)
+            FROM historial_analisis
+            WHERE user_id IS NOT NULL
+            GROUP BY user_id, DATE(fecha)
+            ON DUPLICATE KEY UPDATE usados = VALUES(usados)
+            """
+        ]
+    ),
+    (
+        3,
+        "Bandeja de salida de Telegram (telegram_bandeja)",
+        [
+            # Tiempos en epoch (DOUBLE): el mismo SQL de bandeja_telegram.py sirve en MySQL y SQLite
+            """
+            CREATE TABLE IF NOT EXISTS telegram_bandeja (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                clave VARCHAR(64) NOT NULL UNIQUE,
+                user_id INT,
+                bot_token TEXT NOT NULL,
+                chat_id VARCHAR(255) NOT NULL,
+                texto MEDIUMTEXT NOT NULL,
+                parse_mode VARCHAR(20),
+                estado VARCHAR(20) NOT NULL DEFAULT 'pendiente',
+                intentos INT NOT NULL DEFAULT 0,
+                proximo_intento DOUBLE NOT NULL,
+                reclamo VARCHAR(32),
+                reclamado_hasta DOUBLE,
+                ultimo_error VARCHAR(255),
+                message_id BIGINT,
+                creado DOUBLE NOT NULL,
+                enviado DOUBLE,
+                INDEX idx_estado_proximo (estado, proximo_intento),
+                INDEX idx_reclamo (reclamo)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+            """
+        ]
+    ),
+    (
+        4,
+        "Partes ya entregadas de los mensajes largos de la bandeja de Telegram",
+        [
+            "ALTER TABLE telegram_bandeja ADD COLUMN partes_enviadas INT NOT NULL DEFAULT 0"
+        ]
+    ),
+    (
+        5,
+        "Capturas adjuntas a los mensajes de la bandeja de Telegram",
+        [
+            # JSON con imagenes_base64 y mime_types; NULL = solo texto
+            "ALTER TABLE telegram_bandeja ADD COLUMN imagenes MEDIUMTEXT NULL"
+        ]
+    ),
+]
+
+VERSION_ESQUEMA = MIGRACIONES[-1][0]
+
+
+def obtener_version(cursor) -> int:
+    """
+    Lee la versión de esquema aplicada
+
+    Returns:
+        Versión actual (0 si la tabla de control todavía no existe)
+    """
+    try:
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        return cursor.fetchone()[0]
+    except Error:
+        return 0
+
+
+def aplicar_migraciones(conn) -> int:
+    """
+    Aplica las migraciones pendientes en orden
+
+    Args:
+        conn: Conexión MySQL (del pool o directa)
+
+    Returns:
+        Número de migraciones aplicadas
+
+    Raises:
+        MigracionBloqueada si el lock no se obtiene en 60 s (distinto de "nada que aplicar")
+    """
+    cursor = conn.cursor(buffered=True)
+    aplicadas = 0
+
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, 60)", (LOCK_MIGRACIONES,))
+        if cursor.fetchone()[0] != 1:
+            raise MigracionBloqueada("No se obtuvo el lock de migraciones (¿otro proceso migrando?)")
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                descripcion VARCHAR(255),
+                aplicada_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """)
+
+        # Releer con el lock tomado: otro proceso pudo migrar mientras esperábamos
+        version = obtener_version(cursor)
+
+        for numero, descripcion, sentencias in MIGRACIONES:
+            if numero <= version:
+                continue
+
+            for sentencia in sentencias:
+                cursor.execute(sentencia)
+
+            cursor.execute(
+                "INSERT INTO schema_version (version, descripcion) VALUES (%s, %s)",
+                (numero, descripcion)
+            )
+            conn.commit()
+            aplicadas += 1
+            print(f"✅ Migración {numero} aplicada: {descripcion}")
+
+        return aplicadas
+    finally:
+        try:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_MIGRACIONES,))
+            cursor.fetchall()
+        except Error:
+            pass
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+if __name__ == "__main__":
+    # Ejecutar en el despliegue: python migraciones.py
+    from auth import AuthSystem
+
+    print("=" * 60)
+    print("🗄️ REDI7 IA - Migraciones de Base de Datos")
+    print("=" * 60)
+
+    auth = AuthSystem()
+    if auth.inicializar_esquema():
+        print(f"\n✅ Esquema en versión {VERSION_ESQUEMA}")
+    else:
+        print("\n❌ No se pudo inicializar el esquema")
+        # Código de salida distinto de 0 para que el paso de despliegue falle
+        raise SystemExit(1)
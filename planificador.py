@@ -0,0 +1,174 @@
+"""
+Planificador por plan para las llamadas al modelo de REDI7 IA
+Colas por plan con reparto justo ponderado (stride scheduling) y un presupuesto global
+de tokens por minuto: elite y pro mantienen latencia baja y free se degrada con suavidad
+"""
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from metricas import obtener_metricas
+
+# Estimación de tokens de un análisis antes de hacerlo (se ajusta con el uso real)
+TOKENS_PROMPT_BASE = 1500
+TOKENS_RESPUESTA_ESTIMADOS = 800
+TOKENS_IMAGEN = {"low": 85, "high": 765}
+
+VENTANA_TPM = 60.0
+
+
+def estimar_tokens(params: Dict) -> int:
+    """Tokens previstos de un análisis con imágenes según sus niveles de detalle"""
+    imagenes = sum(TOKENS_IMAGEN.get(d, TOKENS_IMAGEN["high"]) for d in params.get("detail_levels", []))
+    return TOKENS_PROMPT_BASE + imagenes + TOKENS_RESPUESTA_ESTIMADOS
+
+
+class PlanificadorPlanes:
+    """
+    Decide qué trabajo pendiente pasa al modelo
+
+    Cada plan tiene su cola FIFO. Entre planes con trabajos esperando se elige el que
+    terminaría antes su próximo turno y su "pase" avanza 1/peso, así un plan con peso 6 recibe seis turnos por cada uno
+    de un plan con peso 1, pero ninguno se queda sin turno. Además, un trabajo solo sale
+    si cabe en el presupuesto de tokens del último minuto.
+    """
+
+    def __init__(self, pesos: Dict[str, float], tokens_por_minuto: int = 0):
+        """
+        Args:
+            pesos: Peso de cada plan en el reparto (planes desconocidos usan el de 'free')
+            tokens_por_minuto: Presupuesto global de tokens en 60 s (0 = sin límite)
+        """
+        self.pesos = dict(pesos)
+        self.tokens_por_minuto = tokens_por_minuto
+        self._colas: Dict[str, deque] = {}
+        self._pase: Dict[str, float] = {}
+        self._tiempo_virtual = 0.0
+        self._consumo: deque = deque()
+        self._despachados: Dict[str, int] = {}
+        self._cond = threading.Condition()
+
+    def _plan(self, plan: str) -> str:
+        return plan if plan in self.pesos else "free"
+
+    def encolar(self, elemento, plan: str, tokens_estimados: int):
+        """Añade un trabajo a la cola de su plan"""
+        plan = self._plan(plan)
+        with self._cond:
+            cola = self._colas.setdefault(plan, deque())
+            if not cola:
+                # Un plan que vuelve tras estar inactivo no acumula turnos atrasados
+                self._pase[plan] = max(self._pase.get(plan, 0.0), self._tiempo_virtual)
+            cola.append((elemento, tokens_estimados, time.monotonic()))
+            self._cond.notify()
+
+    def retirar(self, elemento) -> bool:
+        """Quita un trabajo que aún no salió (cancelación); True si estaba esperando"""
+        with self._cond:
+            for cola in self._colas.values():
+                for entrada in cola:
+                    if entrada[0] is elemento:
+                        cola.remove(entrada)
+                        self._cond.notify_all()
+                        return True
+        return False
+
+    def _tokens_en_ventana(self, ahora: float) -> int:
+        while self._consumo and self._consumo[0][0] <= ahora - VENTANA_TPM:
+            self._consumo.popleft()
+        return sum(entrada[1] for entrada in self._consumo)
+
+    def _espera_presupuesto(self, tokens: int, ahora: float) -> float:
+        """Segundos hasta que `tokens` caben en el presupuesto (0 = ya caben)"""
+        if not self.tokens_por_minuto:
+            return 0.0
+        # Un trabajo mayor que todo el presupuesto sale cuando la ventana está vacía
+        tokens = min(tokens, self.tokens_por_minuto)
+        usados = self._tokens_en_ventana(ahora)
+        if usados + tokens <= self.tokens_por_minuto:
+            return 0.0
+        sobrante = usados + tokens - self.tokens_por_minuto
+        for instante, consumidos in self._consumo:
+            sobrante -= consumidos
+            if sobrante <= 0:
+                return max(0.01, instante + VENTANA_TPM - ahora)
+        return VENTANA_TPM
+
+    def _plan_siguiente(self) -> Optional[str]:
+        pendientes = [plan for plan, cola in self._colas.items() if cola]
+        if not pendientes:
+            return None
+        # Se atiende el plan cuyo próximo turno termina antes (pase + 1/peso)
+        return min(pendientes, key=lambda plan: (self._pase[plan] + 1.0 / self.pesos[plan], -self.pesos[plan]))
+
+    def siguiente(self) -> Optional[Tuple[object, list]]:
+        """
+        Bloquea hasta que el próximo trabajo (según reparto y presupuesto) puede salir
+
+        Returns:
+            (trabajo, consumo) donde consumo se pasa a ajustar() con los tokens reales,
+            o None si no queda ningún trabajo esperando
+        """
+        with self._cond:
+            while True:
+                plan = self._plan_siguiente()
+                if plan is None:
+                    return None
+
+                elemento, tokens, encolado = self._colas[plan][0]
+                ahora = time.monotonic()
+                espera = self._espera_presupuesto(tokens, ahora)
+                if espera > 0:
+                    self._cond.wait(espera)
+                    continue
+
+                self._colas[plan].popleft()
+                self._pase[plan] += 1.0 / self.pesos[plan]
+                self._tiempo_virtual = self._pase[plan]
+                self._despachados[plan] = self._despachados.get(plan, 0) + 1
+                consumo = [ahora, tokens]
+                self._consumo.append(consumo)
+                break
+
+        obtener_metricas().observar(f"planificador.espera.{plan}", ahora - encolado)
+        return elemento, consumo
+
+    def ajustar(self, consumo: list, tokens_reales: int):
+        """Sustituye la estimación de un trabajo por los tokens que realmente gastó"""
+        with self._cond:
+            consumo[1] = tokens_reales
+            self._cond.notify_all()
+
+    def posicion(self, elemento) -> Optional[int]:
+        """
+        Puesto aproximado del trabajo en el orden de salida (1 = el siguiente)
+
+        Cuenta los que van delante en su cola y, de cada otro plan, los turnos que
+        recibirá mientras tanto según la proporción de pesos.
+        """
+        with self._cond:
+            for plan, cola in self._colas.items():
+                for indice, entrada in enumerate(cola):
+                    if entrada[0] is not elemento:
+                        continue
+                    delante = indice
+                    for otro, otra_cola in self._colas.items():
+                        if otro != plan and otra_cola:
+                            proporcion = self.pesos[otro] / self.pesos[plan]
+                            delante += min(len(otra_cola), math.ceil((indice + 1) * proporcion) - 1)
+                    return delante + 1
+        return None
+
+    def estadisticas(self) -> Dict:
+        """Profundidad por plan, trabajos despachados y uso del presupuesto de tokens"""
+        with self._cond:
+            return {
+                "profundidad": {plan: len(cola) for plan, cola in self._colas.items()},
+                "despachados": dict(self._despachados),
+                "tokens_ultimo_minuto": self._tokens_en_ventana(time.monotonic()),
+                "tokens_por_minuto": self.tokens_por_minuto,
+                "pesos": dict(self.pesos)
+            }
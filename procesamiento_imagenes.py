@@ -0,0 +1,222 @@
+"""
+Preprocesamiento de capturas MT5 para REDI7 IA
+Recorta barras y márgenes, reduce a la resolución que usa GPT-4o y recomprime
+"""
+
+import base64
+import io
+from typing import Dict, List, Tuple
+
+from PIL import Image, ImageChops, ImageOps
+
+from config import CALIDAD_IMAGEN_ANALISIS, FORMATO_IMAGEN_ANALISIS
+
+# Resolución que realmente procesa el modelo según el nivel de detalle
+# low: una sola versión de 512x512 | high: cabe en 2048x2048 y el lado corto se lleva a 768
+LADO_MAX_LOW = 512
+LADO_MAX_HIGH = 2048
+LADO_CORTO_HIGH = 768
+
+# Recorte automático de bandas (barras de herramientas, paneles, barra de estado)
+MAX_RECORTE_BANDA = 0.25   # Nunca recortar más del 25% por lado
+MIN_FONDO_FILA = 0.5       # Una fila/columna del gráfico tiene al menos 50% de color de fondo
+TOLERANCIA_FONDO = 24      # Diferencia máxima por canal para considerar un píxel "fondo"
+
+MIME_POR_FORMATO = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+    "GIF": "image/gif"
+}
+
+
+def detectar_mime(imagen_base64: str) -> str:
+    """Detecta el tipo MIME real de una imagen en base64 por su firma"""
+    try:
+        cabecera = base64.b64decode(imagen_base64[:24])
+    except Exception:
+        return "image/png"
+
+    if cabecera.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if cabecera.startswith(b"RIFF") and cabecera[8:12] == b"WEBP":
+        return "image/webp"
+    if cabecera.startswith(b"GIF8"):
+        return "image/gif"
+    return "image/png"
+
+
+def _color_fondo(img: Image.Image) -> Tuple[int, int, int]:
+    """Color más frecuente de una versión reducida (el fondo del gráfico)"""
+    muestra = img.resize((128, 128), Image.NEAREST)
+    colores = muestra.getcolors(maxcolors=128 * 128)
+    return max(colores, key=lambda c: c[0])[1]
+
+
+def _es_fondo(pixel, fondo) -> bool:
+    return all(abs(p - f) <= TOLERANCIA_FONDO for p, f in zip(pixel, fondo))
+
+
+def _recortar_bandas(img: Image.Image, fondo) -> Image.Image:
+    """
+    Recorta desde cada borde las filas/columnas que no parecen gráfico
+
+    Las barras de herramientas, pestañas y la barra de estado de MT5 tienen un color
+    distinto al fondo del gráfico, así que en esas bandas casi no hay píxeles de fondo.
+    """
+    ancho, alto = img.size
+    # Analizar sobre una versión reducida: suficiente para localizar bandas y barato
+    escala = min(1.0, 256 / max(ancho, alto))
+    mini = img.resize((max(1, int(ancho * escala)), max(1, int(alto * escala))), Image.NEAREST)
+    mw, mh = mini.size
+    pix = mini.load()
+
+    def fraccion_fila(y):
+        return sum(_es_fondo(pix[x, y], fondo) for x in range(mw)) / mw
+
+    def fraccion_columna(x):
+        return sum(_es_fondo(pix[x, y], fondo) for y in range(mh)) / mh
+
+    arriba = 0
+    while arriba < mh * MAX_RECORTE_BANDA and fraccion_fila(arriba) < MIN_FONDO_FILA:
+        arriba += 1
+    abajo = mh
+    while mh - abajo < mh * MAX_RECORTE_BANDA and fraccion_fila(abajo - 1) < MIN_FONDO_FILA:
+        abajo -= 1
+    izquierda = 0
+    while izquierda < mw * MAX_RECORTE_BANDA and fraccion_columna(izquierda) < MIN_FONDO_FILA:
+        izquierda += 1
+    derecha = mw
+    while mw - derecha < mw * MAX_RECORTE_BANDA and fraccion_columna(derecha - 1) < MIN_FONDO_FILA:
+        derecha -= 1
+
+    # Si se llegó al límite sin encontrar gráfico, ese lado no era una barra: no recortar
+    if arriba >= mh * MAX_RECORTE_BANDA:
+        arriba = 0
+    if mh - abajo >= mh * MAX_RECORTE_BANDA:
+        abajo = mh
+    if izquierda >= mw * MAX_RECORTE_BANDA:
+        izquierda = 0
+    if mw - derecha >= mw * MAX_RECORTE_BANDA:
+        derecha = mw
+
+    if (arriba, izquierda, abajo, derecha) == (0, 0, mh, mw):
+        return img
+
+    caja = (
+        int(izquierda / escala),
+        int(arriba / escala),
+        min(ancho, int(round(derecha / escala))),
+        min(alto, int(round(abajo / escala)))
+    )
+    return img.crop(caja)
+
+
+def _recortar_margenes(img: Image.Image, fondo) -> Image.Image:
+    """Quita márgenes vacíos del color de fondo alrededor del contenido"""
+    diferencia = ImageChops.difference(img, Image.new("RGB", img.size, fondo)).convert("L")
+    caja = diferencia.point(lambda v: 255 if v > TOLERANCIA_FONDO else 0).getbbox()
+    if not caja:
+        return img
+
+    margen = 4
+    caja = (
+        max(0, caja[0] - margen),
+        max(0, caja[1] - margen),
+        min(img.width, caja[2] + margen),
+        min(img.height, caja[3] + margen)
+    )
+    return img.crop(caja)
+
+
+def _redimensionar(img: Image.Image, detail: str) -> Image.Image:
+    """Reduce la imagen a la resolución efectiva que usa el modelo (nunca amplía)"""
+    ancho, alto = img.size
+    if detail == "low":
+        escala = min(1.0, LADO_MAX_LOW / max(ancho, alto))
+    else:
+        escala = min(1.0, LADO_MAX_HIGH / max(ancho, alto))
+        escala = min(escala, LADO_CORTO_HIGH / min(ancho, alto))
+
+    if escala >= 1.0:
+        return img
+    return img.resize((max(1, round(ancho * escala)), max(1, round(alto * escala))), Image.LANCZOS)
+
+
+def preparar_imagen(datos: bytes, detail: str = "high", recortar: bool = True) -> Dict:
+    """
+    Preprocesa una captura para enviarla a la API de visión
+
+    Args:
+        datos: Bytes originales de la imagen (PNG/JPEG/WEBP)
+        detail: Nivel de detalle con el que se enviará ('low' o 'high')
+        recortar: Si se recortan barras y márgenes automáticamente
+
+    Returns:
+        Dict con base64, mime, bytes originales/finales y tamaños en píxeles
+    """
+    img = Image.open(io.BytesIO(datos))
+    formato_original = img.format
+    tamano_original = img.size
+    img = ImageOps.exif_transpose(img).convert("RGB")
+
+    if recortar:
+        fondo = _color_fondo(img)
+        img = _recortar_bandas(img, fondo)
+        img = _recortar_margenes(img, fondo)
+
+    img = _redimensionar(img, detail)
+
+    formato = FORMATO_IMAGEN_ANALISIS.upper()
+    salida = io.BytesIO()
+    if formato == "PNG":
+        img.save(salida, format="PNG", optimize=True)
+    else:
+        img.save(salida, format=formato, quality=CALIDAD_IMAGEN_ANALISIS, optimize=True)
+    final = salida.getvalue()
+
+    # Gráficos planos a veces comprimen mejor sin pérdida: quedarse con lo más pequeño
+    if formato != "PNG" and formato_original == "PNG":
+        sin_perdida = io.BytesIO()
+        img.save(sin_perdida, format="PNG", optimize=True)
+        if sin_perdida.tell() < len(final):
+            final = sin_perdida.getvalue()
+            formato = "PNG"
+
+    return {
+        "base64": base64.b64encode(final).decode("utf-8"),
+        "mime": MIME_POR_FORMATO.get(formato, "image/jpeg"),
+        "bytes_originales": len(datos),
+        "bytes_finales": len(final),
+        "tamano_original": tamano_original,
+        "tamano_final": img.size
+    }
+
+
+def preparar_imagenes(lista_datos: List[bytes], detail_levels: List[str], recortar: bool = True) -> Dict:
+    """
+    Preprocesa todas las capturas de un análisis
+
+    Args:
+        lista_datos: Bytes de cada captura
+        detail_levels: Nivel de detalle de cada captura ('low' o 'high')
+        recortar: Si se recortan barras y márgenes automáticamente
+
+    Returns:
+        Dict con imagenes_base64, mime_types, bytes_originales, bytes_finales y bytes_ahorrados
+    """
+    imagenes = [
+        preparar_imagen(datos, detail, recortar=recortar)
+        for datos, detail in zip(lista_datos, detail_levels)
+    ]
+    originales = sum(img["bytes_originales"] for img in imagenes)
+    finales = sum(img["bytes_finales"] for img in imagenes)
+
+    return {
+        "imagenes_base64": [img["base64"] for img in imagenes],
+        "mime_types": [img["mime"] for img in imagenes],
+        "bytes_originales": originales,
+        "bytes_finales": finales,
+        "bytes_ahorrados": max(0, originales - finales),
+        "detalle": imagenes
+    }
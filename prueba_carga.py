@@ -0,0 +1,403 @@
+"""
+Prueba de carga de extremo a extremo para REDI7 IA
+Simula usuarios concurrentes del dashboard recorriendo el flujo real:
+login → can_analyze → reservar_analisis → analizar_con_imagenes → registrar_analisis → Telegram
+
+Corre contra sustitutos locales: MySQL de pruebas (contenedor), OpenAI simulado
+(servidor_openai_local.py) y Telegram simulado (servidor_telegram_local.py).
+Informa p50/p95/p99 por etapa y solicitudes por segundo.
+
+Uso:
+    docker run -d --name redi7-mysql -p 3307:3306 -e MYSQL_ROOT_PASSWORD=redi7 -e MYSQL_DATABASE=redi7_carga mysql:8
+    python prueba_carga.py --db-port 3307 --db-password redi7 --usuarios 50 --iteraciones 5
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+# Prefijo de los usuarios sintéticos: se crean, se reinician y se borran solo estos
+PREFIJO_USUARIO = "carga_"
+PASSWORD_PRUEBA = "carga-redi7"
+
+ETAPAS = ["login", "can_analyze", "reservar", "analisis", "registro", "telegram", "total"]
+
+HOSTS_LOCALES = ("127.0.0.1", "localhost", "::1", "mysql", "db")
+
+TEMPORALIDADES = ["M1", "M5", "M15"]
+DETAIL_LEVELS = ["low", "high", "high"]
+
+
+class RegistroEtapas:
+    """Duraciones y errores por etapa, seguro entre hilos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.duraciones: Dict[str, List[float]] = {etapa: [] for etapa in ETAPAS}
+        self.errores: Dict[str, int] = {etapa: 0 for etapa in ETAPAS}
+        self.motivos: Dict[str, int] = {}
+
+    def anotar(self, etapa: str, inicio: float, ok: bool, motivo: str = ""):
+        """Registra la duración desde `inicio` (perf_counter) y si la etapa falló"""
+        duracion = time.perf_counter() - inicio
+        with self._lock:
+            self.duraciones[etapa].append(duracion)
+            if not ok:
+                self.errores[etapa] += 1
+                if motivo:
+                    clave = f"{etapa}: {motivo[:80]}"
+                    self.motivos[clave] = self.motivos.get(clave, 0) + 1
+        return ok
+
+    def resumen(self, segundos: float) -> Dict:
+        """p50/p95/p99/max en milisegundos, errores y tasa por etapa"""
+        with self._lock:
+            resumen = {}
+            for etapa in ETAPAS:
+                valores = np.array(self.duraciones[etapa]) * 1000
+                if valores.size == 0:
+                    continue
+                p50, p95, p99 = np.percentile(valores, [50, 95, 99])
+                resumen[etapa] = {
+                    "n": int(valores.size),
+                    "errores": self.errores[etapa],
+                    "p50_ms": round(float(p50), 1),
+                    "p95_ms": round(float(p95), 1),
+                    "p99_ms": round(float(p99), 1),
+                    "max_ms": round(float(valores.max()), 1),
+                    "por_segundo": round(valores.size / segundos, 2) if segundos > 0 else 0.0
+                }
+            return resumen
+
+
+def capturas_sinteticas(cantidad: int = 3) -> List[bytes]:
+    """Gráficos de velas falsos con barras de MT5, para que el preprocesado trabaje como en real"""
+    capturas = []
+    for i in range(cantidad):
+        img = Image.new("RGB", (1600, 900), (16, 20, 28))
+        dibujo = ImageDraw.Draw(img)
+        dibujo.rectangle((0, 0, 1600, 40), fill=(230, 230, 230))
+        dibujo.rectangle((0, 870, 1600, 900), fill=(200, 200, 200))
+        rng = np.random.default_rng(i)
+        precio = 450.0
+        for x in range(20, 1580, 12):
+            apertura = precio
+            precio = float(np.clip(precio + rng.normal(0, 8), 120, 820))
+            color = (38, 166, 154) if precio >= apertura else (239, 83, 80)
+            alto, bajo = max(apertura, precio) + rng.uniform(0, 10), min(apertura, precio) - rng.uniform(0, 10)
+            dibujo.line((x + 4, alto, x + 4, bajo), fill=color)
+            dibujo.rectangle((x, min(apertura, precio), x + 8, max(apertura, precio) + 1), fill=color)
+        salida = io.BytesIO()
+        img.save(salida, format="PNG")
+        capturas.append(salida.getvalue())
+    return capturas
+
+
+def preparar_usuarios(auth, cantidad: int, plan: str) -> List[Dict]:
+    """
+    Crea (o reutiliza) los usuarios sintéticos y pone a cero su uso del día
+
+    Returns:
+        Lista de dicts con username y password
+    """
+    conn = auth._get_connection()
+    if not conn:
+        raise RuntimeError("No se pudo conectar a la base de datos de pruebas")
+
+    cursor = conn.cursor(buffered=True)
+    password_hash = auth._hash_password(PASSWORD_PRUEBA)
+    usuarios = []
+    try:
+        for i in range(cantidad):
+            username = f"{PREFIJO_USUARIO}{i:04d}"
+            cursor.execute("""
+                INSERT INTO usuarios (username, email, password_hash, nombre_completo, plan, activo,
+                                      referral_code, telegram_bot_token, telegram_chat_id)
+                VALUES (%s, %s, %s, %s, %s, 1, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE password_hash = VALUES(password_hash), plan = VALUES(plan), activo = 1,
+                    telegram_bot_token = VALUES(telegram_bot_token), telegram_chat_id = VALUES(telegram_chat_id)
+            """, (
+                username, f"{username}@redi7.test", password_hash, f"Usuario de carga {i}", plan,
+                f"CARGA{i:05d}", f"{900000 + i}:CARGA-{i:04d}", str(100000 + i)
+            ))
+            usuarios.append({"username": username, "password": PASSWORD_PRUEBA})
+
+        # Reiniciar cupos: cada ejecución empieza con el día limpio
+        patron = f"{PREFIJO_USUARIO}%"
+        cursor.execute("""
+            DELETE FROM uso_diario WHERE user_id IN (SELECT id FROM usuarios WHERE username LIKE %s)
+        """, (patron,))
+        cursor.execute("""
+            DELETE FROM historial_analisis WHERE user_id IN (SELECT id FROM usuarios WHERE username LIKE %s)
+        """, (patron,))
+        conn.commit()
+    finally:
+        auth._safe_close_cursor(cursor)
+        conn.close()
+    return usuarios
+
+
+def borrar_usuarios(auth) -> int:
+    """Elimina los usuarios sintéticos (historial y cupos caen por ON DELETE CASCADE)"""
+    conn = auth._get_connection()
+    if not conn:
+        return 0
+    cursor = conn.cursor(buffered=True)
+    try:
+        cursor.execute("DELETE FROM usuarios WHERE username LIKE %s", (f"{PREFIJO_USUARIO}%",))
+        borrados = cursor.rowcount
+        conn.commit()
+        return borrados
+    finally:
+        auth._safe_close_cursor(cursor)
+        conn.close()
+
+
+def ejecutar_flujo(auth, ia, usuario: Dict, imagenes: Dict, registro: RegistroEtapas, salida_estructurada: bool) -> bool:
+    """Un análisis completo de un usuario, como lo hace el dashboard; True si llegó al final"""
+    from telegram_sender import TelegramSender
+
+    inicio_total = time.perf_counter()
+
+    inicio = time.perf_counter()
+    login = auth.login(usuario["username"], usuario["password"])
+    if not registro.anotar("login", inicio, login.get("success", False), login.get("mensaje", "")):
+        return registro.anotar("total", inicio_total, False)
+    user_id, plan = login["user_data"]["id"], login["user_data"]["plan"]
+
+    inicio = time.perf_counter()
+    limites = auth.can_analyze(user_id, plan)
+    if not registro.anotar("can_analyze", inicio, limites["allowed"], "sin cupo"):
+        return registro.anotar("total", inicio_total, False)
+
+    inicio = time.perf_counter()
+    reserva = auth.reservar_analisis(user_id, plan)
+    if not registro.anotar("reservar", inicio, reserva["allowed"], "sin cupo"):
+        return registro.anotar("total", inicio_total, False)
+
+    inicio = time.perf_counter()
+    try:
+        resultado = ia.analizar_con_imagenes(
+            activo="XAUUSD",
+            modo="SCALPING",
+            capital=10000.0,
+            riesgo_porcentaje=1.0,
+            horario_actual=time.strftime("%H:%M"),
+            imagenes_base64=imagenes["imagenes_base64"],
+            detail_levels=DETAIL_LEVELS,
+            dispositivo="PC",
+            temporalidades=TEMPORALIDADES,
+            usar_cache=False,
+            mime_types=imagenes["mime_types"],
+            salida_estructurada=salida_estructurada
+        )
+    except Exception as e:
+        resultado = {"error": True, "mensaje": str(e)}
+    if not registro.anotar("analisis", inicio, not resultado.get("error"), resultado.get("mensaje", "")):
+        auth.liberar_reserva(reserva["reserva"])
+        return registro.anotar("total", inicio_total, False)
+
+    inicio = time.perf_counter()
+    registrado = auth.registrar_analisis(
+        user_id, "XAUUSD", "SCALPING", ", ".join(TEMPORALIDADES),
+        resultado["analisis"][:1000], reserva=reserva["reserva"]
+    )
+    if not registro.anotar("registro", inicio, bool(registrado), "no se pudo registrar"):
+        return registro.anotar("total", inicio_total, False)
+
+    inicio = time.perf_counter()
+    telegram_config = auth.obtener_telegram_config(user_id)
+    envio = {"exito": False, "mensaje": "Telegram no configurado"}
+    if telegram_config["configurado"]:
+        sender = TelegramSender(bot_token=telegram_config["bot_token"], chat_id=telegram_config["chat_id"])
+        mensaje = f"🚀 SEÑAL REDI7 AI\n\n📊 Activo: XAUUSD\n⚡ Modo: SCALPING\n\n{resultado['analisis']}"
+        envio = sender.enviar_mensaje(mensaje, parse_mode=None)
+    if not registro.anotar("telegram", inicio, envio["exito"], envio["mensaje"]):
+        return registro.anotar("total", inicio_total, False)
+
+    return registro.anotar("total", inicio_total, True)
+
+
+def usuario_virtual(auth, ia, usuario, imagenes, registro, iteraciones, retraso, pausa, salida_estructurada, progreso):
+    """Un usuario del dashboard: espera su turno de la rampa y repite el flujo"""
+    time.sleep(retraso)
+    for _ in range(iteraciones):
+        ejecutar_flujo(auth, ia, usuario, imagenes, registro, salida_estructurada)
+        progreso()
+        if pausa:
+            time.sleep(pausa)
+
+
+def imprimir_informe(resumen: Dict, segundos: float, flujos: int, completados: int, motivos: Dict):
+    """Tabla de latencias por etapa y rendimiento global"""
+    print("=" * 78)
+    print("📊 REDI7 IA - Resultado de la prueba de carga")
+    print("=" * 78)
+    print(f"{'Etapa':<13}{'n':>7}{'errores':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'req/s':>9}")
+    print("-" * 78)
+    for etapa, datos in resumen.items():
+        print(
+            f"{etapa:<13}{datos['n']:>7}{datos['errores']:>9}{datos['p50_ms']:>10}"
+            f"{datos['p95_ms']:>10}{datos['p99_ms']:>10}{datos['max_ms']:>10}{datos['por_segundo']:>9}"
+        )
+    print("-" * 78)
+    print(f"⏱️ Duración: {segundos:.1f}s | Flujos: {completados}/{flujos} completos | "
+          f"{completados / segundos if segundos else 0:.2f} análisis/s")
+    if motivos:
+        print("\n⚠️ Errores más frecuentes:")
+        for motivo, veces in sorted(motivos.items(), key=lambda m: -m[1])[:8]:
+            print(f"   {veces:>5} × {motivo}")
+
+
+def main():
+    """Punto de entrada de la línea de comandos"""
+    parser = argparse.ArgumentParser(description="REDI7 IA - Prueba de carga de extremo a extremo")
+    parser.add_argument("--usuarios", type=int, default=20, help="Usuarios concurrentes")
+    parser.add_argument("--iteraciones", type=int, default=3, help="Análisis por usuario")
+    parser.add_argument("--rampa", type=float, default=5.0, help="Segundos para arrancar a todos los usuarios")
+    parser.add_argument("--pausa", type=float, default=0.0, help="Segundos entre análisis de un mismo usuario")
+    parser.add_argument("--plan", default="elite", help="Plan de los usuarios sintéticos")
+    parser.add_argument("--texto", action="store_true", help="Pedir la salida en texto en lugar de JSON estructurado")
+    parser.add_argument("--db-host", default="127.0.0.1")
+    parser.add_argument("--db-port", type=int, default=3306)
+    parser.add_argument("--db-user", default="root")
+    parser.add_argument("--db-password", default="")
+    parser.add_argument("--db-name", default="redi7_carga")
+    parser.add_argument("--db-pool", type=int, default=10, help="Tamaño del pool de conexiones (como DB_POOL_SIZE)")
+    parser.add_argument("--permitir-bd-remota", action="store_true", help="Permitir una base que no sea local")
+    parser.add_argument("--openai-url", default="", help="OpenAI ya arrancado (si no, se levanta uno simulado)")
+    parser.add_argument("--telegram-url", default="", help="Telegram ya arrancado (si no, se levanta uno simulado)")
+    parser.add_argument("--puerto-openai", type=int, default=8787, help="Puerto del OpenAI simulado")
+    parser.add_argument("--puerto-telegram", type=int, default=8788, help="Puerto del Telegram simulado")
+    parser.add_argument("--latencia-openai", type=float, default=2.0, help="Media al primer token del OpenAI simulado")
+    parser.add_argument("--tasa-429", type=float, default=0.0, help="429 inyectados en el OpenAI simulado")
+    parser.add_argument("--latencia-telegram", type=float, default=0.15, help="Latencia media del Telegram simulado")
+    parser.add_argument("--json", default="", help="Guardar el resumen en este archivo")
+    parser.add_argument("--limpiar", action="store_true", help="Borrar los usuarios sintéticos al terminar")
+    args = parser.parse_args()
+
+    if args.db_host not in HOSTS_LOCALES and not args.permitir_bd_remota:
+        print(f"❌ {args.db_host} no es una base local. Usa --permitir-bd-remota si de verdad es de pruebas.")
+        sys.exit(1)
+
+    # config.py lee el entorno al importarse (también vía los servidores simulados):
+    # fijar las URL de los sustitutos antes de importar cualquier módulo de la app
+    arrancar_openai, arrancar_telegram = not args.openai_url, not args.telegram_url
+    if arrancar_openai:
+        args.openai_url = f"http://127.0.0.1:{args.puerto_openai}/v1"
+    if arrancar_telegram:
+        args.telegram_url = f"http://127.0.0.1:{args.puerto_telegram}"
+    os.environ["OPENAI_BASE_URL"] = args.openai_url
+    os.environ["TELEGRAM_API_BASE"] = args.telegram_url
+
+    servidores = []
+    if arrancar_openai:
+        import servidor_openai_local
+        servidores.append(servidor_openai_local.crear_servidor(
+            "127.0.0.1", args.puerto_openai, latencia_media=args.latencia_openai, tasa_429=args.tasa_429
+        ))
+    if arrancar_telegram:
+        import servidor_telegram_local
+        servidores.append(servidor_telegram_local.crear_servidor(
+            "127.0.0.1", args.puerto_telegram, latencia_media=args.latencia_telegram
+        ))
+    for servidor in servidores:
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+
+    from auth import AuthSystem
+    from procesamiento_imagenes import preparar_imagenes
+    from redi7_ai import REDI7AI
+
+    print("=" * 60)
+    print("🏋️ REDI7 IA - Prueba de carga")
+    print("=" * 60)
+    print(f"🗄️ MySQL: {args.db_user}@{args.db_host}:{args.db_port}/{args.db_name} (pool {args.db_pool})")
+    print(f"🤖 OpenAI: {args.openai_url}")
+    print(f"📨 Telegram: {args.telegram_url}")
+    print(f"👥 {args.usuarios} usuarios × {args.iteraciones} análisis | rampa {args.rampa}s")
+
+    auth = AuthSystem(config_bd={
+        "host": args.db_host,
+        "port": args.db_port,
+        "user": args.db_user,
+        "password": args.db_password,
+        "database": args.db_name,
+        "pool_size": args.db_pool
+    })
+    if not auth.verificar_esquema():
+        print("❌ No se pudo preparar el esquema de la base de pruebas")
+        sys.exit(1)
+
+    limite = AuthSystem.PLAN_LIMITS.get(args.plan, 3)
+    if args.iteraciones > limite:
+        print(f"⚠️ El plan {args.plan} permite {limite} análisis/día: el resto fallará en can_analyze")
+
+    usuarios = preparar_usuarios(auth, args.usuarios, args.plan)
+    imagenes = preparar_imagenes(capturas_sinteticas(len(TEMPORALIDADES)), DETAIL_LEVELS)
+    ia = REDI7AI(api_key=os.getenv("OPENAI_API_KEY") or "sk-prueba-carga")
+    registro = RegistroEtapas()
+
+    flujos = args.usuarios * args.iteraciones
+    hechos = [0]
+    hechos_lock = threading.Lock()
+
+    def progreso():
+        with hechos_lock:
+            hechos[0] += 1
+            if hechos[0] % max(1, flujos // 20) == 0 or hechos[0] == flujos:
+                sys.stderr.write(f"\r⏳ {hechos[0]}/{flujos} flujos")
+                sys.stderr.flush()
+
+    inicio = time.perf_counter()
+    # Los módulos de la app imprimen en cada llamada: silenciar durante la medición
+    with open(os.devnull, "w") as nulo, redirect_stdout(nulo):
+        with ThreadPoolExecutor(max_workers=args.usuarios, thread_name_prefix="redi7-carga") as ejecutor:
+            for i, usuario in enumerate(usuarios):
+                retraso = args.rampa * i / max(1, args.usuarios)
+                ejecutor.submit(
+                    usuario_virtual, auth, ia, usuario, imagenes, registro,
+                    args.iteraciones, retraso, args.pausa, not args.texto, progreso
+                )
+    segundos = time.perf_counter() - inicio
+    sys.stderr.write("\n")
+
+    resumen = registro.resumen(segundos)
+    completados = resumen.get("total", {}).get("n", 0) - resumen.get("total", {}).get("errores", 0)
+    imprimir_informe(resumen, segundos, flujos, completados, registro.motivos)
+    print(f"\n🗄️ Pool MySQL: {auth.pool.estado()}")
+    for servidor in servidores:
+        print(f"🧪 {type(servidor.simulador).__name__}: {servidor.simulador.estadisticas}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as archivo:
+            json.dump({
+                "parametros": vars(args),
+                "segundos": round(segundos, 2),
+                "flujos": flujos,
+                "completados": completados,
+                "analisis_por_segundo": round(completados / segundos, 3) if segundos else 0.0,
+                "etapas": resumen,
+                "errores": registro.motivos,
+                "pool": auth.pool.estado()
+            }, archivo, ensure_ascii=False, indent=2)
+        print(f"💾 Resumen guardado en {args.json}")
+
+    if args.limpiar:
+        print(f"🧹 Usuarios sintéticos borrados: {borrar_usuarios(auth)}")
+
+    for servidor in servidores:
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
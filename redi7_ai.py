@@ -4,15 +4,40 @@ Autor: Geiser
 Fecha: Febrero 2026
 """
 
+import asyncio
+import json
+import numpy as np
 import openai
 import os
+import re
+import time
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
 from dotenv import load_dotenv
+from cache_analisis import (
+    VueloCancelado,
+    clave_analisis,
+    obtener_cache_analisis,
+    obtener_vuelos_en_curso,
+    ttl_para_temporalidades
+)
+from config import API_TIMEOUT, MAX_CONCURRENCIA_ANALISIS, OPENAI_BASE_URL
+from metricas import medir, obtener_metricas, tramo
+from procesamiento_imagenes import detectar_mime
+from resiliencia import (
+    es_fallo_proveedor,
+    llamar_con_reintentos,
+    llamar_con_reintentos_async,
+    mensaje_error_api,
+    obtener_cortacircuitos
+)
 
 # Cargar variables de entorno desde archivo .env
 load_dotenv()
 
+# Timeout por intento: API_TIMEOUT para leer la respuesta, conexión acotada aparte
+TIMEOUT_API = openai.Timeout(API_TIMEOUT, connect=min(10.0, API_TIMEOUT))
+
 
 class REDI7AI:
     """Sistema de análisis de trading institucional basado en Smart Money Concept"""
@@ -39,6 +64,39 @@ class REDI7AI:
         "EURUSD": {"min": 0.95, "max": 1.25, "descripcion": "EUR/USD entre 0.95-1.25"}
     }
     
+    # Subir al cambiar PROMPT_MAESTRO o el mensaje de usuario (invalida la caché de análisis)
+    VERSION_PROMPT = "1"
+    
+    # Salida estructurada: el modelo devuelve la señal como objeto JSON tipado
+    ESQUEMA_SENAL = {
+        "name": "senal_redi7",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "direccion": {"type": "string", "enum": ["BUY", "SELL"]},
+                "entrada": {"type": "number", "description": "Precio de entrada"},
+                "stop_loss": {"type": "number", "description": "Precio del stop loss"},
+                "tp1": {"type": "number", "description": "Primer take profit"},
+                "tp2": {"type": "number", "description": "Segundo take profit"},
+                "tp3": {"type": "number", "description": "Tercer take profit"},
+                "probabilidad": {"type": "integer", "description": "Probabilidad estimada de éxito, 50-95"},
+                "contexto": {"type": "string", "description": "Resumen de UNA línea con lo más importante del análisis"}
+            },
+            "required": ["direccion", "entrada", "stop_loss", "tp1", "tp2", "tp3", "probabilidad", "contexto"],
+            "additionalProperties": False
+        }
+    }
+    
+    # Campos de precio de la señal (en el orden en que los emite el modelo)
+    NIVELES_SENAL = ["entrada", "stop_loss", "tp1", "tp2", "tp3"]
+    
+    PROMPT_ESTRUCTURADO = """
+
+SALIDA ESTRUCTURADA:
+Responde ÚNICAMENTE con el objeto JSON del esquema senal_redi7 (sin texto adicional).
+Los precios son números sin separador de miles, leídos del gráfico con la misma precisión que el eje de precios."""
+    
     PROMPT_MAESTRO = """Eres REDI7 IA, analista profesional de mercados institucionales especializado en Smart Money Concept.
 
 TU MISIÓN:
@@ -79,15 +137,22 @@ IMPORTANTE:
 - Enfócate en la calidad del análisis institucional
 """
 
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, cache=None):
         """
         Inicializa el sistema REDI7 IA
         
         Args:
             api_key: Clave API de OpenAI
+            cache: Caché de análisis (por defecto la compartida del proceso)
         """
-        self.client = openai.OpenAI(api_key=api_key)
+        # Los reintentos los gestiona resiliencia.py (Retry-After, plazo total, cortacircuitos)
+        self.client = openai.OpenAI(
+            api_key=api_key, base_url=OPENAI_BASE_URL or None, timeout=TIMEOUT_API, max_retries=0
+        )
         self.modelo = "gpt-4o"  # Modelo con capacidad de visión
+        self.cache = cache if cache is not None else obtener_cache_analisis()
+        # Peticiones idénticas simultáneas comparten una sola llamada a la API
+        self.vuelos = obtener_vuelos_en_curso()
         
     def validar_activo(self, activo: str) -> bool:
         """Valida si el activo está en la lista permitida"""
@@ -169,6 +234,135 @@ IMPORTANTE:
             "rr_tp3": round(rr_tp3, 2)
         }
     
+    @classmethod
+    def calcular_gestion_riesgo_lote(
+        cls,
+        activos,
+        entrada,
+        stop_loss,
+        tp1,
+        tp2,
+        tp3,
+        capitales,
+        riesgos_porcentaje
+    ) -> Dict[str, np.ndarray]:
+        """
+        Versión vectorizada de calcular_gestion_riesgo con NumPy
+        
+        Todos los argumentos se combinan por broadcasting: varias señales a la vez (arrays 1D
+        alineados) o una matriz de sensibilidad (capitales de forma (N, 1) y riesgos (1, M)).
+        
+        Args:
+            activos: Símbolo o array de símbolos (fija el valor del punto de cada fila)
+            entrada, stop_loss, tp1, tp2, tp3: Precios (escalares o arrays)
+            capitales: Capital total (escalar o array)
+            riesgos_porcentaje: Porcentaje de riesgo (escalar o array)
+            
+        Returns:
+            Mismas claves que calcular_gestion_riesgo, con arrays (lotaje 0 si SL == entrada)
+        """
+        if isinstance(activos, str):
+            valor_punto = np.float64(cls.VALOR_PUNTO.get(activos.upper(), 10.0))
+        else:
+            valor_punto = np.array([cls.VALOR_PUNTO.get(str(a).upper(), 10.0) for a in np.ravel(activos)])
+            valor_punto = valor_punto.reshape(np.shape(activos))
+        
+        entrada = np.asarray(entrada, dtype=np.float64)
+        capitales = np.asarray(capitales, dtype=np.float64)
+        riesgos_porcentaje = np.asarray(riesgos_porcentaje, dtype=np.float64)
+        
+        # Las distancias son absolutas: BUY y SELL se calculan igual
+        distancia_sl = np.abs(entrada - np.asarray(stop_loss, dtype=np.float64))
+        riesgo_usd = capitales * (riesgos_porcentaje / 100)
+        
+        with np.errstate(divide="ignore", invalid="ignore"):
+            lotaje = np.where(distancia_sl > 0, riesgo_usd / (distancia_sl * valor_punto), 0.0)
+            lotaje = np.round(lotaje, 2)
+            
+            usd_por_punto = valor_punto * lotaje
+            ganancias = [np.abs(np.asarray(tp, dtype=np.float64) - entrada) * usd_por_punto for tp in (tp1, tp2, tp3)]
+            ratios = [np.where(riesgo_usd > 0, g / riesgo_usd, 0.0) for g in ganancias]
+        
+        return {
+            "lotaje": lotaje,
+            "riesgo_usd": np.round(riesgo_usd, 2),
+            "distancia_sl_puntos": np.round(distancia_sl, 1),
+            "valor_punto": valor_punto,
+            "ganancia_tp1": np.round(ganancias[0], 2),
+            "ganancia_tp2": np.round(ganancias[1], 2),
+            "ganancia_tp3": np.round(ganancias[2], 2),
+            "rr_tp1": np.round(ratios[0], 2),
+            "rr_tp2": np.round(ratios[1], 2),
+            "rr_tp3": np.round(ratios[2], 2)
+        }
+    
+    @classmethod
+    def tabla_sensibilidad(
+        cls,
+        activo: str,
+        senal: Dict[str, any],
+        capitales,
+        riesgos_porcentaje
+    ) -> Dict[str, np.ndarray]:
+        """
+        Gestión de riesgo de una señal para cada combinación capital × riesgo
+        
+        Returns:
+            Dict de calcular_gestion_riesgo_lote con matrices (len(capitales), len(riesgos))
+            más los ejes "capitales" y "riesgos_porcentaje"
+        """
+        capitales = np.asarray(capitales, dtype=np.float64)
+        riesgos_porcentaje = np.asarray(riesgos_porcentaje, dtype=np.float64)
+        
+        tabla = cls.calcular_gestion_riesgo_lote(
+            activo,
+            senal["entrada"],
+            senal["stop_loss"],
+            senal["tp1"],
+            senal["tp2"],
+            senal["tp3"],
+            capitales[:, np.newaxis],
+            riesgos_porcentaje[np.newaxis, :]
+        )
+        tabla["capitales"] = capitales
+        tabla["riesgos_porcentaje"] = riesgos_porcentaje
+        return tabla
+    
+    @classmethod
+    def recalcular_senales(
+        cls,
+        activos: List[str],
+        senales: List[Dict[str, any]],
+        capital: float,
+        riesgo_porcentaje: float
+    ) -> Dict[str, np.ndarray]:
+        """
+        Re-calcula de una vez la gestión de muchas señales guardadas con otro capital/riesgo
+        
+        Args:
+            activos: Activo de cada señal
+            senales: Señales con entrada, stop_loss, tp1, tp2, tp3
+            capital: Capital a aplicar
+            riesgo_porcentaje: Riesgo a aplicar
+            
+        Returns:
+            Dict de calcular_gestion_riesgo_lote con un valor por señal
+        """
+        niveles = {
+            clave: np.array([float(senal[clave]) for senal in senales], dtype=np.float64)
+            for clave in cls.NIVELES_SENAL
+        }
+        return cls.calcular_gestion_riesgo_lote(
+            np.array(activos),
+            niveles["entrada"],
+            niveles["stop_loss"],
+            niveles["tp1"],
+            niveles["tp2"],
+            niveles["tp3"],
+            capital,
+            riesgo_porcentaje
+        )
+    
     def analizar_mercado(
         self,
         activo: str,
@@ -236,7 +430,7 @@ Por favor, realiza el análisis completo siguiendo tu protocolo institucional.
         
         try:
             # Llamada a la API
-            response = self.client.chat.completions.create(
+            response = llamar_con_reintentos(lambda: self.client.chat.completions.create(
                 model=self.modelo,
                 messages=[
                     {"role": "system", "content": self.PROMPT_MAESTRO},
@@ -244,7 +438,7 @@ Por favor, realiza el análisis completo siguiendo tu protocolo institucional.
                 ],
                 temperature=0.7,
                 max_tokens=2000
-            )
+            ))
             
             analisis = response.choices[0].message.content
             
@@ -264,7 +458,7 @@ Por favor, realiza el análisis completo siguiendo tu protocolo institucional.
         except Exception as e:
             return {
                 "error": True,
-                "mensaje": f"❌ Error en la API: {str(e)}"
+                "mensaje": mensaje_error_api(e)
             }
     
     def analizar_con_imagenes(
@@ -281,7 +475,10 @@ Por favor, realiza el análisis completo siguiendo tu protocolo institucional.
         evento_macro: bool = False,
         descripcion_evento: str = "",
         contexto_adicional: str = "",
-        gestionar_riesgo: bool = True
+        gestionar_riesgo: bool = True,
+        usar_cache: bool = True,
+        mime_types: Optional[List[str]] = None,
+        salida_estructurada: bool = False
     ) -> Dict[str, any]:
         """
         Realiza análisis con capturas de pantalla de MT5 usando GPT-4 Vision
@@ -300,12 +497,265 @@ Por favor, realiza el análisis completo siguiendo tu protocolo institucional.
             descripcion_evento: Descripción del evento
             contexto_adicional: Información adicional
             gestionar_riesgo: Si se debe incluir gestión de riesgo en el análisis
+            usar_cache: Si se reutiliza un análisis previo de las mismas capturas
+            mime_types: Tipo MIME de cada imagen (si no se indica, se detecta por su firma)
+            salida_estructurada: Si el modelo devuelve la señal como JSON tipado (resultado["senal"])
             
         Returns:
             Diccionario con el análisis completo
         """
         
-        # Validaciones
+        error = self._validar_solicitud_imagenes(activo, modo, riesgo_porcentaje, imagenes_base64)
+        if error:
+            return error
+        
+        # Buscar primero en la caché por contenido (mismas capturas y parámetros)
+        clave_cache, cacheado = self._buscar_en_cache(
+            usar_cache, imagenes_base64, detail_levels, activo, modo, dispositivo,
+            temporalidades, contexto_adicional, descripcion_evento if evento_macro else "",
+            salida_estructurada
+        )
+        
+        compartido = False
+        if cacheado is not None:
+            analisis = cacheado["analisis"]
+            tokens_usados = 0
+            senal = self._senal_respuesta(cacheado, salida_estructurada)
+        else:
+            def llamar():
+                content = self._construir_contenido_imagenes(
+                    activo, modo, horario_actual, imagenes_base64, detail_levels,
+                    dispositivo, temporalidades, contexto_adicional, mime_types
+                )
+                # Llamada a la API con GPT-4 Vision
+                with tramo("openai.chat"):
+                    response = llamar_con_reintentos(lambda: self.client.chat.completions.create(
+                        **self._parametros_vision(content, salida_estructurada)
+                    ))
+                respuesta = {
+                    "analisis": response.choices[0].message.content,
+                    "tokens_usados": response.usage.total_tokens
+                }
+                respuesta["senal"] = self._leer_senal(respuesta["analisis"], salida_estructurada)
+                # Guardar antes de liberar el vuelo: quien llegue después ya acierta en caché
+                self._guardar_respuesta(clave_cache, respuesta, temporalidades, salida_estructurada)
+                return respuesta
+            
+            try:
+                respuesta, compartido = self.vuelos.ejecutar(clave_cache, llamar)
+            except Exception as e:
+                return {
+                    "error": True,
+                    "mensaje": mensaje_error_api(e)
+                }
+            
+            analisis = respuesta["analisis"]
+            # Los tokens se atribuyen a quien hizo la llamada
+            tokens_usados = 0 if compartido else respuesta["tokens_usados"]
+            senal = self._senal_respuesta(respuesta, salida_estructurada)
+            
+            if salida_estructurada and senal is None:
+                return self._error_senal_invalida()
+        
+        resultado = self._armar_resultado_imagenes(
+            analisis, tokens_usados, cacheado is not None, activo, modo, capital,
+            riesgo_porcentaje, horario_actual, evento_macro, gestionar_riesgo, salida_estructurada, senal
+        )
+        resultado["compartido"] = compartido
+        return resultado
+    
+    def analizar_con_imagenes_stream(
+        self,
+        activo: str,
+        modo: str,
+        capital: float,
+        riesgo_porcentaje: float,
+        horario_actual: str,
+        imagenes_base64: List[str],
+        detail_levels: List[str],
+        dispositivo: str,
+        temporalidades: List[str],
+        evento_macro: bool = False,
+        descripcion_evento: str = "",
+        contexto_adicional: str = "",
+        gestionar_riesgo: bool = True,
+        usar_cache: bool = True,
+        mime_types: Optional[List[str]] = None,
+        salida_estructurada: bool = False
+    ) -> Iterator[Dict[str, any]]:
+        """
+        Variante en streaming de analizar_con_imagenes (mismos parámetros)
+        
+        Emite eventos a medida que llega la respuesta del modelo:
+            {"tipo": "texto", "delta": str, "texto": str}  - nuevo fragmento y texto acumulado
+            {"tipo": "gestion", "gestion": dict}           - en cuanto se leen Entrada/SL/TP
+            {"tipo": "fin", "resultado": dict}             - mismo dict que analizar_con_imagenes
+            {"tipo": "error", "resultado": dict}           - validación o error de la API
+        """
+        error = self._validar_solicitud_imagenes(activo, modo, riesgo_porcentaje, imagenes_base64)
+        if error:
+            yield {"tipo": "error", "resultado": error}
+            return
+        
+        clave_cache, cacheado = self._buscar_en_cache(
+            usar_cache, imagenes_base64, detail_levels, activo, modo, dispositivo,
+            temporalidades, contexto_adicional, descripcion_evento if evento_macro else "",
+            salida_estructurada
+        )
+        
+        gestion_emitida = False
+        desde_cache = cacheado is not None
+        vuelo = None
+        
+        if cacheado is None and clave_cache is not None:
+            # Si otra sesión ya está analizando lo mismo, esperar su resultado en lugar de llamar
+            try:
+                cacheado, vuelo = self.vuelos.unirse(clave_cache)
+            except Exception as e:
+                yield {"tipo": "error", "resultado": {"error": True, "mensaje": mensaje_error_api(e)}}
+                return
+        compartido = cacheado is not None and not desde_cache
+        
+        if cacheado is not None:
+            analisis = cacheado["analisis"]
+            tokens_usados = 0
+            senal = self._senal_respuesta(cacheado, salida_estructurada)
+            if compartido and salida_estructurada and senal is None:
+                yield {"tipo": "error", "resultado": self._error_senal_invalida()}
+                return
+            if not salida_estructurada:
+                yield {"tipo": "texto", "delta": analisis, "texto": analisis}
+        else:
+            analisis = ""
+            vista_previa = ""
+            tokens_usados = 0
+            metricas = obtener_metricas()
+            inicio_api = time.perf_counter()
+            primer_token = False
+            stream = None
+            try:
+                content = self._construir_contenido_imagenes(
+                    activo, modo, horario_actual, imagenes_base64, detail_levels,
+                    dispositivo, temporalidades, contexto_adicional, mime_types
+                )
+                
+                # Solo se reintenta la apertura del stream: con texto ya emitido no se repite
+                stream = llamar_con_reintentos(lambda: self.client.chat.completions.create(
+                    **self._parametros_vision(content, salida_estructurada),
+                    stream=True,
+                    stream_options={"include_usage": True}
+                ))
+                
+                for chunk in stream:
+                    # El último fragmento trae el uso de tokens y ninguna elección
+                    if chunk.usage:
+                        tokens_usados = chunk.usage.total_tokens
+                    if not chunk.choices:
+                        continue
+                    
+                    delta = chunk.choices[0].delta.content or ""
+                    if not delta:
+                        continue
+                    
+                    if not primer_token:
+                        primer_token = True
+                        metricas.observar("openai.primer_token", time.perf_counter() - inicio_api)
+                    
+                    analisis += delta
+                    
+                    if salida_estructurada:
+                        # JSON a medias: mostrar los campos ya completos con el formato de la señal
+                        campos = self._campos_completos(analisis)
+                        texto = self._formatear_senal(campos, activo)
+                        if texto != vista_previa:
+                            nuevo = texto[len(vista_previa):] if texto.startswith(vista_previa) else texto
+                            vista_previa = texto
+                            yield {"tipo": "texto", "delta": nuevo, "texto": texto}
+                        
+                        if gestionar_riesgo and not gestion_emitida and all(k in campos for k in self.NIVELES_SENAL):
+                            gestion_emitida = True
+                            gestion = self._gestion_desde_senal(campos, activo, capital, riesgo_porcentaje)
+                            if gestion:
+                                yield {"tipo": "gestion", "gestion": gestion}
+                        continue
+                    
+                    yield {"tipo": "texto", "delta": delta, "texto": analisis}
+                    
+                    # Gestión de riesgo en cuanto la línea de TP3 está completa
+                    if gestionar_riesgo and not gestion_emitida:
+                        pos_tp3 = analisis.find("🎯TP3:")
+                        if pos_tp3 >= 0 and "\n" in analisis[pos_tp3:]:
+                            gestion_emitida = True
+                            gestion = self._gestion_desde_texto(analisis, activo, capital, riesgo_porcentaje)
+                            if gestion:
+                                yield {"tipo": "gestion", "gestion": gestion}
+            except GeneratorExit:
+                # Cancelado por quien consumía el stream: los que esperaban llamarán por su cuenta
+                self._publicar_vuelo(clave_cache, vuelo, error=VueloCancelado())
+                raise
+            except Exception as e:
+                if stream is not None and es_fallo_proveedor(e):
+                    # Corte a mitad del stream (los fallos al abrirlo ya los contó llamar_con_reintentos)
+                    obtener_cortacircuitos().registrar_fallo()
+                metricas.observar("openai.stream", time.perf_counter() - inicio_api, error=True)
+                self._publicar_vuelo(clave_cache, vuelo, error=e)
+                yield {
+                    "tipo": "error",
+                    "resultado": {
+                        "error": True,
+                        "mensaje": mensaje_error_api(e)
+                    }
+                }
+                return
+            metricas.observar("openai.stream", time.perf_counter() - inicio_api)
+            
+            senal = self._leer_senal(analisis, salida_estructurada)
+            respuesta = {"analisis": analisis, "tokens_usados": tokens_usados, "senal": senal}
+            self._guardar_respuesta(clave_cache, respuesta, temporalidades, salida_estructurada)
+            self._publicar_vuelo(clave_cache, vuelo, valor=respuesta)
+            
+            if salida_estructurada and senal is None:
+                yield {"tipo": "error", "resultado": self._error_senal_invalida()}
+                return
+        
+        resultado = self._armar_resultado_imagenes(
+            analisis, tokens_usados, desde_cache, activo, modo, capital,
+            riesgo_porcentaje, horario_actual, evento_macro, gestionar_riesgo, salida_estructurada, senal
+        )
+        resultado["compartido"] = compartido
+        if salida_estructurada and cacheado is not None:
+            yield {"tipo": "texto", "delta": resultado["analisis"], "texto": resultado["analisis"]}
+        if resultado.get("gestion") and not gestion_emitida:
+            yield {"tipo": "gestion", "gestion": resultado["gestion"]}
+        yield {"tipo": "fin", "resultado": resultado}
+    
+    def _parametros_vision(self, content: List[Dict], salida_estructurada: bool = False) -> Dict[str, any]:
+        """Parámetros de la llamada de visión (comunes a la variante síncrona, streaming y async)"""
+        prompt = self.PROMPT_MAESTRO + (self.PROMPT_ESTRUCTURADO if salida_estructurada else "")
+        parametros = {
+            "model": self.modelo,
+            "messages": [
+                {"role": "system", "content": prompt},
+                {"role": "user", "content": content}
+            ],
+            "temperature": 0.7,
+            "max_tokens": 3000,
+            "top_p": 1.0,
+            "frequency_penalty": 0.0,
+            "presence_penalty": 0.0
+        }
+        if salida_estructurada:
+            parametros["response_format"] = {"type": "json_schema", "json_schema": self.ESQUEMA_SENAL}
+        return parametros
+    
+    def _validar_solicitud_imagenes(
+        self,
+        activo: str,
+        modo: str,
+        riesgo_porcentaje: float,
+        imagenes_base64: List[str]
+    ) -> Optional[Dict[str, any]]:
+        """Valida los parámetros de un análisis con imágenes; devuelve el dict de error o None"""
         if not self.validar_activo(activo):
             return {
                 "error": True,
@@ -331,7 +781,126 @@ Por favor, realiza el análisis completo siguiendo tu protocolo institucional.
                 "mensaje": f"❌ Se requieren 2 o 3 capturas de gráficos según el dispositivo (recibidas: {num_imagenes})"
             }
         
-        # Construir mensaje del usuario con contexto
+        return None
+    
+    @medir("cache.analisis")
+    def _buscar_en_cache(
+        self,
+        usar_cache: bool,
+        imagenes_base64: List[str],
+        detail_levels: List[str],
+        activo: str,
+        modo: str,
+        dispositivo: str,
+        temporalidades: List[str],
+        contexto_adicional: str,
+        descripcion_evento: str,
+        salida_estructurada: bool = False
+    ):
+        """Devuelve (clave, análisis cacheado o None); clave es None si no se usa caché"""
+        if not usar_cache or self.cache is None:
+            return None, None
+        
+        clave = clave_analisis(
+            imagenes_base64,
+            detail_levels,
+            activo,
+            modo,
+            dispositivo,
+            temporalidades,
+            f"{self.VERSION_PROMPT}|{self.modelo}|{'json' if salida_estructurada else 'texto'}",
+            extra=f"{contexto_adicional}|{descripcion_evento}"
+        )
+        return clave, self.cache.obtener(clave)
+    
+    def _guardar_en_cache(self, clave: Optional[str], analisis: str, tokens_usados: int, temporalidades: List[str]):
+        """Guarda la respuesta cruda: la gestión de riesgo depende del capital y se recalcula"""
+        if clave is None:
+            return
+        self.cache.guardar(
+            clave,
+            {"analisis": analisis, "tokens_usados": tokens_usados},
+            ttl=ttl_para_temporalidades(temporalidades)
+        )
+    
+    def _guardar_respuesta(
+        self,
+        clave: Optional[str],
+        respuesta: Dict,
+        temporalidades: List[str],
+        salida_estructurada: bool
+    ):
+        """Guarda en caché una respuesta de la API salvo que sea una señal JSON inválida"""
+        if salida_estructurada and respuesta["senal"] is None:
+            return
+        self._guardar_en_cache(clave, respuesta["analisis"], respuesta["tokens_usados"], temporalidades)
+    
+    def _publicar_vuelo(self, clave: Optional[str], futuro, valor: Optional[Dict] = None, error: Optional[BaseException] = None):
+        """Entrega el resultado del líder a los que esperaban (no hace nada si no había vuelo)"""
+        if futuro is not None and not futuro.done():
+            self.vuelos.terminar(clave, futuro, valor=valor, error=error)
+    
+    def _armar_resultado_imagenes(
+        self,
+        analisis: str,
+        tokens_usados: int,
+        desde_cache: bool,
+        activo: str,
+        modo: str,
+        capital: float,
+        riesgo_porcentaje: float,
+        horario_actual: str,
+        evento_macro: bool,
+        gestionar_riesgo: bool,
+        salida_estructurada: bool,
+        senal: Optional[Dict[str, any]]
+    ) -> Dict[str, any]:
+        """
+        Añade la gestión de riesgo local y construye el dict de resultado
+        
+        Con salida estructurada, `analisis` es el JSON del modelo y el texto visible se genera
+        a partir de `senal`; en modo texto `senal` son los niveles leídos de las líneas con emoji.
+        """
+        if salida_estructurada:
+            analisis = self._formatear_senal(senal, activo)
+        
+        gestion = None
+        if gestionar_riesgo and senal:
+            gestion = self._gestion_desde_senal(senal, activo, capital, riesgo_porcentaje)
+            if gestion:
+                analisis += self._formatear_gestion_riesgo(gestion, capital, riesgo_porcentaje)
+        
+        return {
+            "error": False,
+            "activo": activo.upper(),
+            "modo": modo.upper(),
+            "capital": capital,
+            "riesgo_porcentaje": riesgo_porcentaje,
+            "horario": horario_actual,
+            "evento_macro": evento_macro,
+            "analisis": analisis,
+            "senal": senal,
+            "gestion": gestion,
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "tokens_usados": tokens_usados,
+            "con_imagenes": True,
+            "desde_cache": desde_cache
+        }
+    
+    def _construir_contenido_imagenes(
+        self,
+        activo: str,
+        modo: str,
+        horario_actual: str,
+        imagenes_base64: List[str],
+        detail_levels: List[str],
+        dispositivo: str,
+        temporalidades: List[str],
+        contexto_adicional: str = "",
+        mime_types: Optional[List[str]] = None
+    ) -> List[Dict]:
+        """Construye el contenido del mensaje de usuario (texto + imágenes) para la API"""
+        num_imagenes = len(imagenes_base64)
         fecha_actual = datetime.now().strftime("%Y-%m-%d")
         
         # Mensaje base SIEMPRE SIN gestión de riesgo (eso se calcula localmente)
@@ -362,73 +931,169 @@ IMPORTANTE: NO calcules lotaje ni gestión de riesgo. Solo proporciona niveles d
             }
         ]
         
-        # Agregar las imágenes al contenido con sus niveles de detalle
-        for i, (img_base64, detail) in enumerate(zip(imagenes_base64, detail_levels), 1):
+        if not mime_types:
+            mime_types = [detectar_mime(img) for img in imagenes_base64]
+        
+        # Agregar las imágenes al contenido con su tipo real y nivel de detalle
+        for i, (img_base64, detail, mime) in enumerate(zip(imagenes_base64, detail_levels, mime_types), 1):
             content.append({
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/png;base64,{img_base64}",
+                    "url": f"data:{mime};base64,{img_base64}",
                     "detail": detail  # 'low' o 'high' según configuración
                 }
             })
         
+        return content
+    
+    def _extraer_niveles(self, analisis: str) -> Optional[Dict[str, any]]:
+        """
+        Lee dirección, entrada, SL y TPs de las líneas con emoji del análisis
+        
+        Returns:
+            Dict con direccion, entrada, stop_loss, tp1, tp2, tp3 o None si falta alguno
+        """
+        # Buscar señal (BUY o SELL)
+        match_senal = re.search(r'🚨Señal:\s*(BUY|SELL)', analisis, re.IGNORECASE)
+        direccion = match_senal.group(1).upper() if match_senal else "BUY"
+        
+        # Buscar precios
+        match_entrada = re.search(r'💰Entrada:\s*([\d.,]+)', analisis)
+        match_sl = re.search(r'🚫SL:\s*([\d.,]+)', analisis)
+        match_tp1 = re.search(r'🎯TP1:\s*([\d.,]+)', analisis)
+        match_tp2 = re.search(r'🎯TP2:\s*([\d.,]+)', analisis)
+        match_tp3 = re.search(r'🎯TP3:\s*([\d.,]+)', analisis)
+        
+        if not all([match_entrada, match_sl, match_tp1, match_tp2, match_tp3]):
+            return None
+        
+        return {
+            "direccion": direccion,
+            "entrada": float(match_entrada.group(1).replace(',', '')),
+            "stop_loss": float(match_sl.group(1).replace(',', '')),
+            "tp1": float(match_tp1.group(1).replace(',', '')),
+            "tp2": float(match_tp2.group(1).replace(',', '')),
+            "tp3": float(match_tp3.group(1).replace(',', ''))
+        }
+    
+    def _leer_senal(self, respuesta: str, salida_estructurada: bool) -> Optional[Dict[str, any]]:
+        """Obtiene la señal de la respuesta del modelo (JSON o líneas con emoji); None si no se puede"""
+        if salida_estructurada:
+            return self._parsear_senal_json(respuesta)
+        return self._extraer_niveles(respuesta)
+    
+    def _senal_respuesta(self, respuesta: Dict, salida_estructurada: bool) -> Optional[Dict[str, any]]:
+        """Señal de una respuesta: la ya leída por quien la obtuvo, o leída ahora si viene de la caché"""
+        if "senal" in respuesta:
+            return respuesta["senal"]
+        return self._leer_senal(respuesta["analisis"], salida_estructurada)
+    
+    def _parsear_senal_json(self, respuesta: str) -> Optional[Dict[str, any]]:
+        """
+        Valida el objeto JSON de la salida estructurada
+        
+        Returns:
+            Dict con direccion, niveles (float), probabilidad (int) y contexto, o None si no es válido
+        """
         try:
-            # Llamada a la API con GPT-4 Vision
-            response = self.client.chat.completions.create(
-                model=self.modelo,
-                messages=[
-                    {"role": "system", "content": self.PROMPT_MAESTRO},
-                    {"role": "user", "content": content}
-                ],
-                temperature=0.7,
-                max_tokens=3000,
-                top_p=1.0,
-                frequency_penalty=0.0,
-                presence_penalty=0.0
-            )
-            
-            analisis = response.choices[0].message.content
+            datos = json.loads(respuesta)
+            direccion = str(datos["direccion"]).upper()
+            if direccion not in ("BUY", "SELL"):
+                raise ValueError(f"dirección desconocida: {direccion}")
             
-            # Si gestionar_riesgo está activado, calcular localmente
-            gestion_riesgo_texto = ""
-            if gestionar_riesgo:
-                try:
-                    # Extraer valores del análisis usando regex
-                    import re
-                    
-                    # Buscar señal (BUY o SELL)
-                    match_senal = re.search(r'🚨Señal:\s*(BUY|SELL)', analisis, re.IGNORECASE)
-                    direccion = match_senal.group(1).upper() if match_senal else "BUY"
-                    
-                    # Buscar precios
-                    match_entrada = re.search(r'💰Entrada:\s*([\d.,]+)', analisis)
-                    match_sl = re.search(r'🚫SL:\s*([\d.,]+)', analisis)
-                    match_tp1 = re.search(r'🎯TP1:\s*([\d.,]+)', analisis)
-                    match_tp2 = re.search(r'🎯TP2:\s*([\d.,]+)', analisis)
-                    match_tp3 = re.search(r'🎯TP3:\s*([\d.,]+)', analisis)
-                    
-                    if all([match_entrada, match_sl, match_tp1, match_tp2, match_tp3]):
-                        entrada = float(match_entrada.group(1).replace(',', ''))
-                        stop_loss = float(match_sl.group(1).replace(',', ''))
-                        tp1 = float(match_tp1.group(1).replace(',', ''))
-                        tp2 = float(match_tp2.group(1).replace(',', ''))
-                        tp3 = float(match_tp3.group(1).replace(',', ''))
-                        
-                        # Calcular gestión de riesgo usando la función local
-                        gestion = self.calcular_gestion_riesgo(
-                            activo=activo,
-                            entrada=entrada,
-                            stop_loss=stop_loss,
-                            tp1=tp1,
-                            tp2=tp2,
-                            tp3=tp3,
-                            capital=capital,
-                            riesgo_porcentaje=riesgo_porcentaje,
-                            direccion=direccion
-                        )
-                        
-                        # Construir texto de gestión de riesgo
-                        gestion_riesgo_texto = f"""
+            senal = {"direccion": direccion}
+            for clave in self.NIVELES_SENAL:
+                senal[clave] = float(datos[clave])
+            senal["probabilidad"] = int(datos["probabilidad"])
+            senal["contexto"] = str(datos["contexto"])
+            return senal
+        except (TypeError, ValueError, KeyError) as e:
+            print(f"⚠️ Respuesta estructurada inválida: {e}")
+            return None
+    
+    def _error_senal_invalida(self) -> Dict[str, any]:
+        """Error explícito cuando la salida estructurada no trae una señal válida (no se cachea)"""
+        return {
+            "error": True,
+            "mensaje": "❌ El modelo devolvió una señal incompleta o inválida. Inténtalo de nuevo."
+        }
+    
+    def _campos_completos(self, json_parcial: str) -> Dict[str, any]:
+        """Campos escalares ya terminados de un JSON que todavía se está recibiendo"""
+        campos = {}
+        for match in re.finditer(r'"(\w+)"\s*:\s*("(?:[^"\\]|\\.)*"|-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)\s*[,}]', json_parcial):
+            try:
+                campos[match.group(1)] = json.loads(match.group(2))
+            except ValueError:
+                continue
+        return campos
+    
+    def _formatear_precio(self, precio: float) -> str:
+        """Precio sin ceros sobrantes (2650.5, 1.08523)"""
+        return f"{precio:.5f}".rstrip("0").rstrip(".")
+    
+    def _formatear_senal(self, senal: Dict[str, any], activo: str) -> str:
+        """Texto de la señal con el formato de emojis de REDI7 (omite los campos que falten)"""
+        lineas = ["🚨REDI7 IA🚨"]
+        if "direccion" in senal:
+            lineas.append(f"🚨Señal: {senal['direccion']} en {activo.upper()}🚨")
+        for clave, etiqueta in (
+            ("entrada", "💰Entrada"),
+            ("stop_loss", "🚫SL"),
+            ("tp1", "🎯TP1"),
+            ("tp2", "🎯TP2"),
+            ("tp3", "🎯TP3")
+        ):
+            if clave in senal:
+                lineas.append(f"{etiqueta}: {self._formatear_precio(float(senal[clave]))}")
+        if "probabilidad" in senal:
+            lineas.append(f"✅Probabilidad: {senal['probabilidad']}%")
+        if "contexto" in senal:
+            lineas.append(f"📊Contexto: {senal['contexto']}")
+        return "\n".join(lineas)
+    
+    def _gestion_desde_texto(
+        self,
+        analisis: str,
+        activo: str,
+        capital: float,
+        riesgo_porcentaje: float
+    ) -> Optional[Dict[str, any]]:
+        """Calcula la gestión de riesgo a partir de las líneas con emoji (None si no se leen)"""
+        niveles = self._extraer_niveles(analisis)
+        if not niveles:
+            return None
+        return self._gestion_desde_senal(niveles, activo, capital, riesgo_porcentaje)
+    
+    def _gestion_desde_senal(
+        self,
+        senal: Dict[str, any],
+        activo: str,
+        capital: float,
+        riesgo_porcentaje: float
+    ) -> Optional[Dict[str, any]]:
+        """Calcula la gestión de riesgo a partir de los niveles de la señal (None si no se puede)"""
+        try:
+            # Calcular gestión de riesgo usando la función local
+            return self.calcular_gestion_riesgo(
+                activo=activo,
+                entrada=float(senal["entrada"]),
+                stop_loss=float(senal["stop_loss"]),
+                tp1=float(senal["tp1"]),
+                tp2=float(senal["tp2"]),
+                tp3=float(senal["tp3"]),
+                capital=capital,
+                riesgo_porcentaje=riesgo_porcentaje,
+                direccion=str(senal.get("direccion", "BUY"))
+            )
+        except Exception as e:
+            print(f"Error calculando gestión de riesgo: {e}")
+            # Si falla, continuar sin gestión de riesgo
+            return None
+    
+    def _formatear_gestion_riesgo(self, gestion: Dict[str, any], capital: float, riesgo_porcentaje: float) -> str:
+        """Construye el bloque de texto de gestión de riesgo que se añade al análisis"""
+        return f"""
 
 📉GESTIÓN DE RIESGO REDI7📉
 💰 Capital: ${capital:,.2f}
@@ -441,33 +1106,156 @@ IMPORTANTE: NO calcules lotaje ni gestión de riesgo. Solo proporciona niveles d
 📈 Ratio Riesgo/Beneficio promedio: {((gestion['rr_tp1'] + gestion['rr_tp2'] + gestion['rr_tp3']) / 3):.2f}
 
 ℹ️ Valor del punto: ${gestion['valor_punto']} | Distancia SL: {gestion['distancia_sl_puntos']} puntos"""
-                        
-                        # Agregar al análisis
-                        analisis += gestion_riesgo_texto
-                        
-                except Exception as e:
-                    print(f"Error calculando gestión de riesgo: {e}")
-                    # Si falla, continuar sin gestión de riesgo
+
+class AsyncREDI7AI(REDI7AI):
+    """
+    Motor REDI7 IA sobre el cliente asíncrono de OpenAI
+    
+    Mientras se espera a la API no se bloquea ningún hilo, así que varios análisis
+    (p. ej. los cinco activos de un usuario Elite) tardan lo que el más lento.
+    """
+    
+    def __init__(self, api_key: str, cache=None, max_concurrencia: Optional[int] = None):
+        """
+        Args:
+            api_key: Clave API de OpenAI
+            cache: Caché de análisis (por defecto la compartida del proceso)
+            max_concurrencia: Análisis simultáneos en analizar_lote (por defecto config.MAX_CONCURRENCIA_ANALISIS)
+        """
+        super().__init__(api_key, cache=cache)
+        self.client_async = openai.AsyncOpenAI(
+            api_key=api_key, base_url=OPENAI_BASE_URL or None, timeout=TIMEOUT_API, max_retries=0
+        )
+        self.max_concurrencia = max_concurrencia or MAX_CONCURRENCIA_ANALISIS
+    
+    async def analizar_con_imagenes_async(
+        self,
+        activo: str,
+        modo: str,
+        capital: float,
+        riesgo_porcentaje: float,
+        horario_actual: str,
+        imagenes_base64: List[str],
+        detail_levels: List[str],
+        dispositivo: str,
+        temporalidades: List[str],
+        evento_macro: bool = False,
+        descripcion_evento: str = "",
+        contexto_adicional: str = "",
+        gestionar_riesgo: bool = True,
+        usar_cache: bool = True,
+        mime_types: Optional[List[str]] = None,
+        salida_estructurada: bool = False
+    ) -> Dict[str, any]:
+        """Versión asíncrona de analizar_con_imagenes (mismos parámetros y resultado)"""
+        error = self._validar_solicitud_imagenes(activo, modo, riesgo_porcentaje, imagenes_base64)
+        if error:
+            return error
+        
+        clave_cache, cacheado = self._buscar_en_cache(
+            usar_cache, imagenes_base64, detail_levels, activo, modo, dispositivo,
+            temporalidades, contexto_adicional, descripcion_evento if evento_macro else "",
+            salida_estructurada
+        )
+        
+        compartido = False
+        if cacheado is not None:
+            analisis = cacheado["analisis"]
+            tokens_usados = 0
+            senal = self._senal_respuesta(cacheado, salida_estructurada)
+        else:
+            async def llamar():
+                content = self._construir_contenido_imagenes(
+                    activo, modo, horario_actual, imagenes_base64, detail_levels,
+                    dispositivo, temporalidades, contexto_adicional, mime_types
+                )
+                with tramo("openai.chat_async"):
+                    response = await llamar_con_reintentos_async(lambda: self.client_async.chat.completions.create(
+                        **self._parametros_vision(content, salida_estructurada)
+                    ))
+                respuesta = {
+                    "analisis": response.choices[0].message.content,
+                    "tokens_usados": response.usage.total_tokens
+                }
+                respuesta["senal"] = self._leer_senal(respuesta["analisis"], salida_estructurada)
+                self._guardar_respuesta(clave_cache, respuesta, temporalidades, salida_estructurada)
+                return respuesta
             
-            return {
-                "error": False,
-                "activo": activo.upper(),
-                "modo": modo.upper(),
-                "capital": capital,
-                "riesgo_porcentaje": riesgo_porcentaje,
-                "horario": horario_actual,
-                "evento_macro": evento_macro,
-                "analisis": analisis,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "tokens_usados": response.usage.total_tokens,
-                "con_imagenes": True
-            }
+            try:
+                respuesta, compartido = await self.vuelos.ejecutar_async(clave_cache, llamar)
+            except Exception as e:
+                return {
+                    "error": True,
+                    "mensaje": mensaje_error_api(e)
+                }
             
-        except Exception as e:
-            return {
-                "error": True,
-                "mensaje": f"❌ Error en la API: {str(e)}"
-            }
+            analisis = respuesta["analisis"]
+            tokens_usados = 0 if compartido else respuesta["tokens_usados"]
+            senal = self._senal_respuesta(respuesta, salida_estructurada)
+            
+            if salida_estructurada and senal is None:
+                return self._error_senal_invalida()
+        
+        resultado = self._armar_resultado_imagenes(
+            analisis, tokens_usados, cacheado is not None, activo, modo, capital,
+            riesgo_porcentaje, horario_actual, evento_macro, gestionar_riesgo, salida_estructurada, senal
+        )
+        resultado["compartido"] = compartido
+        return resultado
+    
+    async def analizar_lote(
+        self,
+        solicitudes: List[Dict[str, any]],
+        max_concurrencia: Optional[int] = None
+    ) -> List[Dict[str, any]]:
+        """
+        Ejecuta varios análisis a la vez, como mucho `max_concurrencia` simultáneos
+        
+        Args:
+            solicitudes: Parámetros de analizar_con_imagenes para cada análisis (normalmente uno por activo)
+            max_concurrencia: Límite de llamadas simultáneas (por defecto el del motor)
+            
+        Returns:
+            Resultados en el mismo orden que las solicitudes (un fallo no cancela el resto)
+        """
+        semaforo = asyncio.Semaphore(max_concurrencia or self.max_concurrencia)
+        
+        async def ejecutar(solicitud: Dict[str, any]) -> Dict[str, any]:
+            async with semaforo:
+                try:
+                    return await self.analizar_con_imagenes_async(**solicitud)
+                except Exception as e:
+                    return {
+                        "error": True,
+                        "activo": str(solicitud.get("activo", "")).upper(),
+                        "mensaje": f"❌ Error en el análisis: {str(e)}"
+                    }
+        
+        return await asyncio.gather(*(ejecutar(solicitud) for solicitud in solicitudes))
+    
+    async def cerrar(self):
+        """Cierra las conexiones del cliente asíncrono"""
+        await self.client_async.close()
+
+
+def analizar_lote_sync(
+    api_key: str,
+    solicitudes: List[Dict[str, any]],
+    max_concurrencia: Optional[int] = None
+) -> List[Dict[str, any]]:
+    """
+    Ejecuta un lote de análisis desde código síncrono (script de Streamlit, CLI)
+    
+    Crea un motor asíncrono propio para el bucle de eventos de esta llamada y lo cierra al terminar.
+    """
+    async def ejecutar_lote():
+        motor = AsyncREDI7AI(api_key=api_key, max_concurrencia=max_concurrencia)
+        try:
+            return await motor.analizar_lote(solicitudes)
+        finally:
+            await motor.cerrar()
+    
+    return asyncio.run(ejecutar_lote())
 
 
 def main():
@@ -0,0 +1,304 @@
+"""
+Resiliencia de las llamadas a OpenAI para REDI7 IA
+Reintentos con backoff exponencial y jitter que respetan Retry-After, plazo total acotado
+y un cortacircuitos por proceso que falla rápido mientras el proveedor está caído
+"""
+
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+import openai
+
+from config import (
+    API_BACKOFF_BASE,
+    API_BACKOFF_MAX,
+    API_PLAZO_TOTAL,
+    API_REINTENTOS,
+    API_TIMEOUT,
+    CIRCUITO_SEGUNDOS_ABIERTO,
+    CIRCUITO_UMBRAL_FALLOS
+)
+from metricas import obtener_metricas
+
+# Estados del cortacircuitos
+CERRADO = "cerrado"
+ABIERTO = "abierto"
+SEMIABIERTO = "semiabierto"
+
+
+class CircuitoAbierto(Exception):
+    """El proveedor se considera caído: la llamada se rechaza sin salir del proceso"""
+
+    def __init__(self, segundos_restantes: float):
+        self.segundos_restantes = segundos_restantes
+        super().__init__(f"OpenAI no disponible temporalmente, reintenta en {segundos_restantes:.0f}s")
+
+
+class Cortacircuitos:
+    """
+    Cortacircuitos clásico cerrado → abierto → semiabierto
+
+    Tras `umbral_fallos` fallos seguidos del proveedor se abre y rechaza llamadas durante
+    `segundos_abierto`; después deja pasar una sola llamada de prueba que lo cierra o lo reabre.
+    """
+
+    def __init__(self, umbral_fallos: int = 5, segundos_abierto: float = 30.0):
+        self.umbral_fallos = umbral_fallos
+        self.segundos_abierto = segundos_abierto
+        self.estado = CERRADO
+        self.fallos_seguidos = 0
+        self.abierto_hasta = 0.0
+        self.aperturas = 0
+        self.rechazadas = 0
+        self._prueba_en_curso = False
+        self._lock = threading.Lock()
+
+    def permitir(self):
+        """Lanza CircuitoAbierto si la llamada no debe intentarse"""
+        with self._lock:
+            if self.estado == CERRADO:
+                return
+            ahora = time.monotonic()
+            if self.estado == ABIERTO and ahora >= self.abierto_hasta:
+                self.estado = SEMIABIERTO
+                self._prueba_en_curso = False
+            if self.estado == SEMIABIERTO and not self._prueba_en_curso:
+                self._prueba_en_curso = True
+                return
+            self.rechazadas += 1
+            raise CircuitoAbierto(max(0.0, self.abierto_hasta - ahora))
+
+    def liberar_prueba(self):
+        """La llamada de prueba terminó sin veredicto (cancelada o error propio): otra podrá probar"""
+        with self._lock:
+            self._prueba_en_curso = False
+
+    def registrar_exito(self):
+        with self._lock:
+            self.estado = CERRADO
+            self.fallos_seguidos = 0
+            self._prueba_en_curso = False
+
+    def registrar_fallo(self):
+        with self._lock:
+            self.fallos_seguidos += 1
+            if self.estado == SEMIABIERTO or self.fallos_seguidos >= self.umbral_fallos:
+                if self.estado != ABIERTO:
+                    self.aperturas += 1
+                    print(f"🔌 Cortacircuitos de OpenAI abierto durante {self.segundos_abierto:.0f}s")
+                self.estado = ABIERTO
+                self.abierto_hasta = time.monotonic() + self.segundos_abierto
+                self._prueba_en_curso = False
+
+    def estadisticas(self) -> Dict:
+        with self._lock:
+            return {
+                "estado": self.estado,
+                "fallos_seguidos": self.fallos_seguidos,
+                "aperturas": self.aperturas,
+                "rechazadas": self.rechazadas,
+                "segundos_para_reintento": round(max(0.0, self.abierto_hasta - time.monotonic()), 1)
+                if self.estado == ABIERTO else 0.0
+            }
+
+
+def es_reintentable(error: Exception) -> bool:
+    """429, 408/409, 5xx, timeouts y errores de conexión se reintentan; el resto no"""
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def es_fallo_proveedor(error: Exception) -> bool:
+    """Fallos que cuentan para el cortacircuitos: un 429 significa que el proveedor responde"""
+    return es_reintentable(error) and getattr(error, "status_code", None) != 429
+
+
+def segundos_retry_after(error: Exception) -> Optional[float]:
+    """Lee retry-after-ms o Retry-After (segundos o fecha HTTP) de la respuesta de error"""
+    respuesta = getattr(error, "response", None)
+    if respuesta is None:
+        return None
+    cabeceras = respuesta.headers
+
+    valor_ms = cabeceras.get("retry-after-ms")
+    if valor_ms:
+        try:
+            return float(valor_ms) / 1000
+        except ValueError:
+            pass
+
+    valor = cabeceras.get("retry-after")
+    if not valor:
+        return None
+    try:
+        return float(valor)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+class PoliticaReintentos:
+    """Cuántas veces y cuánto esperar entre intentos"""
+
+    def __init__(
+        self,
+        max_intentos: int = 3,
+        base: float = 1.0,
+        maximo: float = 20.0,
+        plazo_total: float = 90.0,
+        timeout_intento: float = 0.0
+    ):
+        """
+        Args:
+            max_intentos: Intentos totales (1 = sin reintentos)
+            base: Espera del primer reintento en segundos (se duplica en cada uno)
+            maximo: Tope del backoff propio; un Retry-After se respeta entero (el plazo total decide)
+            plazo_total: Segundos máximos desde el primer intento; no se reintenta si no caben
+            timeout_intento: Duración máxima de un intento (la espera más el intento deben caber)
+        """
+        self.max_intentos = max(1, max_intentos)
+        self.base = base
+        self.maximo = maximo
+        self.plazo_total = plazo_total
+        self.timeout_intento = timeout_intento
+
+    def espera(self, intento: int, error: Exception) -> float:
+        """Espera antes del intento siguiente: backoff con jitter completo, nunca menos que el Retry-After"""
+        backoff = random.uniform(0, min(self.maximo, self.base * 2 ** (intento - 1)))
+        retry_after = segundos_retry_after(error)
+        if retry_after is not None:
+            # Reintentar antes de lo que pide el servidor solo gasta un intento en otro 429
+            return max(retry_after, backoff)
+        return backoff
+
+
+def _preparar_reintento(error, intento, politica, cortacircuitos, inicio) -> Optional[float]:
+    """Registra el fallo y devuelve la espera antes del próximo intento (None = no reintentar)"""
+    if es_fallo_proveedor(error):
+        cortacircuitos.registrar_fallo()
+    elif isinstance(error, openai.APIStatusError):
+        # 4xx (incluido 429): el proveedor responde, no cuenta como caída
+        cortacircuitos.registrar_exito()
+    else:
+        # Error nuestro (no del proveedor): no dice nada de su estado
+        cortacircuitos.liberar_prueba()
+    if not es_reintentable(error) or intento >= politica.max_intentos:
+        return None
+
+    espera = politica.espera(intento, error)
+    # El reintento entero (espera + intento con su timeout) debe terminar dentro del plazo
+    if time.monotonic() - inicio + espera + politica.timeout_intento > politica.plazo_total:
+        return None
+
+    print(f"🔁 OpenAI {type(error).__name__}: reintento {intento + 1}/{politica.max_intentos} en {espera:.1f}s")
+    obtener_metricas().observar("openai.espera_reintento", espera)
+    return espera
+
+
+def llamar_con_reintentos(
+    funcion: Callable,
+    politica: Optional[PoliticaReintentos] = None,
+    cortacircuitos: Optional[Cortacircuitos] = None
+):
+    """
+    Ejecuta `funcion()` con reintentos y cortacircuitos
+
+    Raises:
+        CircuitoAbierto si el proveedor está marcado como caído, o el último error de la API
+    """
+    politica = politica or obtener_politica()
+    cortacircuitos = cortacircuitos or obtener_cortacircuitos()
+    inicio = time.monotonic()
+    intento = 1
+    while True:
+        cortacircuitos.permitir()
+        try:
+            resultado = funcion()
+        except Exception as e:
+            espera = _preparar_reintento(e, intento, politica, cortacircuitos, inicio)
+            if espera is None:
+                raise
+            time.sleep(espera)
+            intento += 1
+            continue
+        except BaseException:
+            cortacircuitos.liberar_prueba()
+            raise
+        cortacircuitos.registrar_exito()
+        return resultado
+
+
+async def llamar_con_reintentos_async(
+    funcion: Callable[[], Awaitable],
+    politica: Optional[PoliticaReintentos] = None,
+    cortacircuitos: Optional[Cortacircuitos] = None
+):
+    """Versión asíncrona de llamar_con_reintentos (las esperas no bloquean el event loop)"""
+    politica = politica or obtener_politica()
+    cortacircuitos = cortacircuitos or obtener_cortacircuitos()
+    inicio = time.monotonic()
+    intento = 1
+    while True:
+        cortacircuitos.permitir()
+        try:
+            resultado = await funcion()
+        except Exception as e:
+            espera = _preparar_reintento(e, intento, politica, cortacircuitos, inicio)
+            if espera is None:
+                raise
+            await asyncio.sleep(espera)
+            intento += 1
+            continue
+        except BaseException:
+            # Cancelación (CancelledError) o interrupción: la prueba no puede quedar tomada
+            cortacircuitos.liberar_prueba()
+            raise
+        cortacircuitos.registrar_exito()
+        return resultado
+
+
+def mensaje_error_api(error: Exception) -> str:
+    """Mensaje para el usuario según el tipo de fallo"""
+    if isinstance(error, CircuitoAbierto):
+        return f"❌ {error}"
+    if isinstance(error, openai.RateLimitError):
+        return "❌ OpenAI está limitando las solicitudes (429). Inténtalo de nuevo en unos segundos"
+    if isinstance(error, openai.APITimeoutError):
+        return "❌ OpenAI no respondió a tiempo. Inténtalo de nuevo"
+    return f"❌ Error en la API: {str(error)}"
+
+
+_cortacircuitos: Optional[Cortacircuitos] = None
+_politica: Optional[PoliticaReintentos] = None
+_resiliencia_lock = threading.Lock()
+
+
+def obtener_cortacircuitos() -> Cortacircuitos:
+    """Cortacircuitos de OpenAI del proceso (compartido por todas las sesiones y motores)"""
+    global _cortacircuitos
+    if _cortacircuitos is None:
+        with _resiliencia_lock:
+            if _cortacircuitos is None:
+                _cortacircuitos = Cortacircuitos(CIRCUITO_UMBRAL_FALLOS, CIRCUITO_SEGUNDOS_ABIERTO)
+    return _cortacircuitos
+
+
+def obtener_politica() -> PoliticaReintentos:
+    """Política de reintentos configurada en config.py"""
+    global _politica
+    if _politica is None:
+        with _resiliencia_lock:
+            if _politica is None:
+                _politica = PoliticaReintentos(
+                    API_REINTENTOS, API_BACKOFF_BASE, API_BACKOFF_MAX, API_PLAZO_TOTAL, API_TIMEOUT
+                )
+    return _politica
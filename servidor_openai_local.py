@@ -0,0 +1,371 @@
+"""
+Servidor local que imita la API de chat-completions de OpenAI para REDI7 IA
+Permite medir rendimiento sin conexión: latencias configurables, streaming, errores 429/500
+y respuestas con el formato de señales REDI7 (texto o JSON estructurado)
+
+Uso:
+    python servidor_openai_local.py --puerto 8787 --latencia lognormal --latencia-media 2.5 --tasa-429 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8787/v1 streamlit run app_redi7.py
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+from redi7_ai import REDI7AI
+
+# Tokens que factura OpenAI por imagen según el nivel de detalle (aprox. 1 tile en high)
+TOKENS_IMAGEN = {"low": 85, "high": 765}
+
+DISTRIBUCIONES = ["fija", "uniforme", "normal", "lognormal"]
+
+CONTEXTOS = [
+    "Barrida de liquidez bajo el mínimo asiático y CHoCH en M1",
+    "Order block alcista en M15 con FVG sin mitigar por encima",
+    "BOS bajista en M15 tras rechazo en zona premium",
+    "Rango comprimido: entrada en el extremo con confirmación de volumen",
+    "Mitigación de order block bajista y desplazamiento institucional"
+]
+
+
+class SimuladorOpenAI:
+    """Genera respuestas y latencias sintéticas; lleva estadísticas de lo servido"""
+
+    def __init__(
+        self,
+        distribucion: str = "lognormal",
+        latencia_media: float = 2.0,
+        latencia_desviacion: float = 0.5,
+        ms_por_token: float = 8.0,
+        tasa_429: float = 0.0,
+        tasa_500: float = 0.0,
+        retry_after: float = 1.0,
+        tokens_prompt_base: int = 350,
+        tokens_respuesta: Optional[int] = None,
+        semilla: Optional[int] = None
+    ):
+        """
+        Args:
+            distribucion: Distribución del tiempo hasta el primer token (fija, uniforme, normal, lognormal)
+            latencia_media: Media de ese tiempo en segundos
+            latencia_desviacion: Desviación (en lognormal, sigma del logaritmo)
+            ms_por_token: Milisegundos por token generado (ritmo del streaming)
+            tasa_429: Probabilidad de responder 429 (rate limit) con Retry-After
+            tasa_500: Probabilidad de responder 500
+            retry_after: Segundos que se indican en Retry-After
+            tokens_prompt_base: Tokens de prompt sin contar imágenes
+            tokens_respuesta: Fija los tokens de respuesta (None = estimar por longitud)
+            semilla: Semilla aleatoria para resultados reproducibles
+        """
+        if distribucion not in DISTRIBUCIONES:
+            raise ValueError(f"Distribución no soportada: {distribucion}")
+        self.distribucion = distribucion
+        self.latencia_media = latencia_media
+        self.latencia_desviacion = latencia_desviacion
+        self.ms_por_token = ms_por_token
+        self.tasa_429 = tasa_429
+        self.tasa_500 = tasa_500
+        self.retry_after = retry_after
+        self.tokens_prompt_base = tokens_prompt_base
+        self.tokens_respuesta = tokens_respuesta
+        self._rng = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.estadisticas = {"solicitudes": 0, "streaming": 0, "errores_429": 0, "errores_500": 0, "tokens": 0}
+
+    def _aleatorio(self):
+        with self._lock:
+            return self._rng.random()
+
+    def contar(self, clave: str, cantidad: int = 1):
+        with self._lock:
+            self.estadisticas[clave] += cantidad
+
+    def latencia_primer_token(self) -> float:
+        """Segundos hasta el primer token según la distribución configurada"""
+        with self._lock:
+            media, desviacion = self.latencia_media, self.latencia_desviacion
+            if self.distribucion == "fija":
+                valor = media
+            elif self.distribucion == "uniforme":
+                valor = self._rng.uniform(max(0.0, media - desviacion), media + desviacion)
+            elif self.distribucion == "normal":
+                valor = self._rng.gauss(media, desviacion)
+            else:
+                # Lognormal con la media pedida: cola larga como la de la API real
+                mu = math.log(max(media, 1e-6)) - desviacion ** 2 / 2
+                valor = self._rng.lognormvariate(mu, desviacion)
+        return max(0.0, valor)
+
+    def error_inyectado(self) -> Optional[int]:
+        """Código de error a devolver en esta solicitud (o None)"""
+        tirada = self._aleatorio()
+        if tirada < self.tasa_429:
+            return 429
+        if tirada < self.tasa_429 + self.tasa_500:
+            return 500
+        return None
+
+    def _senal(self, activo: str) -> Dict:
+        """Señal coherente con el rango de precios típico del activo"""
+        rango = REDI7AI.RANGOS_PRECIO_VALIDOS.get(activo, {"min": 100.0, "max": 200.0})
+        with self._lock:
+            precio = self._rng.uniform(rango["min"], rango["max"])
+            direccion = self._rng.choice(["BUY", "SELL"])
+            riesgo = precio * self._rng.uniform(0.001, 0.004)
+            probabilidad = self._rng.randint(60, 90)
+            contexto = self._rng.choice(CONTEXTOS)
+        signo = 1 if direccion == "BUY" else -1
+        decimales = 5 if precio < 10 else 2
+        return {
+            "direccion": direccion,
+            "entrada": round(precio, decimales),
+            "stop_loss": round(precio - signo * riesgo, decimales),
+            "tp1": round(precio + signo * riesgo * 1.5, decimales),
+            "tp2": round(precio + signo * riesgo * 2.5, decimales),
+            "tp3": round(precio + signo * riesgo * 4.0, decimales),
+            "probabilidad": probabilidad,
+            "contexto": contexto
+        }
+
+    def respuesta(self, solicitud: Dict) -> Dict:
+        """
+        Construye el contenido y los tokens de una solicitud de chat-completions
+
+        Returns:
+            Dict con contenido, prompt_tokens y completion_tokens
+        """
+        texto_usuario = ""
+        imagenes = []
+        for mensaje in solicitud.get("messages", []):
+            contenido = mensaje.get("content")
+            if isinstance(contenido, str):
+                texto_usuario += contenido
+            elif isinstance(contenido, list):
+                for parte in contenido:
+                    if parte.get("type") == "text":
+                        texto_usuario += parte.get("text", "")
+                    elif parte.get("type") == "image_url":
+                        imagenes.append(parte.get("image_url", {}).get("detail", "high"))
+
+        match = re.search(r"\b(" + "|".join(REDI7AI.ACTIVOS_PERMITIDOS) + r")\b", texto_usuario)
+        activo = match.group(1) if match else "XAUUSD"
+        senal = self._senal(activo)
+
+        formato = solicitud.get("response_format") or {}
+        if formato.get("type") == "json_schema":
+            contenido = json.dumps(senal, ensure_ascii=False)
+        else:
+            contenido = (
+                f"🚨REDI7 IA🚨\n"
+                f"🚨Señal: {senal['direccion']} en {activo}🚨\n"
+                f"💰Entrada: {senal['entrada']}\n"
+                f"🚫SL: {senal['stop_loss']}\n"
+                f"🎯TP1: {senal['tp1']}\n"
+                f"🎯TP2: {senal['tp2']}\n"
+                f"🎯TP3: {senal['tp3']}\n"
+                f"✅Probabilidad: {senal['probabilidad']}%\n"
+                f"📊Contexto: {senal['contexto']}"
+            )
+
+        prompt_tokens = self.tokens_prompt_base + len(texto_usuario) // 4 + sum(
+            TOKENS_IMAGEN.get(detail, TOKENS_IMAGEN["high"]) for detail in imagenes
+        )
+        completion_tokens = self.tokens_respuesta or max(1, len(contenido) // 3)
+        return {"contenido": contenido, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+
+
+class ManejadorOpenAI(BaseHTTPRequestHandler):
+    """Endpoints: POST /v1/chat/completions, GET /v1/models, GET /estadisticas"""
+
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def simulador(self) -> SimuladorOpenAI:
+        return self.server.simulador
+
+    def log_message(self, formato, *args):
+        # Silencioso: en pruebas de carga el log por solicitud distorsiona las medidas
+        pass
+
+    def _json(self, estado: int, cuerpo: Dict, cabeceras: Optional[Dict] = None):
+        datos = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        for clave, valor in (cabeceras or {}).items():
+            self.send_header(clave, valor)
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._json(200, {"object": "list", "data": [{"id": "gpt-4o", "object": "model", "owned_by": "redi7-local"}]})
+        elif self.path.rstrip("/") == "/estadisticas":
+            self._json(200, dict(self.simulador.estadisticas))
+        else:
+            self._json(404, {"error": {"message": "Ruta no encontrada", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._json(404, {"error": {"message": "Ruta no encontrada", "type": "invalid_request_error"}})
+            return
+
+        longitud = int(self.headers.get("Content-Length", 0))
+        try:
+            solicitud = json.loads(self.rfile.read(longitud) or b"{}")
+        except ValueError:
+            self._json(400, {"error": {"message": "JSON inválido", "type": "invalid_request_error"}})
+            return
+
+        sim = self.simulador
+        sim.contar("solicitudes")
+
+        error = sim.error_inyectado()
+        if error == 429:
+            sim.contar("errores_429")
+            self._json(
+                429,
+                {"error": {"message": "Rate limit reached (simulado)", "type": "requests", "code": "rate_limit_exceeded"}},
+                {"Retry-After": f"{sim.retry_after:g}", "x-ratelimit-remaining-requests": "0"}
+            )
+            return
+        if error == 500:
+            sim.contar("errores_500")
+            self._json(500, {"error": {"message": "Error interno (simulado)", "type": "server_error"}})
+            return
+
+        datos = sim.respuesta(solicitud)
+        sim.contar("tokens", datos["prompt_tokens"] + datos["completion_tokens"])
+        uso = {
+            "prompt_tokens": datos["prompt_tokens"],
+            "completion_tokens": datos["completion_tokens"],
+            "total_tokens": datos["prompt_tokens"] + datos["completion_tokens"]
+        }
+        base = {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "created": int(time.time()),
+            "model": solicitud.get("model", "gpt-4o")
+        }
+
+        time.sleep(sim.latencia_primer_token())
+
+        if solicitud.get("stream"):
+            sim.contar("streaming")
+            self._enviar_stream(base, datos, uso, bool((solicitud.get("stream_options") or {}).get("include_usage")))
+            return
+
+        time.sleep(datos["completion_tokens"] * sim.ms_por_token / 1000)
+        self._json(200, {
+            **base,
+            "object": "chat.completion",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": datos["contenido"]},
+                "finish_reason": "stop",
+                "logprobs": None
+            }],
+            "usage": uso
+        })
+
+    def _enviar_stream(self, base: Dict, datos: Dict, uso: Dict, incluir_uso: bool):
+        """Server-sent events como la API real: fragmentos, uso opcional y [DONE]"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def evento(choices, extra=None):
+            cuerpo = {**base, "object": "chat.completion.chunk", "choices": choices, **(extra or {})}
+            self.wfile.write(f"data: {json.dumps(cuerpo, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        contenido = datos["contenido"]
+        # Repartir el texto en tantos fragmentos como tokens de respuesta (mínimo 1 carácter)
+        tamano = max(1, len(contenido) // max(1, datos["completion_tokens"]))
+        pausa = self.simulador.ms_por_token / 1000 * max(1, datos["completion_tokens"]) / max(1, len(contenido) // tamano)
+
+        try:
+            evento([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            for i in range(0, len(contenido), tamano):
+                evento([{"index": 0, "delta": {"content": contenido[i:i + tamano]}, "finish_reason": None}])
+                time.sleep(pausa)
+            evento([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if incluir_uso:
+                evento([], {"usage": uso})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente canceló el stream
+            pass
+
+
+def crear_servidor(host: str = "127.0.0.1", puerto: int = 8787, **opciones) -> ThreadingHTTPServer:
+    """
+    Crea (sin arrancar) el servidor simulado; `opciones` van a SimuladorOpenAI
+
+    Usar servidor.serve_forever() en un hilo y servidor.shutdown() al terminar.
+    """
+    servidor = ThreadingHTTPServer((host, puerto), ManejadorOpenAI)
+    servidor.daemon_threads = True
+    servidor.simulador = SimuladorOpenAI(**opciones)
+    return servidor
+
+
+def main():
+    """Punto de entrada de la línea de comandos"""
+    parser = argparse.ArgumentParser(description="REDI7 IA - Servidor local compatible con OpenAI chat-completions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8787)
+    parser.add_argument("--latencia", choices=DISTRIBUCIONES, default="lognormal", help="Distribución del tiempo al primer token")
+    parser.add_argument("--latencia-media", type=float, default=2.0, help="Media en segundos")
+    parser.add_argument("--latencia-desviacion", type=float, default=0.5, help="Desviación (sigma en lognormal)")
+    parser.add_argument("--ms-por-token", type=float, default=8.0, help="Milisegundos por token generado")
+    parser.add_argument("--tasa-429", type=float, default=0.0, help="Fracción de solicitudes con 429")
+    parser.add_argument("--tasa-500", type=float, default=0.0, help="Fracción de solicitudes con 500")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Segundos en la cabecera Retry-After")
+    parser.add_argument("--tokens-prompt", type=int, default=350, help="Tokens de prompt sin imágenes")
+    parser.add_argument("--tokens-respuesta", type=int, default=None, help="Fijar tokens de respuesta")
+    parser.add_argument("--semilla", type=int, default=None, help="Semilla aleatoria")
+    args = parser.parse_args()
+
+    servidor = crear_servidor(
+        args.host,
+        args.puerto,
+        distribucion=args.latencia,
+        latencia_media=args.latencia_media,
+        latencia_desviacion=args.latencia_desviacion,
+        ms_por_token=args.ms_por_token,
+        tasa_429=args.tasa_429,
+        tasa_500=args.tasa_500,
+        retry_after=args.retry_after,
+        tokens_prompt_base=args.tokens_prompt,
+        tokens_respuesta=args.tokens_respuesta,
+        semilla=args.semilla
+    )
+
+    print("=" * 60)
+    print("🧪 REDI7 IA - OpenAI simulado")
+    print("=" * 60)
+    print(f"🌐 http://{args.host}:{args.puerto}/v1  (OPENAI_BASE_URL)")
+    print(f"⏱️ Latencia {args.latencia} media {args.latencia_media}s | {args.ms_por_token} ms/token")
+    print(f"💥 429: {args.tasa_429:.0%} | 500: {args.tasa_500:.0%}")
+
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n⏹️ Detenido. Estadísticas: {servidor.simulador.estadisticas}")
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Servidor local que imita la Bot API de Telegram para REDI7 IA
+Responde getMe, sendMessage, sendPhoto y sendMediaGroup (con file_id reutilizables) con latencia
+configurable, errores 429 (retry_after) y tokens inválidos
+
+Uso:
+    python servidor_telegram_local.py --puerto 8788 --latencia-media 0.15 --tasa-429 0.02
+    TELEGRAM_API_BASE=http://127.0.0.1:8788 streamlit run app_redi7.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+# Los tokens que empiezan así responden 401, como un bot revocado
+PREFIJO_TOKEN_INVALIDO = "invalido"
+
+RUTA_METODO = re.compile(r"^/bot(?P<token>[^/]+)/(?P<metodo>\w+)$")
+
+# Límites de la Bot API para fotos
+LIMITE_LEYENDA = 1024
+MAX_MEDIOS_GRUPO = 10
+
+
+class SimuladorTelegram:
+    """Latencias, errores inyectados y estadísticas del Telegram simulado"""
+
+    def __init__(
+        self,
+        latencia_media: float = 0.15,
+        latencia_desviacion: float = 0.05,
+        tasa_429: float = 0.0,
+        retry_after: int = 1,
+        semilla: Optional[int] = None
+    ):
+        """
+        Args:
+            latencia_media: Segundos medios por llamada
+            latencia_desviacion: Desviación (distribución normal, truncada en 0)
+            tasa_429: Probabilidad de responder 429 Too Many Requests
+            retry_after: Segundos que se indican en parameters.retry_after
+            semilla: Semilla aleatoria para resultados reproducibles
+        """
+        self.latencia_media = latencia_media
+        self.latencia_desviacion = latencia_desviacion
+        self.tasa_429 = tasa_429
+        self.retry_after = retry_after
+        self._rng = random.Random(semilla)
+        self._lock = threading.Lock()
+        self._siguiente_id = 1
+        self._file_ids = set()
+        self.estadisticas = {
+            "solicitudes": 0,
+            "mensajes": 0,
+            "errores_429": 0,
+            "errores_401": 0,
+            "fotos_subidas": 0,
+            "fotos_reutilizadas": 0,
+            "bytes_subidos": 0
+        }
+
+    def contar(self, clave: str, cantidad: int = 1):
+        with self._lock:
+            self.estadisticas[clave] = self.estadisticas.get(clave, 0) + cantidad
+
+    def latencia(self) -> float:
+        with self._lock:
+            return max(0.0, self._rng.gauss(self.latencia_media, self.latencia_desviacion))
+
+    def limitar(self) -> bool:
+        """True si esta llamada debe responder 429"""
+        with self._lock:
+            return self._rng.random() < self.tasa_429
+
+    def nuevo_message_id(self) -> int:
+        with self._lock:
+            message_id = self._siguiente_id
+            self._siguiente_id += 1
+            return message_id
+
+    def registrar_foto(self, datos: bytes) -> str:
+        """Guarda una foto subida y devuelve su file_id"""
+        file_id = "simfoto_" + hashlib.sha1(datos).hexdigest()[:20]
+        with self._lock:
+            self._file_ids.add(file_id)
+        self.contar("fotos_subidas")
+        self.contar("bytes_subidos", len(datos))
+        return file_id
+
+    def existe_foto(self, file_id: str) -> bool:
+        with self._lock:
+            return file_id in self._file_ids
+
+
+class ManejadorTelegram(BaseHTTPRequestHandler):
+    """Rutas /bot<token>/<método> con respuestas en el formato de la Bot API"""
+
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def simulador(self) -> SimuladorTelegram:
+        return self.server.simulador
+
+    def log_message(self, formato, *args):
+        pass
+
+    def _json(self, estado: int, cuerpo: Dict):
+        datos = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _parametros(self) -> Tuple[Dict, Dict[str, bytes]]:
+        """Parámetros de query string, JSON, formulario o multipart (con archivos), como acepta Telegram"""
+        url = urlparse(self.path)
+        parametros = {k: v[0] for k, v in parse_qs(url.query).items()}
+        archivos: Dict[str, bytes] = {}
+        longitud = int(self.headers.get("Content-Length", 0))
+        if longitud:
+            cuerpo = self.rfile.read(longitud)
+            tipo = self.headers.get("Content-Type", "")
+            if "application/json" in tipo:
+                parametros.update(json.loads(cuerpo or b"{}"))
+            elif "application/x-www-form-urlencoded" in tipo:
+                parametros.update({k: v[0] for k, v in parse_qs(cuerpo.decode("utf-8")).items()})
+            elif "multipart/form-data" in tipo:
+                mensaje = BytesParser(policy=HTTP).parsebytes(
+                    f"Content-Type: {tipo}\r\n\r\n".encode("latin-1") + cuerpo
+                )
+                for parte in mensaje.iter_parts():
+                    nombre = parte.get_param("name", header="content-disposition")
+                    datos = parte.get_payload(decode=True) or b""
+                    if parte.get_filename():
+                        archivos[nombre] = datos
+                    else:
+                        parametros[nombre] = datos.decode("utf-8")
+        return parametros, archivos
+
+    def _foto(self, referencia, archivos: Dict[str, bytes]) -> Optional[str]:
+        """file_id de una foto: subida en el formulario (attach://campo) o un file_id ya existente"""
+        sim = self.simulador
+        referencia = str(referencia or "")
+        campo = referencia[len("attach://"):] if referencia.startswith("attach://") else referencia
+        if campo in archivos:
+            return sim.registrar_foto(archivos[campo])
+        if sim.existe_foto(referencia):
+            sim.contar("fotos_reutilizadas")
+            return referencia
+        return None
+
+    def _mensaje_foto(self, chat_id, file_id: str, leyenda: str = "") -> Dict:
+        sim = self.simulador
+        mensaje = {
+            "message_id": sim.nuevo_message_id(),
+            "date": int(time.time()),
+            "chat": {"id": chat_id},
+            "photo": [
+                {"file_id": file_id + "_m", "width": 320, "height": 180},
+                {"file_id": file_id, "width": 1280, "height": 720}
+            ]
+        }
+        if leyenda:
+            mensaje["caption"] = leyenda
+        return mensaje
+
+    def do_GET(self):
+        self._atender()
+
+    def do_POST(self):
+        self._atender()
+
+    def _atender(self):
+        ruta = urlparse(self.path).path
+        if ruta.rstrip("/") == "/estadisticas":
+            self._json(200, dict(self.simulador.estadisticas))
+            return
+
+        match = RUTA_METODO.match(ruta)
+        if not match:
+            self._json(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+
+        sim = self.simulador
+        sim.contar("solicitudes")
+        token, metodo = match.group("token"), match.group("metodo")
+        try:
+            parametros, archivos = self._parametros()
+        except ValueError:
+            self._json(400, {"ok": False, "error_code": 400, "description": "Bad Request: invalid JSON"})
+            return
+
+        time.sleep(sim.latencia())
+
+        if token.startswith(PREFIJO_TOKEN_INVALIDO):
+            sim.contar("errores_401")
+            self._json(401, {"ok": False, "error_code": 401, "description": "Unauthorized"})
+            return
+
+        if sim.limitar():
+            sim.contar("errores_429")
+            self._json(429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {sim.retry_after}",
+                "parameters": {"retry_after": sim.retry_after}
+            })
+            return
+
+        if metodo == "getMe":
+            self._json(200, {"ok": True, "result": {
+                "id": abs(hash(token)) % 10 ** 10,
+                "is_bot": True,
+                "first_name": "REDI7 Local",
+                "username": f"redi7_local_{token[-4:]}_bot"
+            }})
+        elif metodo == "sendMessage":
+            if not parametros.get("chat_id") or not parametros.get("text"):
+                self._json(400, {"ok": False, "error_code": 400, "description": "Bad Request: chat_id and text are required"})
+                return
+            sim.contar("mensajes")
+            self._json(200, {"ok": True, "result": {
+                "message_id": sim.nuevo_message_id(),
+                "date": int(time.time()),
+                "chat": {"id": parametros["chat_id"]},
+                "text": parametros["text"]
+            }})
+        elif metodo == "sendPhoto":
+            file_id = self._foto(parametros.get("photo") or ("attach://photo" if "photo" in archivos else ""), archivos)
+            if not parametros.get("chat_id") or file_id is None:
+                self._json(400, {"ok": False, "error_code": 400, "description": "Bad Request: wrong file identifier"})
+                return
+            if len(parametros.get("caption", "")) > LIMITE_LEYENDA:
+                self._json(400, {"ok": False, "error_code": 400, "description": "Bad Request: message caption is too long"})
+                return
+            sim.contar("mensajes")
+            self._json(200, {"ok": True, "result": self._mensaje_foto(parametros["chat_id"], file_id, parametros.get("caption", ""))})
+        elif metodo == "sendMediaGroup":
+            try:
+                medios = parametros["media"] if isinstance(parametros.get("media"), list) else json.loads(parametros.get("media", "[]"))
+            except ValueError:
+                medios = []
+            if not parametros.get("chat_id") or not 2 <= len(medios) <= MAX_MEDIOS_GRUPO:
+                self._json(400, {"ok": False, "error_code": 400, "description": "Bad Request: media must include 2-10 items"})
+                return
+            if any(len(m.get("caption", "")) > LIMITE_LEYENDA for m in medios):
+                self._json(400, {"ok": False, "error_code": 400, "description": "Bad Request: message caption is too long"})
+                return
+            file_ids = [self._foto(m.get("media"), archivos) for m in medios]
+            if None in file_ids:
+                self._json(400, {"ok": False, "error_code": 400, "description": "Bad Request: wrong file identifier"})
+                return
+            sim.contar("mensajes", len(medios))
+            self._json(200, {"ok": True, "result": [
+                self._mensaje_foto(parametros["chat_id"], file_id, m.get("caption", ""))
+                for file_id, m in zip(file_ids, medios)
+            ]})
+        else:
+            self._json(404, {"ok": False, "error_code": 404, "description": "Not Found: method not found"})
+
+
+def crear_servidor(host: str = "127.0.0.1", puerto: int = 8788, **opciones) -> ThreadingHTTPServer:
+    """
+    Crea (sin arrancar) el servidor simulado; `opciones` van a SimuladorTelegram
+
+    Usar servidor.serve_forever() en un hilo y servidor.shutdown() al terminar.
+    """
+    servidor = ThreadingHTTPServer((host, puerto), ManejadorTelegram)
+    servidor.daemon_threads = True
+    servidor.simulador = SimuladorTelegram(**opciones)
+    return servidor
+
+
+def main():
+    """Punto de entrada de la línea de comandos"""
+    parser = argparse.ArgumentParser(description="REDI7 IA - Servidor local compatible con la Bot API de Telegram")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8788)
+    parser.add_argument("--latencia-media", type=float, default=0.15, help="Segundos medios por llamada")
+    parser.add_argument("--latencia-desviacion", type=float, default=0.05)
+    parser.add_argument("--tasa-429", type=float, default=0.0, help="Fracción de llamadas con 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Segundos en parameters.retry_after")
+    parser.add_argument("--semilla", type=int, default=None)
+    args = parser.parse_args()
+
+    servidor = crear_servidor(
+        args.host,
+        args.puerto,
+        latencia_media=args.latencia_media,
+        latencia_desviacion=args.latencia_desviacion,
+        tasa_429=args.tasa_429,
+        retry_after=args.retry_after,
+        semilla=args.semilla
+    )
+
+    print("=" * 60)
+    print("🧪 REDI7 IA - Telegram simulado")
+    print("=" * 60)
+    print(f"🌐 http://{args.host}:{args.puerto}  (TELEGRAM_API_BASE)")
+    print(f"⏱️ Latencia media {args.latencia_media}s | 💥 429: {args.tasa_429:.0%}")
+
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n⏹️ Detenido. Estadísticas: {servidor.simulador.estadisticas}")
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
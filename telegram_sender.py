@@ -3,44 +3,138 @@ Sistema de envío de señales a Telegram para REDI7 AI
 """
 
 import requests
+import base64
+import hashlib
+import json
 import os
-from typing import Dict, Optional
+import threading
+import time
+from typing import Dict, List, Optional, Union
+
+from requests.adapters import HTTPAdapter
+
+from cache_ttl import CacheTTL
+from config import (
+    TELEGRAM_API_BASE,
+    TELEGRAM_CACHE_BOT_TTL,
+    TELEGRAM_CACHE_BOT_TTL_INVALIDO,
+    TELEGRAM_CACHE_FILE_ID_TTL,
+    TELEGRAM_MAX_CONEXIONES
+)
+from mensajes_telegram import dividir_mensaje, separar_leyenda
+from metricas import medir
+
+# Resultado de getMe por token, compartido por todas las sesiones del proceso
+_cache_bots = CacheTTL(max_entradas=1000, ttl=TELEGRAM_CACHE_BOT_TTL)
+
+# Respuestas de la Bot API que indican token revocado o bot sin acceso
+CODIGOS_BOT_INVALIDO = (401, 403)
+
+# Segundos de retry_after que se esperan sin abandonar un mensaje partido a medias
+ESPERA_MAXIMA_ENTRE_PARTES = 5
+
+# Timeout de una petición de texto y de una subida de capturas
+TIMEOUT_MENSAJE = 10
+TIMEOUT_IMAGENES = 60
+
+# Límite de fotos de sendMediaGroup
+MAX_IMAGENES_GRUPO = 10
+
+# file_id de cada captura ya subida, por (token, hash de la imagen): un file_id solo vale para su bot
+_cache_file_ids = CacheTTL(max_entradas=5000, ttl=TELEGRAM_CACHE_FILE_ID_TTL)
+
+
+def invalidar_bot(bot_token: str):
+    """Olvida la validación de un token (p. ej. tras un 401/403 al enviar)"""
+    _cache_bots.invalidar(bot_token)
+
+
+def estadisticas_cache_bots() -> Dict:
+    return _cache_bots.estadisticas()
+
+
+def estadisticas_cache_imagenes() -> Dict:
+    return _cache_file_ids.estadisticas()
+
+
+_sesion_telegram: Optional[requests.Session] = None
+_sesion_lock = threading.Lock()
+
+
+def obtener_sesion_telegram() -> requests.Session:
+    """
+    Sesión HTTP del proceso para la Bot API (compartida por todas las sesiones y senders)
+
+    Mantiene las conexiones keep-alive con api.telegram.org, así cada envío se ahorra
+    el handshake TCP+TLS. requests.Session es segura para peticiones simples entre hilos.
+    """
+    global _sesion_telegram
+    if _sesion_telegram is None:
+        with _sesion_lock:
+            if _sesion_telegram is None:
+                sesion = requests.Session()
+                adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=TELEGRAM_MAX_CONEXIONES, max_retries=0)
+                sesion.mount("https://", adaptador)
+                sesion.mount("http://", adaptador)
+                _sesion_telegram = sesion
+    return _sesion_telegram
+
+
+def normalizar_chat_id(chat_id) -> Union[int, str]:
+    """
+    Convierte el chat_id a número si es posible (soporta negativos para grupos)
+
+    Si es un supergrupo escrito sin el prefijo -100, lo añade.
+    """
+    chat_id_str = str(chat_id or "").strip()
+    try:
+        chat_id_int = int(chat_id_str) if chat_id_str else ""
+        
+        # Si el chat_id empieza con 100 (supergrupo sin -100), agregar -100
+        # Grupos/Supergrupos de Telegram tienen IDs negativos con formato -100xxxxxxxxxx
+        if chat_id_int > 0 and str(chat_id_int).startswith('100') and len(str(chat_id_int)) >= 10:
+            # Es probablemente un supergrupo sin el prefijo -100
+            chat_id_int = int(f"-100{chat_id_int}")
+            print(f"ℹ️ Chat ID convertido a formato de supergrupo: {chat_id_int}")
+        
+        return chat_id_int
+    except (ValueError, TypeError):
+        return chat_id_str
+
 
 class TelegramSender:
     """Clase para enviar mensajes a Telegram"""
     
-    def __init__(self, bot_token: Optional[str] = None, chat_id: Optional[str] = None):
+    def __init__(
+        self,
+        bot_token: Optional[str] = None,
+        chat_id: Optional[str] = None,
+        sesion: Optional[requests.Session] = None
+    ):
         """
         Inicializa el sender de Telegram
         
         Args:
             bot_token: Token del bot de Telegram (opcional, se puede usar variable de entorno)
             chat_id: ID del chat o grupo (opcional, se puede usar variable de entorno)
+            sesion: Sesión HTTP a usar (por defecto la compartida del proceso)
         """
         self.bot_token = bot_token or os.getenv("TELEGRAM_BOT_TOKEN", "")
-        chat_id_str = str(chat_id or os.getenv("TELEGRAM_CHAT_ID", "")).strip()
+        self.chat_id = normalizar_chat_id(chat_id or os.getenv("TELEGRAM_CHAT_ID", ""))
+        self.sesion = sesion or obtener_sesion_telegram()
         
-        # Convertir chat_id a número si es posible (soporta negativos para grupos)
-        try:
-            chat_id_int = int(chat_id_str) if chat_id_str else ""
-            
-            # Si el chat_id empieza con 100 (supergrupo sin -100), agregar -100
-            # Grupos/Supergrupos de Telegram tienen IDs negativos con formato -100xxxxxxxxxx
-            if chat_id_int > 0 and str(chat_id_int).startswith('100') and len(str(chat_id_int)) >= 10:
-                # Es probablemente un supergrupo sin el prefijo -100
-                chat_id_int = int(f"-100{chat_id_int}")
-                print(f"ℹ️ Chat ID convertido a formato de supergrupo: {chat_id_int}")
-            
-            self.chat_id = chat_id_int
-        except (ValueError, TypeError):
-            self.chat_id = chat_id_str
-        
-        self.api_url = f"https://api.telegram.org/bot{self.bot_token}"
+        self.api_url = f"{TELEGRAM_API_BASE.rstrip('/')}/bot{self.bot_token}"
     
-    def validar_configuracion(self) -> Dict[str, any]:
+    def validar_configuracion(self, usar_cache: bool = True) -> Dict[str, any]:
         """
         Valida que la configuración de Telegram esté completa
         
+        La identidad del bot se guarda por token durante TELEGRAM_CACHE_BOT_TTL, así los
+        envíos seguidos no repiten el getMe; un 401/403 al enviar la invalida.
+        
+        Args:
+            usar_cache: False fuerza la consulta a Telegram (p. ej. al guardar la configuración)
+        
         Returns:
             Dict con status de validación
         """
@@ -56,21 +150,45 @@ class TelegramSender:
                 "mensaje": "❌ Chat ID no configurado. Configura TELEGRAM_CHAT_ID en variables de entorno."
             }
         
-        # Verificar que el bot sea válido
+        validacion = _cache_bots.obtener(self.bot_token) if usar_cache else None
+        if validacion is None:
+            validacion = self._consultar_bot()
+            if "ttl" in validacion:
+                _cache_bots.guardar(self.bot_token, validacion, ttl=validacion.pop("ttl"))
+        return dict(validacion)
+    
+    @medir("telegram.getMe")
+    def _consultar_bot(self) -> Dict[str, any]:
+        """
+        Pregunta a Telegram por el bot (getMe)
+        
+        Returns:
+            Dict de validación; incluye 'ttl' si la respuesta es cacheable
+            (errores de red o de servidor no lo son)
+        """
         try:
-            response = requests.get(f"{self.api_url}/getMe", timeout=5)
+            response = self.sesion.get(f"{self.api_url}/getMe", timeout=5)
             if response.status_code == 200:
                 bot_info = response.json()
                 if bot_info.get("ok"):
                     return {
                         "valido": True,
-                        "mensaje": f"✅ Bot conectado: @{bot_info['result']['username']}"
+                        "mensaje": f"✅ Bot conectado: @{bot_info['result']['username']}",
+                        "bot": bot_info['result'],
+                        "ttl": TELEGRAM_CACHE_BOT_TTL
                     }
                 else:
                     return {
                         "valido": False,
-                        "mensaje": "❌ Token del bot inválido"
+                        "mensaje": "❌ Token del bot inválido",
+                        "ttl": TELEGRAM_CACHE_BOT_TTL_INVALIDO
                     }
+            elif response.status_code in CODIGOS_BOT_INVALIDO:
+                return {
+                    "valido": False,
+                    "mensaje": "❌ Token del bot inválido",
+                    "ttl": TELEGRAM_CACHE_BOT_TTL_INVALIDO
+                }
             else:
                 return {
                     "valido": False,
@@ -121,52 +239,153 @@ class TelegramSender:
         Returns:
             Dict con resultado del envío
         """
-        try:
-            payload = {
-                "chat_id": self.chat_id,
-                "text": mensaje,
-                "disable_notification": disable_notification
-            }
-
-            if parse_mode:
-                payload["parse_mode"] = parse_mode
-            
-            # Debug: mostrar info de envío (sin token completo)
-            print(f"🔍 Intentando enviar a Telegram:")
-            print(f"   Chat ID: {self.chat_id} (tipo: {type(self.chat_id).__name__})")
-            print(f"   Bot Token: {'***' + str(self.bot_token)[-6:] if self.bot_token else 'No configurado'}")
+        # Debug: mostrar info de envío (sin token completo)
+        print(f"🔍 Intentando enviar a Telegram:")
+        print(f"   Chat ID: {self.chat_id} (tipo: {type(self.chat_id).__name__})")
+        print(f"   Bot Token: {'***' + str(self.bot_token)[-6:] if self.bot_token else 'No configurado'}")
+        
+        resultado = self.enviar_a(self.chat_id, mensaje, parse_mode, disable_notification)
+        print(f"   Respuesta HTTP: {resultado.get('codigo', '-')}")
+        if not resultado["exito"]:
+            print(f"   {resultado['mensaje']}")
+        return resultado
+    
+    def enviar_a(
+        self,
+        chat_id: Union[int, str],
+        mensaje: str,
+        parse_mode: Optional[str] = "Markdown",
+        disable_notification: bool = False,
+        desde_parte: int = 0
+    ) -> Dict[str, any]:
+        """
+        Envía un mensaje a un chat concreto por la sesión compartida (sin trazas de depuración)
+        
+        Si supera el límite de Telegram se divide por secciones (mensajes_telegram.py) y las
+        partes salen en orden, seguidas y por la misma conexión; solo la primera notifica.
+        
+        Args:
+            chat_id: Chat destino (ya normalizado)
+            mensaje: Texto del mensaje
+            parse_mode: Modo de parseo (Markdown o HTML)
+            disable_notification: Si se desactiva la notificación
+            desde_parte: Partes ya entregadas en un intento anterior (no se repiten)
             
-            response = requests.post(
-                f"{self.api_url}/sendMessage",
-                json=payload,
-                timeout=10
+        Returns:
+            Dict con exito, mensaje, message_id (primera parte enviada), codigo HTTP,
+            retry_after (segundos) si hubo 429, partes y partes_enviadas (contando desde_parte)
+        """
+        partes = dividir_mensaje(mensaje, parse_mode)
+        enviadas = desde_parte
+        message_ids = []
+        esperado_429 = False
+        resultado = {"exito": True, "mensaje": "✅ Señal enviada a Telegram correctamente"}
+        
+        while enviadas < len(partes):
+            resultado = self._enviar_parte(
+                chat_id,
+                partes[enviadas],
+                parse_mode,
+                disable_notification or enviadas > 0
             )
+            if resultado["exito"]:
+                message_ids.append(resultado["message_id"])
+                enviadas += 1
+                esperado_429 = False
+                continue
             
-            print(f"   Respuesta HTTP: {response.status_code}")
+            # A mitad de un mensaje partido, un 429 corto se espera aquí para no dejarlo a medias
+            retry_after = resultado.get("retry_after", 0)
+            if message_ids and not esperado_429 and 0 < retry_after <= ESPERA_MAXIMA_ENTRE_PARTES:
+                esperado_429 = True
+                time.sleep(retry_after)
+                continue
+            break
+        
+        resultado.update({
+            "partes": len(partes),
+            "partes_enviadas": enviadas,
+            "message_ids": message_ids
+        })
+        if message_ids:
+            resultado["message_id"] = message_ids[0]
+        return resultado
+    
+    @medir("telegram.sendMessage")
+    def _enviar_parte(
+        self,
+        chat_id: Union[int, str],
+        mensaje: str,
+        parse_mode: Optional[str],
+        disable_notification: bool
+    ) -> Dict[str, any]:
+        """Una llamada a sendMessage (el texto ya cabe en el límite)"""
+        payload = {
+            "chat_id": chat_id,
+            "text": mensaje,
+            "disable_notification": disable_notification
+        }
+
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        
+        resultado = self._llamar("sendMessage", json=payload)
+        if resultado["exito"]:
+            resultado["message_id"] = resultado.pop("respuesta")["message_id"]
+        return resultado
+    
+    def _llamar(self, metodo: str, timeout: float = TIMEOUT_MENSAJE, **peticion) -> Dict[str, any]:
+        """
+        POST a un método de la Bot API por la sesión compartida
+        
+        Args:
+            metodo: Método de la Bot API (sendMessage, sendPhoto...)
+            timeout: Segundos máximos de la petición
+            peticion: json=, data= o files= para requests
+        
+        Returns:
+            Dict con exito, mensaje, codigo HTTP, retry_after (segundos) si hubo 429
+            y respuesta (el 'result' de Telegram) si fue bien
+        """
+        try:
+            response = self.sesion.post(
+                f"{self.api_url}/{metodo}",
+                timeout=timeout,
+                **peticion
+            )
             
             if response.status_code == 200:
                 result = response.json()
-                print(f"   Resultado OK: {result.get('ok')}")
                 if result.get("ok"):
                     return {
                         "exito": True,
                         "mensaje": "✅ Señal enviada a Telegram correctamente",
-                        "message_id": result["result"]["message_id"]
+                        "respuesta": result["result"],
+                        "codigo": 200
                     }
                 else:
                     error_desc = result.get('description', 'Error desconocido')
-                    print(f"   Error Telegram: {error_desc}")
                     return {
                         "exito": False,
-                        "mensaje": f"❌ Error de Telegram: {error_desc}"
+                        "mensaje": f"❌ Error de Telegram: {error_desc}",
+                        "codigo": 200
                     }
             else:
+                if response.status_code in CODIGOS_BOT_INVALIDO:
+                    # Token revocado o bot expulsado: la próxima validación vuelve a preguntar
+                    invalidar_bot(self.bot_token)
                 error_text = response.text
-                print(f"   Error HTTP: {error_text}")
-                return {
+                resultado = {
                     "exito": False,
-                    "mensaje": f"❌ Error HTTP {response.status_code}: {error_text[:100]}"
+                    "mensaje": f"❌ Error HTTP {response.status_code}: {error_text[:100]}",
+                    "codigo": response.status_code
                 }
+                if response.status_code == 429:
+                    try:
+                        resultado["retry_after"] = response.json().get("parameters", {}).get("retry_after", 1)
+                    except ValueError:
+                        resultado["retry_after"] = 1
+                return resultado
                 
         except requests.exceptions.Timeout:
             return {
@@ -179,6 +398,138 @@ class TelegramSender:
                 "mensaje": f"❌ Error al enviar: {str(e)}"
             }
     
+    def enviar_con_imagenes(
+        self,
+        chat_id: Union[int, str],
+        mensaje: str,
+        imagenes_base64: List[str],
+        mime_types: Optional[List[str]] = None,
+        parse_mode: Optional[str] = None,
+        disable_notification: bool = False,
+        desde_parte: int = 0
+    ) -> Dict[str, any]:
+        """
+        Envía las capturas del análisis con la señal como leyenda (sendPhoto o sendMediaGroup)
+        
+        Cada imagen se sube una sola vez por bot: su file_id queda en caché y los envíos
+        siguientes (otros chats, reintentos) lo reutilizan sin volver a subir los bytes.
+        Lo que no cabe en la leyenda se envía después como texto con enviar_a().
+        
+        Args:
+            chat_id: Chat destino (ya normalizado)
+            mensaje: Texto de la señal
+            imagenes_base64: Capturas ya recomprimidas (preparar_imagenes), como máximo 10
+            mime_types: Tipo MIME de cada captura (por defecto image/jpeg)
+            parse_mode: Modo de parseo (Markdown o HTML)
+            disable_notification: Si se desactiva la notificación
+            desde_parte: Partes ya entregadas en un intento anterior (la 0 son las imágenes)
+        
+        Returns:
+            Mismo formato que enviar_a(); las imágenes cuentan como la primera parte
+        """
+        if not imagenes_base64:
+            return self.enviar_a(chat_id, mensaje, parse_mode, disable_notification, desde_parte)
+        
+        leyenda, resto = separar_leyenda(mensaje, parse_mode)
+        # Mismo reparto que hará enviar_a(): de él depende reanudar con partes_enviadas
+        partes = 1 + (len(dividir_mensaje(resto, parse_mode)) if resto else 0)
+        message_ids = []
+        
+        if desde_parte == 0:
+            resultado = self._enviar_imagenes(
+                chat_id,
+                imagenes_base64[:MAX_IMAGENES_GRUPO],
+                mime_types or [],
+                leyenda,
+                parse_mode,
+                disable_notification
+            )
+            if not resultado["exito"]:
+                resultado.update({"partes": partes, "partes_enviadas": 0, "message_ids": []})
+                return resultado
+            message_ids = resultado["message_ids"]
+        
+        if not resto:
+            return {
+                "exito": True,
+                "mensaje": "✅ Señal enviada a Telegram correctamente",
+                "message_id": message_ids[0] if message_ids else None,
+                "message_ids": message_ids,
+                "codigo": 200,
+                "partes": 1,
+                "partes_enviadas": 1
+            }
+        
+        resultado = self.enviar_a(chat_id, resto, parse_mode, True, max(0, desde_parte - 1))
+        resultado.update({
+            "partes": partes,
+            "partes_enviadas": resultado["partes_enviadas"] + 1,
+            "message_ids": message_ids + resultado["message_ids"]
+        })
+        if message_ids:
+            resultado["message_id"] = message_ids[0]
+        return resultado
+    
+    @medir("telegram.sendMediaGroup")
+    def _enviar_imagenes(
+        self,
+        chat_id: Union[int, str],
+        imagenes_base64: List[str],
+        mime_types: List[str],
+        leyenda: str,
+        parse_mode: Optional[str],
+        disable_notification: bool
+    ) -> Dict[str, any]:
+        """Una llamada a sendPhoto (una imagen) o sendMediaGroup (2-10), subiendo solo las que no tienen file_id"""
+        claves = [(self.bot_token, hashlib.sha256(imagen.encode("ascii")).hexdigest()) for imagen in imagenes_base64]
+        medios = []
+        archivos = {}
+        for indice, (imagen, clave) in enumerate(zip(imagenes_base64, claves)):
+            file_id = _cache_file_ids.obtener(clave)
+            if file_id is None:
+                mime = mime_types[indice] if indice < len(mime_types) else "image/jpeg"
+                campo = f"captura{indice}"
+                archivos[campo] = (f"{campo}.{mime.split('/')[-1]}", base64.b64decode(imagen), mime)
+                file_id = f"attach://{campo}"
+            medios.append({"type": "photo", "media": file_id})
+        
+        medios[0]["caption"] = leyenda
+        if parse_mode:
+            medios[0]["parse_mode"] = parse_mode
+        
+        datos = {"chat_id": chat_id, "disable_notification": str(disable_notification).lower()}
+        if len(medios) == 1:
+            # sendPhoto acepta el file_id directamente o el archivo en el campo 'photo'
+            datos.update({k: v for k, v in medios[0].items() if k not in ("type", "media")})
+            if archivos:
+                peticion = {"data": datos, "files": {"photo": next(iter(archivos.values()))}}
+            else:
+                peticion = {"data": dict(datos, photo=medios[0]["media"])}
+            resultado = self._llamar("sendPhoto", timeout=TIMEOUT_IMAGENES, **peticion)
+            mensajes = [resultado.get("respuesta")] if resultado["exito"] else []
+        else:
+            datos["media"] = json.dumps(medios, ensure_ascii=False)
+            resultado = self._llamar("sendMediaGroup", timeout=TIMEOUT_IMAGENES, data=datos, files=archivos or None)
+            mensajes = resultado.get("respuesta") or []
+        
+        if not resultado["exito"]:
+            if resultado.get("codigo") == 400:
+                # Un file_id caducado o de otro bot: el próximo intento vuelve a subir los bytes
+                for clave in claves:
+                    _cache_file_ids.invalidar(clave)
+            return resultado
+        
+        # La foto de mayor resolución es la última de cada mensaje; su file_id vale para cualquier chat del bot
+        for clave, mensaje_tg in zip(claves, mensajes):
+            fotos = mensaje_tg.get("photo") or []
+            if fotos:
+                _cache_file_ids.guardar(clave, fotos[-1]["file_id"])
+        
+        resultado.pop("respuesta", None)
+        resultado["message_ids"] = [m["message_id"] for m in mensajes]
+        resultado["subidas"] = len(archivos)
+        return resultado
+    
     def enviar_senal(self, analisis: str, activo: str, modo: str) -> Dict[str, any]:
         """
         Envía una señal de trading formateada a Telegram
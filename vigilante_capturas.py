@@ -0,0 +1,378 @@
+"""
+Vigilante de capturas MT5 para REDI7 IA
+Detecta sets nuevos en DIR_CAPTURAS en cuanto los scripts de MT5 los dejan, espera a que
+terminen de escribirse, los analiza y envía la señal a Telegram
+
+Uso:
+    python vigilante_capturas.py
+    python vigilante_capturas.py --activos XAUUSD NAS100 --debounce 1.5
+"""
+
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from analisis_lote import descubrir_sets
+from config import (
+    CAPITAL_DEFAULT,
+    DIR_ANALISIS,
+    DIR_CAPTURAS,
+    SALIDA_ESTRUCTURADA,
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_CHAT_ID,
+    VIGILANTE_COLA_POR_ACTIVO,
+    VIGILANTE_DEBOUNCE,
+    VIGILANTE_INTERVALO,
+    VIGILANTE_TRABAJADORES_POR_ACTIVO
+)
+from procesamiento_imagenes import preparar_imagenes
+from redi7_ai import REDI7AI
+from telegram_sender import TelegramSender
+
+# Etapas medidas desde la llegada del último archivo del set
+ETAPAS = ["deteccion", "espera_cola", "analisis", "telegram", "total"]
+
+# Muestras que se conservan por etapa para los percentiles
+MAX_MUESTRAS = 1000
+
+
+class MetricasLatencia:
+    """Latencias recientes por etapa (ventana acotada) y contadores del vigilante"""
+
+    def __init__(self):
+        self._muestras = {etapa: deque(maxlen=MAX_MUESTRAS) for etapa in ETAPAS}
+        self._lock = threading.Lock()
+        self.contadores = {"detectados": 0, "analizados": 0, "errores": 0, "enviados": 0, "descartados": 0}
+
+    def registrar(self, etapa: str, segundos: float):
+        with self._lock:
+            self._muestras[etapa].append(segundos)
+
+    def contar(self, contador: str):
+        with self._lock:
+            self.contadores[contador] += 1
+
+    def resumen(self) -> Dict:
+        """p50/p95/max por etapa en segundos"""
+        with self._lock:
+            resumen = {"contadores": dict(self.contadores)}
+            for etapa, muestras in self._muestras.items():
+                if muestras:
+                    valores = np.fromiter(muestras, dtype=np.float64)
+                    resumen[etapa] = {
+                        "n": len(valores),
+                        "p50": round(float(np.percentile(valores, 50)), 2),
+                        "p95": round(float(np.percentile(valores, 95)), 2),
+                        "max": round(float(valores.max()), 2)
+                    }
+            return resumen
+
+
+class VigilanteCapturas:
+    """Sondea DIR_CAPTURAS y reparte los sets listos en colas acotadas por activo"""
+
+    def __init__(
+        self,
+        api_key: str,
+        directorio: str = DIR_CAPTURAS,
+        activos: Optional[List[str]] = None,
+        intervalo: float = 1.0,
+        debounce: float = 2.0,
+        cola_por_activo: int = 3,
+        trabajadores_por_activo: int = 1,
+        capital: float = CAPITAL_DEFAULT,
+        riesgo_porcentaje: float = 1.0,
+        telegram: Optional[TelegramSender] = None,
+        ruta_salida: Optional[str] = None
+    ):
+        """
+        Args:
+            api_key: Clave de OpenAI
+            directorio: Carpeta raíz de capturas (ACTIVO/MODO/...)
+            activos: Limitar a estos activos (por defecto todos los permitidos)
+            intervalo: Segundos entre sondeos del directorio
+            debounce: Segundos sin cambios en el set antes de darlo por escrito
+            cola_por_activo: Sets pendientes por activo; al llenarse se descarta el más antiguo
+            trabajadores_por_activo: Análisis simultáneos por activo
+            capital: Capital para la gestión de riesgo
+            riesgo_porcentaje: Riesgo por operación
+            telegram: Sender para las señales (None = no enviar)
+            ruta_salida: JSONL donde registrar cada análisis (None = no guardar)
+        """
+        self.motor = REDI7AI(api_key=api_key)
+        self.directorio = directorio
+        self.activos = activos or list(REDI7AI.ACTIVOS_PERMITIDOS)
+        self.intervalo = intervalo
+        self.debounce = debounce
+        self.trabajadores_por_activo = trabajadores_por_activo
+        self.capital = capital
+        self.riesgo_porcentaje = riesgo_porcentaje
+        self.telegram = telegram
+        self.ruta_salida = ruta_salida
+        self.metricas = MetricasLatencia()
+
+        self.colas = {activo: queue.Queue(maxsize=cola_por_activo) for activo in self.activos}
+        self._vistos: Dict[str, str] = {}        # id -> firma ya despachada
+        self._candidatos: Dict[str, str] = {}    # id -> firma del sondeo anterior
+        self._detener = threading.Event()
+        self._hilos: List[threading.Thread] = []
+        self._lock_salida = threading.Lock()
+
+    # ━━━━━━━━━━━━━━━━━━━━━━
+    # 🔍 DETECCIÓN
+    # ━━━━━━━━━━━━━━━━━━━━━━
+
+    def marcar_existentes(self):
+        """Da por procesados los sets que ya estaban al arrancar (solo interesan los nuevos)"""
+        for item in descubrir_sets(self.directorio, self.activos):
+            self._vistos[item["id"]] = item["firma"]
+
+    def sondear(self):
+        """Un sondeo: despacha los sets nuevos o modificados que llevan `debounce` segundos estables"""
+        ahora = time.time()
+        for item in descubrir_sets(self.directorio, self.activos):
+            if self._vistos.get(item["id"]) == item["firma"]:
+                continue
+
+            # Debounce: misma firma en dos sondeos y último archivo con antigüedad suficiente
+            if self._candidatos.get(item["id"]) != item["firma"]:
+                self._candidatos[item["id"]] = item["firma"]
+                continue
+            try:
+                llegada = max(os.path.getmtime(ruta) for ruta in item["archivos"])
+            except OSError as e:
+                # MT5 o una limpieza lo borró tras el listado: se reevalúa en el próximo sondeo
+                print(f"⚠️ Set {item['id']} no disponible: {e}")
+                del self._candidatos[item["id"]]
+                continue
+            if ahora - llegada < self.debounce:
+                continue
+
+            del self._candidatos[item["id"]]
+            self._vistos[item["id"]] = item["firma"]
+            item["llegada"] = llegada
+            item["detectado"] = ahora
+            self.metricas.contar("detectados")
+            self.metricas.registrar("deteccion", ahora - llegada)
+            self._encolar(item)
+
+    def _encolar(self, item: Dict):
+        """Encola sin bloquear el sondeo: si la cola del activo está llena, sale el set más viejo"""
+        cola = self.colas[item["activo"]]
+        while True:
+            try:
+                cola.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    descartado = cola.get_nowait()
+                    cola.task_done()
+                    self.metricas.contar("descartados")
+                    print(f"⚠️ Cola de {item['activo']} llena: se descarta el set {descartado['id']} (ya no es la última vela)")
+                except queue.Empty:
+                    pass
+
+    # ━━━━━━━━━━━━━━━━━━━━━━
+    # ⚙️ TRABAJADORES
+    # ━━━━━━━━━━━━━━━━━━━━━━
+
+    def _trabajador(self, activo: str):
+        cola = self.colas[activo]
+        while not self._detener.is_set():
+            try:
+                item = cola.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._procesar(item)
+            except Exception as e:
+                self.metricas.contar("errores")
+                print(f"❌ Error procesando {item['id']}: {e}")
+            finally:
+                cola.task_done()
+
+    def _procesar(self, item: Dict):
+        """Analiza un set y envía la señal, midiendo cada etapa"""
+        inicio = time.time()
+        self.metricas.registrar("espera_cola", inicio - item["detectado"])
+
+        datos = []
+        for ruta in item["archivos"]:
+            with open(ruta, "rb") as f:
+                datos.append(f.read())
+        preparadas = preparar_imagenes(datos, item["detail_levels"])
+
+        resultado = self.motor.analizar_con_imagenes(
+            activo=item["activo"],
+            modo=item["modo"],
+            capital=self.capital,
+            riesgo_porcentaje=self.riesgo_porcentaje,
+            horario_actual=datetime.fromtimestamp(item["llegada"]).strftime("%H:%M"),
+            imagenes_base64=preparadas["imagenes_base64"],
+            mime_types=preparadas["mime_types"],
+            detail_levels=item["detail_levels"],
+            dispositivo=item["dispositivo"],
+            temporalidades=item["temporalidades"],
+            salida_estructurada=SALIDA_ESTRUCTURADA
+        )
+        fin_analisis = time.time()
+        self.metricas.registrar("analisis", fin_analisis - inicio)
+
+        envio = None
+        if resultado["error"]:
+            self.metricas.contar("errores")
+            print(f"❌ {item['activo']} {item['id']}: {resultado['mensaje']}")
+        else:
+            self.metricas.contar("analizados")
+            if self.telegram:
+                envio = self.telegram.enviar_mensaje(self._mensaje_telegram(resultado), parse_mode=None)
+                self.metricas.registrar("telegram", time.time() - fin_analisis)
+                if envio["exito"]:
+                    self.metricas.contar("enviados")
+
+        total = time.time() - item["llegada"]
+        self.metricas.registrar("total", total)
+        if not resultado["error"]:
+            estado_tg = "" if envio is None else (" → 📱 enviado" if envio["exito"] else f" → ⚠️ Telegram: {envio['mensaje']}")
+            print(f"✅ {item['activo']} {item['modo']} {item['id']} en {total:.1f}s desde la captura{estado_tg}")
+
+        self._guardar(item, resultado, envio, total)
+
+    def _mensaje_telegram(self, resultado: Dict) -> str:
+        """Mismo formato que el envío automático del dashboard"""
+        analisis_principal = resultado["analisis"].split("📉GESTIÓN DE RIESGO REDI7📉")[0].strip()
+        return f"🚀 SEÑAL REDI7 AI\n\n📊 Activo: {resultado['activo']}\n⚡ Modo: {resultado['modo']}\n\n{analisis_principal}"
+
+    def _guardar(self, item: Dict, resultado: Dict, envio: Optional[Dict], total: float):
+        if not self.ruta_salida:
+            return
+        registro = {
+            "id": item["id"],
+            "firma": item["firma"],
+            "activo": item["activo"],
+            "modo": item["modo"],
+            "procesado": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "latencia_total_s": round(total, 2),
+            "error": bool(resultado.get("error")),
+            "mensaje": resultado.get("mensaje", ""),
+            "senal": resultado.get("senal"),
+            "gestion": resultado.get("gestion"),
+            "analisis": resultado.get("analisis", ""),
+            "telegram": envio
+        }
+        with self._lock_salida:
+            with open(self.ruta_salida, "a", encoding="utf-8") as f:
+                f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+    # ━━━━━━━━━━━━━━━━━━━━━━
+    # ▶️ CICLO DE VIDA
+    # ━━━━━━━━━━━━━━━━━━━━━━
+
+    def iniciar(self):
+        """Arranca los trabajadores de cada activo"""
+        if self.ruta_salida:
+            os.makedirs(os.path.dirname(os.path.abspath(self.ruta_salida)), exist_ok=True)
+        for activo in self.activos:
+            for i in range(self.trabajadores_por_activo):
+                hilo = threading.Thread(target=self._trabajador, args=(activo,), name=f"vigilante-{activo}-{i}", daemon=True)
+                hilo.start()
+                self._hilos.append(hilo)
+
+    def ejecutar(self, intervalo_resumen: float = 60.0):
+        """Bucle de sondeo hasta Ctrl+C; imprime las métricas cada `intervalo_resumen` segundos"""
+        self.iniciar()
+        ultimo_resumen = time.monotonic()
+        try:
+            while not self._detener.is_set():
+                try:
+                    self.sondear()
+                except OSError as e:
+                    # Carpetas que desaparecen a mitad del listado: el vigilante sigue sondeando
+                    print(f"⚠️ Error en el sondeo de {self.directorio}: {e}")
+                if time.monotonic() - ultimo_resumen >= intervalo_resumen:
+                    self.imprimir_metricas()
+                    ultimo_resumen = time.monotonic()
+                self._detener.wait(self.intervalo)
+        except KeyboardInterrupt:
+            print("\n⏹️ Deteniendo vigilante...")
+        finally:
+            self.detener()
+            self.imprimir_metricas()
+
+    def detener(self):
+        self._detener.set()
+        for hilo in self._hilos:
+            hilo.join(timeout=5)
+
+    def imprimir_metricas(self):
+        resumen = self.metricas.resumen()
+        pendientes = {activo: cola.qsize() for activo, cola in self.colas.items() if cola.qsize()}
+        print(f"📊 {resumen['contadores']} | en cola: {pendientes or 0}")
+        for etapa in ETAPAS:
+            if etapa in resumen:
+                m = resumen[etapa]
+                print(f"   {etapa:<12} n={m['n']:<5} p50={m['p50']:>6}s  p95={m['p95']:>6}s  max={m['max']:>6}s")
+
+
+def main():
+    """Punto de entrada de la línea de comandos"""
+    parser = argparse.ArgumentParser(description="REDI7 IA - Vigilante de capturas MT5")
+    parser.add_argument("--directorio", default=DIR_CAPTURAS, help="Carpeta raíz de capturas (ACTIVO/MODO/...)")
+    parser.add_argument("--activos", nargs="*", help="Limitar a estos activos")
+    parser.add_argument("--intervalo", type=float, default=VIGILANTE_INTERVALO, help="Segundos entre sondeos")
+    parser.add_argument("--debounce", type=float, default=VIGILANTE_DEBOUNCE, help="Segundos estables antes de analizar")
+    parser.add_argument("--cola", type=int, default=VIGILANTE_COLA_POR_ACTIVO, help="Sets pendientes por activo")
+    parser.add_argument("--trabajadores", type=int, default=VIGILANTE_TRABAJADORES_POR_ACTIVO, help="Análisis simultáneos por activo")
+    parser.add_argument("--capital", type=float, default=CAPITAL_DEFAULT, help="Capital para la gestión de riesgo")
+    parser.add_argument("--riesgo", type=float, default=1.0, help="Riesgo por operación en %% (1-5)")
+    parser.add_argument("--procesar-existentes", action="store_true", help="Analizar también los sets que ya estaban")
+    parser.add_argument("--sin-telegram", action="store_true", help="No enviar señales a Telegram")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("👁️ REDI7 IA - Vigilante de Capturas")
+    print("=" * 60)
+
+    api_key = os.getenv("OPENAI_API_KEY", "")
+    if not api_key:
+        print("⚠️  Configura OPENAI_API_KEY en las variables de entorno")
+        return
+
+    telegram = None
+    if not args.sin_telegram:
+        if TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID:
+            telegram = TelegramSender(TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID)
+        else:
+            print("ℹ️ TELEGRAM_BOT_TOKEN/TELEGRAM_CHAT_ID no configurados: solo se guardarán los análisis")
+
+    vigilante = VigilanteCapturas(
+        api_key,
+        directorio=args.directorio,
+        activos=[a.upper() for a in args.activos] if args.activos else None,
+        intervalo=args.intervalo,
+        debounce=args.debounce,
+        cola_por_activo=max(1, args.cola),
+        trabajadores_por_activo=max(1, args.trabajadores),
+        capital=args.capital,
+        riesgo_porcentaje=args.riesgo,
+        telegram=telegram,
+        ruta_salida=os.path.join(DIR_ANALISIS, "vigilante.jsonl")
+    )
+
+    if not args.procesar_existentes:
+        vigilante.marcar_existentes()
+
+    print(f"📂 Vigilando '{args.directorio}' cada {args.intervalo}s (debounce {args.debounce}s). Ctrl+C para salir.")
+    vigilante.ejecutar()
+
+
+if __name__ == "__main__":
+    main()